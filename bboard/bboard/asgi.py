@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bboard.settings')
+# под ASGI страницы, только читающие данные, выводят асинхронные контроллеры
+os.environ.setdefault('BBOARD_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -45,6 +45,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # замеры обработки запросов, должен быть первым
+    'main.middlewares.RequestTimingMiddleware',
+    # чтение с основной БД после записи
+    'main.middlewares.ReplicaStickinessMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -58,7 +62,9 @@ ROOT_URLCONF = 'bboard.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # шаблонизатор Django с замером времени рендеринга шаблонов
+        'BACKEND': 'main.instrumentation.TimedDjangoTemplates',
+        'NAME': 'django',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -75,17 +81,96 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'bboard.wsgi.application'
 
+# асинхронные контроллеры страниц, только читающих данные (main.async_views);
+# включаются в bboard/asgi.py, под WSGI используются синхронные контроллеры
+ASYNC_VIEWS = os.environ.get('BBOARD_ASYNC_VIEWS') == '1'
+
 
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
+# Профили подключения к SQLite, выбираются переменной окружения
+# BBOARD_DATABASE_PROFILE. Профиль 'production': журнал WAL (читатели не
+# ждут писателей), ожидание снятия блокировки вместо ошибки "database is
+# locked", транзакции BEGIN IMMEDIATE и постоянные подключения. Ключи
+# PRAGMAS и IMMEDIATE_TRANSACTIONS обрабатывает main.dbprofile.
+DATABASE_PROFILES = {
+    'default': {},
+    'production': {
+        'CONN_MAX_AGE': 600,
+        # ожидание блокировки, с
+        'OPTIONS': {'timeout': 20},
+        'PRAGMAS': {
+            'journal_mode': 'WAL',
+            'busy_timeout': 20000,
+            # в режиме WAL NORMAL не теряет целостность при сбое
+            'synchronous': 'NORMAL',
+            'mmap_size': 256 * 1024 * 1024,
+            # отрицательное значение - размер кэша страниц в килобайтах
+            'cache_size': -20000,
+            'temp_store': 'MEMORY',
+        },
+        'IMMEDIATE_TRANSACTIONS': True,
+    },
+}
+
+DATABASE_PROFILE = os.environ.get('BBOARD_DATABASE_PROFILE', 'default')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'bboard.data',
+        **DATABASE_PROFILES[DATABASE_PROFILE],
+    }
+}
+
+# Реплики для чтения: пути к копиям файла БД через запятую в переменной
+# окружения BBOARD_DATABASE_REPLICAS. Локально копии обновляет команда
+# sync_replicas, при работе с другой СУБД сюда вписываются настройки
+# подключения к ее репликам. Чем больше реплик, тем больше запросов
+# на чтение может обслужить сайт.
+DATABASE_REPLICAS = []
+for i, name in enumerate(filter(None, os.environ.get('BBOARD_DATABASE_REPLICAS', '').split(','))):
+    alias = 'replica%s' % (i + 1)
+    DATABASES[alias] = {**DATABASES['default'], 'NAME': name.strip(),
+            'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['main.routers.ReplicaRouter']
+
+# сколько секунд после записи в БД пользователь читает с основной БД, а не
+# с реплик (должно быть больше задержки обновления реплик)
+REPLICA_STICKY_SECONDS = 10
+REPLICA_STICKY_COOKIE = 'primary_db'
+
+
+# Кэш. Локальная память годится для одного процесса; если сайт обслуживают
+# несколько рабочих процессов, следует указать общий бэкенд (файловый,
+# memcached и т.п.), чтобы кэшированные данные и их сброс были общими.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bboard',
     }
 }
 
+# время хранения кэшированных страниц для гостей, в секундах; устаревшие
+# страницы вытесняются сменой поколения (main.caching), а не по времени
+PAGE_CACHE_TIMEOUT = 60 * 60
+
+# количество результатов общего поиска (списков ключей найденных объявлений),
+# хранимых в памяти каждого процесса; самые давно запрошенные вытесняются
+SEARCH_CACHE_SIZE = 256
+
+# пул заданий captcha для комментариев гостей (main.captchas): количество
+# действительных заданий, пополняемое фоновой задачей, и срок действия
+# задания пула, мин. Выданное посетителю задание остается действительным
+# еще не менее CAPTCHA_GET_FROM_POOL_TIMEOUT минут
+CAPTCHA_GET_FROM_POOL = True
+CAPTCHA_GET_FROM_POOL_TIMEOUT = 10
+CAPTCHA_POOL_SIZE = 1000
+CAPTCHA_POOL_LIFETIME = 24 * 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -133,8 +218,17 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'main.AdvUser'
 
 # TCP порт для отладочного smtp-сервера
+# (запуск: python -m aiosmtpd -n -l localhost:1025)
 EMAIL_PORT = 1025
 
+# очередь писем с требованием активации (main.mailing): размер пакета,
+# отправляемого через одно соединение, максимальное число попыток, задержка
+# перед первой повторной попыткой и время аренды пакета, в секундах
+ACTIVATION_MAIL_BATCH_SIZE = 100
+ACTIVATION_MAIL_MAX_ATTEMPTS = 5
+ACTIVATION_MAIL_RETRY_DELAY = 60
+ACTIVATION_MAIL_LEASE = 600
+
 # директория и интернет-адрес изображений и миниатюр объявлений
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
@@ -150,3 +244,25 @@ THUMBNAIL_ALIASES = {
             },
         }
 
+# количество рабочих потоков в пулах фоновых задач (main.background);
+# 0 - задачи пула выполняются сразу, в потоке запроса
+BACKGROUND_WORKERS = {
+        'default': 2,
+        'thumbnails': 2,
+        'mail': 1,
+        'variants': 1,
+        }
+
+# количество процессов, создающих уменьшенные копии изображений для страниц
+# объявлений (main.variants); 0 - копии создаются в потоке пула 'variants'
+VARIANT_PROCESSES = 2
+
+
+# режим пагинации списка объявлений рубрики: 'pages' - нумерованные страницы,
+# 'keyset' - порции по курсору с подгрузкой при прокрутке
+BBS_PAGINATION_MODE = 'pages'
+
+# выводить ли замеры обработки запроса в заголовке Server-Timing (видны
+# в инструментах разработчика браузера); по умолчанию только в режиме
+# отладки, чтобы сайт, открытый для всех, не раскрывал замеры
+SERVER_TIMING = DEBUG
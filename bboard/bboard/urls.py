@@ -14,16 +14,21 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
 from django.contrib.staticfiles.views import serve
 from django.views.decorators.cache import never_cache
+from main.views import pooled_captcha_image
 
 # импорт для приложения содания миниатюр thumbnails
 from django.conf.urls.static import static
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    # изображения заданий captcha из пула, по тем же адресам, что и у
+    # django-simple-captcha
+    re_path(r'^captcha/image/(?P<key>\w+)/$', pooled_captcha_image, {'scale': 1}),
+    re_path(r'^captcha/image/(?P<key>\w+)@2/$', pooled_captcha_image, {'scale': 2}),
     path('captcha/', include('captcha.urls')),
     path('', include('main.urls')),
 ]
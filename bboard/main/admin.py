@@ -3,7 +3,8 @@ import datetime
 # импорты для редактора пользователей
 from django.contrib import admin
 from .models import AdvUser
-from .utilities import send_activation_notification
+from .mailing import enqueue_activation_letters
+from .deletion import delete_bbs, delete_users
 
 # импорты для редакторов надрубрик и подрубрик
 from .models import SuperRubric, SubRubric
@@ -12,14 +13,16 @@ from .forms import SubRubricForm
 # импорт для редакторов объявлений и дополнительных иллюстраций
 from .models import Bb, AdditionalImage
 
+# импорт для просмотра очереди писем активации
+from .models import ActivationLetter
+
 def send_activation_notifications(modeladmin, request, queryset):
     """
-    Отправляет письма с требованием активации всем пользователям из списка.
+    Ставит в очередь письма с требованием активации всем пользователям из
+    списка. Письма отправляются в фоне одним пакетом.
     """
-    for rec in queryset:
-        if not rec.is_activated:
-            send_activation_notification(rec)
-    modeladmin.message_user(request, 'Письма с требованиями отправлены')
+    enqueue_activation_letters(queryset.filter(is_activated=False))
+    modeladmin.message_user(request, 'Письма с требованиями поставлены в очередь')
 send_activation_notifications.short_description = 'Отправки писем с требованиями активации'
 
 
@@ -76,6 +79,12 @@ class AdvUserAdmin(admin.ModelAdmin):
     readonly_fields = ('last_login', 'date_joined')
     actions = (send_activation_notifications,)
 
+    def delete_queryset(self, request, queryset):
+        """
+        Массовое удаление пользователей вместе с их объявлениями.
+        """
+        delete_users(queryset)
+
 
 class SubRubricInline(admin.TabularInline):
     """
@@ -115,6 +124,21 @@ class BbAdmin(admin.ModelAdmin):
             'image', 'is_active')
     inlines = (AdditionalImageInline,)
 
+    def delete_queryset(self, request, queryset):
+        """
+        Массовое удаление выбранных объявлений несколькими запросами.
+        """
+        delete_bbs(queryset)
+
+
+
+class ActivationLetterAdmin(admin.ModelAdmin):
+    """
+    Просмотр очереди писем с требованием активации.
+    """
+    list_display = ('user', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+    readonly_fields = ('user', 'attempts', 'batch', 'last_error', 'created_at', 'sent_at')
 
 
 # строка регистрации типов пользователей
@@ -128,3 +152,6 @@ admin.site.register(SubRubric, SubRubricAdmin)
 
 # строка регистрации редактора объявлений + встроенный редактор доп. изображений
 admin.site.register(Bb, BbAdmin)
+
+# строка регистрации просмотра очереди писем активации
+admin.site.register(ActivationLetter, ActivationLetterAdmin)
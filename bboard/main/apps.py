@@ -1,6 +1,5 @@
 from django.apps import AppConfig
 from django.dispatch import Signal
-from .utilities import send_activation_notification
 
 
 class MainConfig(AppConfig):
@@ -8,10 +7,35 @@ class MainConfig(AppConfig):
     name = 'main'
     verbose_name = 'Доска объявлений'
 
+    def ready(self):
+        # подключение обработчиков сигналов моделей
+        from . import signals
+        user_registered.connect(user_registered_dispatcher)
+        # прагмы и режим транзакций SQLite из профиля подключения
+        from django.db.backends.signals import connection_created
+        from .dbprofile import configure_sqlite
+        connection_created.connect(configure_sqlite)
+        # замер SQL-запросов посредником RequestTimingMiddleware
+        from .instrumentation import install_query_timer
+        connection_created.connect(install_query_timer)
+        # список информационных страничек составляется при запуске
+        from .pages import get_pages
+        get_pages()
+
 # user_regidstered = Signal(providing_args=['instance'])
 # странно, в нашем варианте Django такого ключевого параметра (providing_args) нет...
 
 user_registered = Signal(use_caching=['instance'])
 
+# сигнал массового удаления объявлений, отправляется вместо post_delete
+# для каждого объявления; параметр pks - список ключей удаленных объявлений,
+# rubrics - рубрики, в списках которых выводились удаленные объявления
+bbs_deleted = Signal()
+
 def user_registered_dispatcher(sender, **kwargs):
-    send_activation_notification(kwargs['instance'])
+    """
+    Письмо с требованием активации ставится в очередь и отправляется в фоне,
+    регистрация не ждет ответа почтового сервера.
+    """
+    from .mailing import enqueue_activation_letters
+    enqueue_activation_letters([kwargs['instance']])
@@ -0,0 +1,148 @@
+# Асинхронные варианты контроллеров, только читающих данные; используются
+# при работе под ASGI (настройка ASYNC_VIEWS), синхронные контроллеры из
+# views.py остаются для WSGI. В Django 4.0 нет асинхронного ORM, поэтому
+# обращения к БД и отрисовка шаблонов выполняются в синхронных
+# контроллерах через sync_to_async(), одним переходом в поток на запрос.
+# Асинхронно, без перехода в поток, обслуживаются страницы, которые уже
+# есть в кэше, - основная доля запросов гостей. Так же, до перехода в
+# поток, читается дерево рубрик для обработчика контекста. Так читается
+# только кэш в памяти процесса; чтение из внешнего кэша (файлы,
+# memcached) блокировало бы цикл событий и выполняется в потоке.
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.urls import path
+from django.utils.cache import get_conditional_response
+
+from . import views
+from .caching import get_cached_rubric_tree, get_rubric_tree, page_cache_key
+from .pages import get_page_template, get_rendered_page
+
+
+def is_plain_guest(request):
+    """
+    Гость без всплывающих сообщений: у него нет cookie сессии и cookie
+    сообщений. Проверка не загружает сессию из БД.
+    """
+    return (settings.SESSION_COOKIE_NAME not in request.COOKIES
+            and CookieStorage.cookie_name not in request.COOKIES)
+
+
+# хранилища кэша в памяти процесса, чтение из которых не ждет ввода-вывода
+IN_PROCESS_CACHES = (
+        'django.core.cache.backends.locmem.LocMemCache',
+        'django.core.cache.backends.dummy.DummyCache',
+        )
+
+
+def cache_in_process():
+    return settings.CACHES['default']['BACKEND'] in IN_PROCESS_CACHES
+
+
+async def read_cache(func, *args):
+    """
+    Выполняет чтение из кэша func(*args): сразу, если кэш в памяти
+    процесса, иначе в потоке, не блокируя цикл событий.
+    """
+    if cache_in_process():
+        return func(*args)
+    return await sync_to_async(func)(*args)
+
+
+async def get_rubric_tree_async():
+    """
+    Дерево рубрик из памяти процесса или из кэша (см. read_cache()).
+    Построение дерева по БД выполняется в потоке.
+    """
+    tree = await read_cache(get_cached_rubric_tree)
+    if tree is None:
+        tree = await sync_to_async(get_rubric_tree)()
+    return tree
+
+
+async def run_sync_view(view, request, *args, **kwargs):
+    """
+    Выполняет синхронный контроллер view в потоке. Дерево рубрик для
+    обработчика контекста читается заранее, асинхронно.
+    """
+    request.rubric_tree = await get_rubric_tree_async()
+    return await sync_to_async(view)(request, *args, **kwargs)
+
+
+def get_cached_page(request, view, kwargs):
+    return cache.get(page_cache_key(request, view.__name__, kwargs, view.rubric_kwarg))
+
+
+def cached_page_view(view):
+    """
+    Асинхронный контроллер для синхронного контроллера view, снабженного
+    декоратором cache_anonymous_page: страница, найденная в кэше, выдается
+    гостю сразу, иначе выполняется view (он же кэширует страницу).
+    """
+    async def wrapper(request, *args, **kwargs):
+        if request.method == 'GET' and is_plain_guest(request):
+            response = await read_cache(get_cached_page, request, view, kwargs)
+            if response is not None:
+                return response
+        return await run_sync_view(view, request, *args, **kwargs)
+    wrapper.__name__ = view.__name__
+    wrapper.__doc__ = view.__doc__
+    return wrapper
+
+
+index = cached_page_view(views.index)
+by_rubric = cached_page_view(views.by_rubric)
+by_rubric_more = cached_page_view(views.by_rubric_more)
+search = cached_page_view(views.search)
+
+
+async def detail(request, rubric_pk, pk):
+    """
+    Страничка объявления с комментариями и формой комментария (с токеном
+    CSRF), поэтому не кэшируется и целиком выводится синхронным
+    контроллером.
+    """
+    return await run_sync_view(views.detail, request, rubric_pk, pk)
+
+
+async def other_page(request, page):
+    """
+    Информационная страничка. Гостю страничка, уже отрисованная при
+    текущих версиях дерева рубрик и количества объявлений в них, выдается
+    из памяти (с проверкой ETag).
+    """
+    if get_page_template(page) is not None and is_plain_guest(request):
+        # версия странички хранится в кэше
+        rendered = await read_cache(get_rendered_page, page)
+        if rendered is not None:
+            content, etag = rendered
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = HttpResponse(content)
+            response['ETag'] = etag
+            return response
+    return await run_sync_view(views.other_page, request, page)
+
+
+# асинхронные контроллеры по именам маршрутов main.urls
+ASYNC_VIEWS = {
+        'index': index,
+        'by_rubric': by_rubric,
+        'by_rubric_more': by_rubric_more,
+        'search': search,
+        'detail': detail,
+        'other': other_page,
+        }
+
+
+def use_async_views(urlpatterns):
+    """
+    Копия списка маршрутов, в которой контроллеры из ASYNC_VIEWS заменены
+    асинхронными.
+    """
+    return [path(str(pattern.pattern), ASYNC_VIEWS[pattern.name], name=pattern.name)
+            if pattern.name in ASYNC_VIEWS else pattern
+            for pattern in urlpatterns]
@@ -0,0 +1,74 @@
+# Фоновое выполнение задач вне потока обработки запроса
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from loguru import logger
+
+# пулы рабочих потоков, создаются при первой отправке задачи
+_executors = {}
+_executors_lock = threading.Lock()
+
+THREAD_NAME_PREFIX = 'bboard-'
+
+
+def get_pool_size(pool):
+    """
+    Размер пула берется из настройки BACKGROUND_WORKERS, для пулов, не
+    упомянутых в ней, - размер пула 'default'. Ноль означает, что задачи
+    пула выполняются сразу, в вызывающем потоке (удобно в тестах).
+    """
+    workers = settings.BACKGROUND_WORKERS
+    return workers.get(pool, workers.get('default', 0))
+
+
+def get_executor(pool):
+    with _executors_lock:
+        if pool not in _executors:
+            _executors[pool] = ThreadPoolExecutor(
+                    max_workers=get_pool_size(pool),
+                    thread_name_prefix=THREAD_NAME_PREFIX + pool
+                    )
+        return _executors[pool]
+
+
+def run_task(func, *args):
+    """
+    Выполняет задачу, записывая в журнал возникшие исключения. Соединения
+    с БД, открытые рабочим потоком, закрываются по окончании задачи.
+    """
+    try:
+        return func(*args)
+    except Exception:
+        logger.exception(f'background task {func.__name__} failed')
+    finally:
+        if in_worker_thread():
+            connections.close_all()
+
+
+def in_worker_thread():
+    """
+    Соединения закрываются только в рабочих потоках пулов, но не в потоке
+    запроса, где задача могла выполниться сразу.
+    """
+    return threading.current_thread().name.startswith(THREAD_NAME_PREFIX)
+
+
+def submit(func, *args, pool='default'):
+    """
+    Отправляет задачу в пул рабочих потоков pool.
+    """
+    if get_pool_size(pool) <= 0:
+        run_task(func, *args)
+        return None
+    return get_executor(pool).submit(run_task, func, *args)
+
+
+def submit_on_commit(func, *args, pool='default'):
+    """
+    Отправляет задачу в пул после фиксации текущей транзакции, чтобы задача
+    увидела сохраненные данные.
+    """
+    transaction.on_commit(lambda: submit(func, *args, pool=pool))
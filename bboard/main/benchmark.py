@@ -0,0 +1,483 @@
+# Замеры производительности контроллеров: каждый маршрут из main.urls
+# запрашивается тестовым клиентом несколько раз, для него вычисляются
+# перцентили времени ответа, количество SQL-запросов и пиковый объем
+# памяти, выделенной при обработке запроса.
+
+import asyncio
+import io
+import math
+import os
+import platform
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import django
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management import call_command
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import (CaptureQueriesContext, setup_test_environment,
+        teardown_test_environment, override_settings)
+from django.urls import include, path, reverse
+
+from .models import AdvUser, Bb
+from .facets import price_bucket
+
+PERCENTILES = (50, 95, 99)
+
+
+class Scenario:
+    """
+    Запрос к одному маршруту: имя сценария, адрес, метод, данные POST и
+    признак того, что запрос выполняется от имени зарегистрированного
+    пользователя. Имя маршрута route по умолчанию совпадает с именем
+    сценария.
+
+    Сценарии, изменяющие и удаляющие записи, получают свежую запись перед
+    каждым запросом: ее создает функция fixture(client) до запуска
+    таймера, а адрес и данные POST таких сценариев - функции этой записи.
+    Функция setup(client) выполняется один раз для клиента сценария.
+    """
+    def __init__(self, name, url, method='get', data=None, login=False,
+            relogin=False, route=None, fixture=None, setup=None):
+        self.name = name
+        self.route = route or name
+        self.url = url
+        self.method = method
+        self.data = data
+        self.login = login
+        # вход перед каждым запросом (нужен для замера выхода из системы)
+        self.relogin = relogin
+        self.fixture = fixture
+        self.setup = setup
+
+    def prepare(self, client):
+        """
+        Свежая запись для очередного запроса или None.
+        """
+        return self.fixture(client) if self.fixture else None
+
+    def request(self, client, fixture=None):
+        url = self.url(fixture) if callable(self.url) else self.url
+        if self.method == 'post':
+            response = client.post(url, self.data(fixture) if callable(self.data) else self.data)
+        else:
+            response = client.get(url)
+        if response.streaming:
+            # содержимое потокового ответа формируется при чтении
+            b''.join(response.streaming_content)
+        return response
+
+
+def percentile(values, p):
+    """
+    Перцентиль p (0-100) по методу ближайшего ранга.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))
+    return values[rank]
+
+
+def bb_add_data(user, bb):
+    """
+    Данные формы добавления объявления вместе с пустым набором форм
+    дополнительных иллюстраций.
+    """
+    return {
+            'rubric': bb.rubric_id,
+            'title': 'Замер',
+            'content': 'Объявление, добавленное при замере',
+            'price': 100,
+            'contacts': 'бенчмарк',
+            'author': user.pk,
+            'is_active': 'on',
+            'additionalimage_set-TOTAL_FORMS': 0,
+            'additionalimage_set-INITIAL_FORMS': 0,
+            }
+
+
+def copy_bb(bb):
+    """
+    Копия объявления bb того же автора - свежая запись для сценариев,
+    изменяющих и удаляющих объявление.
+    """
+    return Bb.objects.create(rubric_id=bb.rubric_id, author_id=bb.author_id,
+            title=bb.title, content=bb.content, price=bb.price, contacts=bb.contacts)
+
+
+def fresh_user(client):
+    """
+    Новый пользователь, от имени которого входит клиент, - свежая запись
+    для сценариев, изменяющих и удаляющих учетную запись. Пароль не
+    задается, чтобы не тратить время на его хеширование.
+    """
+    user = AdvUser.objects.create_user('benchmark-%s' % uuid.uuid4().hex[:12])
+    client.force_login(user)
+    return user
+
+
+def login_staff(client):
+    """
+    Вход от имени сотрудника - для страниц, доступных только персоналу.
+    """
+    staff, created = AdvUser.objects.get_or_create(username='benchmark-staff',
+            defaults={'is_staff': True})
+    client.force_login(staff)
+
+
+def user_change_data(user):
+    return {'username': user.username, 'email': '%s@example.com' % user.username,
+            'first_name': 'Замер', 'last_name': '', 'send_messages': 'on'}
+
+
+def default_scenarios(user, bb):
+    """
+    Сценарии для всех маршрутов main.urls. Объявление bb должно
+    принадлежать пользователю user. Каждый сценарий выполняется своим
+    клиентом, поэтому выход из системы не затрагивает остальные.
+    """
+    rubric_pk = bb.rubric_id
+    keyword = bb.title.split()[0]
+    return [
+            Scenario('index', reverse('main:index')),
+            Scenario('by_rubric', reverse('main:by_rubric', kwargs={'pk': rubric_pk})),
+            Scenario('by_rubric_keyword', '%s?keyword=%s' % (
+                reverse('main:by_rubric', kwargs={'pk': rubric_pk}), keyword),
+                route='by_rubric'),
+            Scenario('by_rubric_price', '%s?bucket=%s&sort=price' % (
+                reverse('main:by_rubric', kwargs={'pk': rubric_pk}), price_bucket(bb.price)),
+                route='by_rubric'),
+            Scenario('search', '%s?keyword=%s' % (reverse('main:search'), keyword)),
+            Scenario('by_rubric_page_2', '%s?page=2' % reverse(
+                'main:by_rubric', kwargs={'pk': rubric_pk}), route='by_rubric'),
+            Scenario('by_rubric_more', reverse('main:by_rubric_more', kwargs={'pk': rubric_pk})),
+            Scenario('detail', reverse('main:detail',
+                kwargs={'rubric_pk': rubric_pk, 'pk': bb.pk})),
+            Scenario('comments_more', reverse('main:comments_more',
+                kwargs={'rubric_pk': rubric_pk, 'pk': bb.pk})),
+            Scenario('other', reverse('main:other', kwargs={'page': 'about'})),
+            Scenario('export_bbs', '%s?rubric=%s' % (reverse('main:export_bbs'), rubric_pk)),
+            Scenario('perf_stats', reverse('main:perf_stats'), setup=login_staff),
+            Scenario('login', reverse('main:login')),
+            Scenario('register', reverse('main:register')),
+            Scenario('register_done', reverse('main:register_done')),
+            Scenario('register_activate', reverse('main:register_activate',
+                kwargs={'sign': 'bad-signature'})),
+            Scenario('profile', reverse('main:profile'), login=True),
+            Scenario('profile_bb_detail', reverse('main:profile_bb_detail',
+                kwargs={'pk': bb.pk}), login=True),
+            Scenario('profile_bb_add', reverse('main:profile_bb_add'), login=True),
+            Scenario('profile_bb_add_post', reverse('main:profile_bb_add'), method='post',
+                data=lambda fixture: bb_add_data(user, bb), login=True, route='profile_bb_add'),
+            Scenario('profile_bb_change', reverse('main:profile_bb_change',
+                kwargs={'pk': bb.pk}), login=True),
+            Scenario('profile_bb_change_post', lambda copy: reverse('main:profile_bb_change',
+                kwargs={'pk': copy.pk}), method='post',
+                data=lambda copy: bb_add_data(user, copy), login=True,
+                route='profile_bb_change', fixture=lambda client: copy_bb(bb)),
+            Scenario('profile_bb_delete', reverse('main:profile_bb_delete',
+                kwargs={'pk': bb.pk}), login=True),
+            Scenario('profile_bb_delete_post', lambda copy: reverse('main:profile_bb_delete',
+                kwargs={'pk': copy.pk}), method='post', login=True,
+                route='profile_bb_delete', fixture=lambda client: copy_bb(bb)),
+            Scenario('profile_change', reverse('main:profile_change'), login=True),
+            Scenario('profile_change_post', reverse('main:profile_change'), method='post',
+                data=user_change_data, route='profile_change', fixture=fresh_user),
+            Scenario('profile_delete', reverse('main:profile_delete'), login=True),
+            Scenario('profile_delete_post', reverse('main:profile_delete'), method='post',
+                route='profile_delete', fixture=fresh_user),
+            Scenario('password_change', reverse('main:password_change'), login=True),
+            Scenario('logout', reverse('main:logout'), login=True, relogin=True),
+            ]
+
+
+def measure(client, scenario, iterations, login=None):
+    """
+    Выполняет сценарий iterations раз и возвращает сводку замеров.
+    Время и память меряются в разных проходах, так как отслеживание
+    выделений памяти само замедляет обработку запроса. Повторный вход
+    (login) и создание свежей записи сценария выполняются до запуска
+    таймера.
+    """
+    timings = []
+    queries = []
+    statuses = set()
+    for i in range(iterations):
+        if login:
+            login()
+        fixture = scenario.prepare(client)
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            response = scenario.request(client, fixture)
+            timings.append((time.perf_counter() - start) * 1000)
+        queries.append(len(context.captured_queries))
+        statuses.add(response.status_code)
+    if login:
+        login()
+    fixture = scenario.prepare(client)
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        scenario.request(client, fixture)
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+    result = {'p%s_ms' % p: round(percentile(timings, p), 3) for p in PERCENTILES}
+    result.update({
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'queries': max(queries),
+        'peak_memory_kb': round(peak / 1024, 1),
+        'status': sorted(statuses),
+        'iterations': iterations,
+        })
+    return result
+
+
+def run_benchmark(scenarios, user, password, iterations=20, warmup=2):
+    """
+    Выполняет сценарии и возвращает словарь замеров, ключи которого -
+    имена сценариев. Перед замером каждый сценарий прогревается warmup
+    раз, чтобы в результаты не попали загрузка шаблонов и наполнение
+    кэшей.
+    """
+    results = {}
+    for scenario in scenarios:
+        client = Client()
+        login = None
+        if scenario.login:
+            login = lambda: client.login(username=user.username, password=password)
+            login()
+        if scenario.setup:
+            scenario.setup(client)
+        for i in range(warmup):
+            if scenario.relogin:
+                login()
+            scenario.request(client, scenario.prepare(client))
+        results[scenario.name] = measure(client, scenario, iterations,
+                login if scenario.relogin else None)
+    return results
+
+
+def pick_fixture():
+    """
+    Выбирает пользователя и его объявление с наибольшим числом
+    комментариев - на таком объявлении контроллеры работают дольше всего.
+    """
+    bb = (Bb.objects.filter(is_active=True)
+            .annotate(comments_total=Count('comment'))
+            .order_by('-comments_total', '-pk')
+            .select_related('author').first())
+    if bb is None:
+        return None, None
+    return bb.author, bb
+
+
+@contextmanager
+def seeded_database(stdout, no_page_cache=False, database_file=False, **seed_options):
+    """
+    Временная тестовая БД, заполненная командой seed_bboard, и временная
+    папка MEDIA_ROOT: замеры не затрагивают рабочие БД и файлы. Тестовая
+    БД SQLite по умолчанию находится в памяти; для замеров с большим
+    количеством одновременных запросов (database_file=True) она создается
+    во временном файле с профилем подключения 'production' (журнал WAL,
+    ожидание блокировок), как на рабочем сайте.
+    """
+    setup_test_environment()
+    temp_dir = tempfile.mkdtemp(prefix='bboard-benchmark-')
+    media_root = os.path.join(temp_dir, 'media')
+    settings_dict = connection.settings_dict
+    saved_settings = {**settings_dict, 'TEST': dict(settings_dict['TEST'])}
+    if database_file and connection.vendor == 'sqlite':
+        settings_dict['TEST']['NAME'] = os.path.join(temp_dir, 'benchmark.sqlite3')
+        settings_dict.update(settings.DATABASE_PROFILES['production'])
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        overrides = {'BACKGROUND_WORKERS': {'default': 0}, 'MEDIA_ROOT': media_root}
+        if no_page_cache:
+            overrides['PAGE_CACHE_TIMEOUT'] = 0
+        with override_settings(**overrides):
+            call_command('seed_bboard', stdout=stdout, **seed_options)
+            yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        settings_dict.clear()
+        settings_dict.update(saved_settings)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        teardown_test_environment()
+
+
+def environment_info():
+    return {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'platform': platform.platform(),
+            }
+
+
+# Сравнение WSGI и ASGI: приложения Django вызываются напрямую, без
+# сервера и сети, конкурентные запросы выполняются пулом потоков (WSGI,
+# как у многопоточного сервера) или задачами asyncio (ASGI).
+
+def async_urlconf():
+    """
+    Маршруты сайта, в которых main.urls использует асинхронные
+    контроллеры (как под ASGI).
+    """
+    from bboard import urls as project_urls
+    from . import urls as main_urls
+    from .async_views import use_async_views
+
+    class AsyncUrlconf:
+        urlpatterns = [pattern for pattern in project_urls.urlpatterns
+                if getattr(pattern, 'app_name', None) != 'main']
+        urlpatterns.append(path('', include((use_async_views(main_urls.urlpatterns), 'main'))))
+
+    return AsyncUrlconf
+
+
+def wsgi_environ(url):
+    path_info, _, query = url.partition('?')
+    return {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path_info, 'QUERY_STRING': query,
+            'SCRIPT_NAME': '', 'SERVER_NAME': 'testserver', 'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': 'testserver',
+            'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(), 'wsgi.errors': io.StringIO(),
+            'wsgi.multithread': True, 'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            }
+
+
+def asgi_scope(url):
+    path_info, _, query = url.partition('?')
+    return {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': path_info, 'raw_path': path_info.encode(),
+            'query_string': query.encode(), 'root_path': '',
+            'headers': [(b'host', b'testserver')],
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 50000),
+            }
+
+
+class LoadResult:
+    """
+    Итоги нагрузочного прогона: время ответов, ошибки и наибольшее
+    количество одновременно работавших потоков.
+    """
+    def __init__(self):
+        self.timings = []
+        self.errors = 0
+        self.max_threads = threading.active_count()
+
+    def add(self, elapsed, status):
+        self.timings.append(elapsed * 1000)
+        if status >= 400:
+            self.errors += 1
+        self.max_threads = max(self.max_threads, threading.active_count())
+
+
+def call_wsgi(application, url, result):
+    start = time.perf_counter()
+    statuses = []
+    body = application(wsgi_environ(url), lambda status, headers: statuses.append(status))
+    try:
+        for chunk in body:
+            pass
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    result.add(time.perf_counter() - start, int(statuses[0].split()[0]))
+
+
+def run_wsgi(urls, requests, concurrency, result):
+    application = get_wsgi_application()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(call_wsgi, application, urls[i % len(urls)], result)
+                for i in range(requests)]:
+            future.result()
+
+
+async def call_asgi(application, url, result):
+    start = time.perf_counter()
+    messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+    disconnected = asyncio.Event()
+    status = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await application(asgi_scope(url), receive, send)
+    disconnected.set()
+    result.add(time.perf_counter() - start, status[0])
+
+
+def run_asgi(urls, requests, concurrency, result):
+    application = get_asgi_application()
+
+    async def worker(numbers):
+        for i in numbers:
+            await call_asgi(application, urls[i % len(urls)], result)
+
+    async def main():
+        await asyncio.gather(*(worker(range(n, requests, concurrency))
+            for n in range(concurrency)))
+
+    asyncio.run(main())
+
+
+SERVERS = {'wsgi': run_wsgi, 'asgi': run_asgi}
+
+
+def run_load(server, urls, requests, concurrency):
+    """
+    Выполняет requests запросов к адресам urls по кругу, concurrency
+    одновременно, через приложение WSGI или ASGI. Пропускная способность
+    и время ответа меряются в первом проходе, пиковый объем выделенной
+    памяти - во втором (отслеживание памяти замедляет работу).
+    """
+    overrides = {}
+    if server == 'asgi':
+        overrides['ROOT_URLCONF'] = async_urlconf()
+    with override_settings(**overrides):
+        # прогрев: шаблоны, кэш страниц, дерево рубрик
+        SERVERS[server](urls, len(urls), 1, LoadResult())
+        result = LoadResult()
+        start = time.perf_counter()
+        SERVERS[server](urls, requests, concurrency, result)
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        try:
+            SERVERS[server](urls, min(requests, concurrency * 2), concurrency, LoadResult())
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {
+            'requests': requests,
+            'concurrency': concurrency,
+            'requests_per_second': round(requests / elapsed, 1),
+            'p50_ms': round(percentile(result.timings, 50), 3),
+            'p95_ms': round(percentile(result.timings, 95), 3),
+            'p99_ms': round(percentile(result.timings, 99), 3),
+            'errors': result.errors,
+            'max_threads': result.max_threads,
+            'peak_memory_kb': round(peak / 1024, 1),
+            }
@@ -0,0 +1,247 @@
+# Кэширование данных, общих для всех страниц сайта
+
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+from functools import partial, wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import SubRubric
+
+# узлы дерева рубрик: надрубрика со списком подрубрик и сама подрубрика
+SuperRubricNode = namedtuple('SuperRubricNode', ('pk', 'name', 'sub_rubrics'))
+SubRubricNode = namedtuple('SubRubricNode', ('pk', 'name'))
+
+RUBRIC_TREE_KEY = 'main:rubric_tree'
+RUBRIC_TREE_VERSION_KEY = 'main:rubric_tree_version'
+
+# копия дерева рубрик, хранящаяся в памяти процесса: (версия, дерево)
+_local_rubric_tree = (None, ())
+
+
+def build_rubric_tree():
+    """
+    Строит дерево рубрик одним запросом к БД. Порядок подрубрик задается
+    сортировкой модели SubRubric, поэтому подрубрики одной надрубрики идут
+    подряд.
+    """
+    tree = []
+    rows = SubRubric.objects.values_list(
+            'pk', 'name', 'super_rubric__pk', 'super_rubric__name'
+            )
+    for pk, name, super_pk, super_name in rows:
+        if not tree or tree[-1].pk != super_pk:
+            tree.append(SuperRubricNode(super_pk, super_name, []))
+        tree[-1].sub_rubrics.append(SubRubricNode(pk, name))
+    return tuple(node._replace(sub_rubrics=tuple(node.sub_rubrics)) for node in tree)
+
+
+def get_rubric_tree_version():
+    """
+    Текущая версия дерева рубрик; меняется при любом изменении рубрик.
+    """
+    version = cache.get(RUBRIC_TREE_VERSION_KEY)
+    if version is None:
+        cache.add(RUBRIC_TREE_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(RUBRIC_TREE_VERSION_KEY)
+    return version
+
+
+def get_cached_rubric_tree():
+    """
+    Возвращает дерево рубрик из памяти процесса или из кэша, без обращения
+    к БД. None, если дерево нужно построить заново.
+    """
+    global _local_rubric_tree
+    version = get_rubric_tree_version()
+    local_version, tree = _local_rubric_tree
+    if version == local_version:
+        return tree
+    cached = cache.get(RUBRIC_TREE_KEY)
+    if cached is not None and cached[0] == version:
+        _local_rubric_tree = cached
+        return cached[1]
+    return None
+
+
+def get_rubric_tree():
+    """
+    Возвращает дерево рубрик. Пока версия дерева в кэше не изменилась,
+    используется копия из памяти процесса, и обращений к БД нет вовсе.
+    Дерево, построенное одним процессом, через кэш получают остальные.
+    """
+    global _local_rubric_tree
+    tree = get_cached_rubric_tree()
+    if tree is None:
+        version = get_rubric_tree_version()
+        tree = build_rubric_tree()
+        cache.set(RUBRIC_TREE_KEY, (version, tree), None)
+        _local_rubric_tree = (version, tree)
+    return tree
+
+
+def invalidate_rubric_tree():
+    """
+    Объявляет все копии дерева рубрик устаревшими, в том числе копии
+    в памяти других процессов.
+    """
+    cache.set(RUBRIC_TREE_VERSION_KEY, uuid.uuid4().hex, None)
+    cache.delete(RUBRIC_TREE_KEY)
+
+
+# поколения списков объявлений: общее (главная страница, общий поиск),
+# отдельное для каждой рубрики и поколение количества объявлений в
+# рубриках (панель навигации, фасеты)
+BBS_GENERATION_KEY = 'main:bbs_generation'
+RUBRIC_GENERATION_KEY = 'main:bbs_generation:%s'
+COUNTS_GENERATION_KEY = 'main:bbs_counts_generation'
+
+
+def get_generations(keys):
+    """
+    Номера поколений с ключами keys, прочитанные из кэша одним обращением.
+    При потере счетчика он начинается с текущего времени, чтобы не
+    совпасть ни с одним из прежних номеров поколений.
+    """
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            cache.add(key, int(time.time() * 1000), None)
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+def get_bbs_generation(rubric=None):
+    """
+    Номер поколения списков объявлений рубрики rubric или, без рубрики,
+    общих списков объявлений всех рубрик. Ключи кэшированных страниц
+    включают этот номер, поэтому после изменения списка старые копии
+    страниц просто перестают использоваться.
+    """
+    key = BBS_GENERATION_KEY if rubric is None else RUBRIC_GENERATION_KEY % rubric
+    return get_generations([key])[0]
+
+
+def get_counts_generation():
+    """
+    Номер поколения количества активных объявлений в рубриках и их
+    ценовых интервалах.
+    """
+    return get_generations([COUNTS_GENERATION_KEY])[0]
+
+
+def _incr_generations(keys):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            get_generations([key])
+
+
+def bump_bbs_generation(rubrics=None, counts=False):
+    """
+    Начинает новое поколение общих списков объявлений и списков рубрик
+    rubrics, при counts=True - и количества объявлений в рубриках. Без
+    rubrics устаревают списки всех рубрик и количество объявлений.
+
+    Счетчики увеличиваются сразу и еще раз после фиксации транзакции,
+    чтобы страница, закэшированная другим запросом до фиксации изменений,
+    больше не использовалась.
+    """
+    if rubrics is None:
+        rubrics = SubRubric.objects.values_list('pk', flat=True)
+        counts = True
+    keys = [BBS_GENERATION_KEY] + [RUBRIC_GENERATION_KEY % pk for pk in set(rubrics)]
+    if counts:
+        keys.append(COUNTS_GENERATION_KEY)
+    _incr_generations(keys)
+    transaction.on_commit(lambda: _incr_generations(keys))
+
+
+def page_cache_key(request, view_name, kwargs, rubric_kwarg=None):
+    """
+    Ключ кэшированной страницы: имя контроллера, его параметры (рубрика),
+    параметры запроса (искомое слово, номер страницы, курсор) и версии
+    данных страницы. Страница рубрики (ее ключ - параметр контроллера
+    rubric_kwarg) зависит от поколения списков только этой рубрики,
+    остальные - от общего поколения; все страницы выводят дерево рубрик
+    и количество объявлений в них.
+    """
+    query = hashlib.md5(request.GET.urlencode().encode()).hexdigest()
+    params = ':'.join('%s=%s' % item for item in sorted(kwargs.items()))
+    listing = (BBS_GENERATION_KEY if rubric_kwarg is None
+            else RUBRIC_GENERATION_KEY % kwargs[rubric_kwarg])
+    generations = ':'.join(map(str, get_generations([listing, COUNTS_GENERATION_KEY])))
+    return 'main:page:%s:%s:%s:%s:%s' % (get_rubric_tree_version(), generations,
+            view_name, params, query)
+
+
+def cache_anonymous_page(view=None, rubric_kwarg=None):
+    """
+    Декоратор, кэширующий страницы, выводимые гостям. Страницы
+    зарегистрированных пользователей, ответы на POST-запросы и страницы
+    со всплывающими сообщениями не кэшируются. Для страниц рубрики
+    указывается параметр контроллера с ключом рубрики rubric_kwarg (см.
+    page_cache_key()).
+    """
+    if view is None:
+        return partial(cache_anonymous_page, rubric_kwarg=rubric_kwarg)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if (request.method != 'GET' or request.user.is_authenticated
+                or len(get_messages(request))):
+            return view(request, *args, **kwargs)
+        key = page_cache_key(request, view.__name__, kwargs, rubric_kwarg)
+        response = cache.get(key)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.cookies:
+                cache.set(key, response, settings.PAGE_CACHE_TIMEOUT)
+        return response
+    wrapper.rubric_kwarg = rubric_kwarg
+    return wrapper
+
+
+class LRUCache:
+    """
+    Кэш в памяти процесса на maxsize записей: при переполнении вытесняется
+    запись, дольше всех не запрашивавшаяся. Может использоваться из
+    нескольких потоков.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,233 @@
+# Пул заранее подготовленных заданий captcha для комментариев гостей.
+# Фоновая задача (и команда refill_captchas) создает задания пакетами и
+# сразу рисует их изображения, сохраняя файлы PNG в хранилище. Страница
+# объявления выбирает случайное задание из пула одним запросом SELECT, без
+# записи в БД, а изображение отдается из кэша или с диска, без рисования.
+# Просроченные задания удаляются той же фоновой задачей порциями, а не при
+# каждой проверке ответа, как это делает django-simple-captcha.
+
+import datetime
+import hashlib
+import random
+
+from captcha.conf import settings as captcha_settings
+from captcha.fields import CaptchaField, CaptchaTextInput
+from captcha.models import CaptchaStore
+from captcha.views import captcha_image
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import router
+from django.utils import timezone
+from loguru import logger
+
+from .background import submit_on_commit
+
+# папка с изображениями заданий пула в хранилище
+POOL_DIR = 'captcha_pool'
+
+# границы ключей пула кэшируются ненадолго: новые задания попадают
+# в выборку не сразу, но выбор задания обходится одним запросом
+POOL_RANGE_KEY = 'main:captcha_pool_range'
+POOL_RANGE_TIMEOUT = 60
+
+IMAGE_KEY = 'main:captcha_image:%s:%s'
+IMAGE_TIMEOUT = 10 * 60
+
+# блокировка от одновременного пополнения пула, с
+REFILL_LOCK_KEY = 'main:captcha_refill'
+REFILL_LOCK_TIMEOUT = 10 * 60
+
+# количество заданий, создаваемых одним запросом INSERT
+REFILL_BATCH_SIZE = 100
+
+REAP_BATCH_SIZE = 500
+
+
+def image_scales():
+    return (1, 2) if captcha_settings.CAPTCHA_2X_IMAGE else (1,)
+
+
+def image_name(key, scale):
+    suffix = '@2' if scale == 2 else ''
+    return '%s/%s%s.png' % (POOL_DIR, key, suffix)
+
+
+def min_expiration():
+    """
+    Задание, выданное посетителю, должно оставаться действительным еще
+    CAPTCHA_GET_FROM_POOL_TIMEOUT минут.
+    """
+    return timezone.now() + datetime.timedelta(
+            minutes=int(captcha_settings.CAPTCHA_GET_FROM_POOL_TIMEOUT))
+
+
+def make_challenges(count):
+    """
+    Создает count заданий с ключами, вычисленными заранее, как в
+    CaptchaStore.save(), одним запросом INSERT. Возвращает их ключи.
+    """
+    expiration = timezone.now() + datetime.timedelta(minutes=settings.CAPTCHA_POOL_LIFETIME)
+    stores = []
+    for i in range(count):
+        challenge, response = captcha_settings.get_challenge()()
+        key = hashlib.sha1(('%s%s%s' % (random.getrandbits(64), challenge, response))
+                .encode('utf8')).hexdigest()
+        stores.append(CaptchaStore(challenge=challenge, response=response.lower(),
+                hashkey=key, expiration=expiration))
+    CaptchaStore.objects.bulk_create(stores)
+    return [store.hashkey for store in stores]
+
+
+def render_images(key):
+    """
+    Рисует изображения задания средствами django-simple-captcha и сохраняет
+    их в хранилище.
+    """
+    for scale in image_scales():
+        response = captcha_image(None, key, scale)
+        if response.status_code == 200:
+            default_storage.save(image_name(key, scale), ContentFile(response.content))
+
+
+def delete_images(key):
+    for scale in image_scales():
+        cache.delete(IMAGE_KEY % (key, scale))
+        try:
+            default_storage.delete(image_name(key, scale))
+        except OSError:
+            logger.warning(f'cannot delete captcha image {key}')
+
+
+def reap_expired(batch_size=REAP_BATCH_SIZE):
+    """
+    Удаляет просроченные задания порциями по batch_size вместе с их
+    изображениями. Возвращает количество удаленных заданий.
+    """
+    now = timezone.now()
+    reaped = 0
+    while True:
+        batch = list(CaptchaStore.objects.filter(expiration__lte=now)
+                .order_by('pk').values_list('pk', 'hashkey')[:batch_size])
+        if not batch:
+            break
+        # без сборщика связанных объектов и сигналов post_delete
+        stores = CaptchaStore.objects.filter(pk__in=[pk for pk, key in batch])
+        stores._raw_delete(router.db_for_write(CaptchaStore))
+        for pk, key in batch:
+            delete_images(key)
+        reaped += len(batch)
+        if len(batch) < batch_size:
+            break
+    return reaped
+
+
+def refill_pool(size=None, batch_size=REFILL_BATCH_SIZE):
+    """
+    Удаляет просроченные задания и дополняет пул до size действительных
+    заданий. Возвращает пару (удалено, создано).
+    """
+    size = settings.CAPTCHA_POOL_SIZE if size is None else size
+    reaped = reap_expired()
+    created = 0
+    missing = size - CaptchaStore.objects.filter(expiration__gt=min_expiration()).count()
+    while missing > 0:
+        for key in make_challenges(min(missing, batch_size)):
+            render_images(key)
+            created += 1
+            missing -= 1
+    if created:
+        cache.delete(POOL_RANGE_KEY)
+    return reaped, created
+
+
+def _refill_locked():
+    try:
+        refill_pool()
+    finally:
+        cache.delete(REFILL_LOCK_KEY)
+
+
+def schedule_refill():
+    """
+    Ставит пополнение пула в очередь фоновых задач, если оно еще не
+    выполняется.
+    """
+    if cache.add(REFILL_LOCK_KEY, True, REFILL_LOCK_TIMEOUT):
+        submit_on_commit(_refill_locked)
+
+
+def pool_range():
+    """
+    Наименьший и наибольший ключи действительных заданий пула.
+    """
+    bounds = cache.get(POOL_RANGE_KEY)
+    if bounds is None:
+        stores = CaptchaStore.objects.filter(expiration__gt=min_expiration())
+        bounds = (stores.order_by('pk').values_list('pk', flat=True).first(),
+                stores.order_by('-pk').values_list('pk', flat=True).first())
+        cache.set(POOL_RANGE_KEY, bounds, POOL_RANGE_TIMEOUT)
+    return bounds
+
+
+def pick_challenge():
+    """
+    Ключ случайного действительного задания пула: первое задание с ключом
+    не меньше случайного числа из диапазона ключей пула, выбираемое по
+    первичному ключу без сортировки всей таблицы. Если пул пуст, ставится
+    его пополнение, а задание создается как обычно.
+    """
+    low, high = pool_range()
+    if low is not None:
+        stores = CaptchaStore.objects.filter(expiration__gt=min_expiration()).order_by('pk')
+        start = random.randint(low, high)
+        key = stores.filter(pk__gte=start).values_list('hashkey', flat=True).first()
+        if key is None:
+            key = stores.filter(pk__lt=start).values_list('hashkey', flat=True).first()
+        if key is not None:
+            return key
+        cache.delete(POOL_RANGE_KEY)
+    logger.warning('captcha pool is empty, generating challenge')
+    schedule_refill()
+    return CaptchaStore.generate_key()
+
+
+def read_image(key, scale):
+    """
+    Изображение задания пула: из кэша, иначе из хранилища. None, если
+    задание создано не через пул.
+    """
+    cache_key = IMAGE_KEY % (key, scale)
+    content = cache.get(cache_key)
+    if content is None:
+        name = image_name(key, scale)
+        try:
+            with default_storage.open(name) as f:
+                content = f.read()
+        except OSError:
+            return None
+        cache.set(cache_key, content, IMAGE_TIMEOUT)
+    return content
+
+
+class PooledCaptchaTextInput(CaptchaTextInput):
+    """
+    Элемент управления captcha, выводящий задание из пула.
+    """
+    def fetch_captcha_store(self, name, value, attrs=None, generator=None):
+        key = pick_challenge()
+        self._value = [key, '']
+        self._key = key
+        self.id_ = self.build_attrs(attrs).get('id', None)
+
+
+class PooledCaptchaField(CaptchaField):
+    """
+    Поле captcha с заданиями из пула. Просроченные задания при проверке
+    ответа не удаляются (это делает refill_pool()), так как в настройках
+    задано CAPTCHA_GET_FROM_POOL.
+    """
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('widget', PooledCaptchaTextInput())
+        super().__init__(*args, **kwargs)
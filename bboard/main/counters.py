@@ -0,0 +1,61 @@
+# Денормализованные счетчики объявлений: количество активных комментариев
+# и дополнительных иллюстраций. При создании, модерации и удалении записей
+# счетчики меняются на единицу запросом UPDATE с выражением F() (без
+# чтения объявления и без потери одновременных изменений). Пакетные
+# операции, не отправляющие сигналов, пересчитывают счетчики функцией
+# recount_bbs().
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Bb, AdditionalImage, Comment
+
+
+def change_counters(bb_id, comments=0, images=0):
+    """
+    Изменяет счетчики объявления bb_id на заданные величины.
+    """
+    changes = {}
+    if comments:
+        changes['comments_count'] = F('comments_count') + comments
+    if images:
+        changes['images_count'] = F('images_count') + images
+    if changes:
+        Bb.objects.filter(pk=bb_id).update(**changes)
+
+
+def count_related(model, **filters):
+    """
+    Подзапрос, считающий записи модели model, связанные с объявлением из
+    внешнего запроса.
+    """
+    counts = (model.objects.filter(bb=OuterRef('pk'), **filters).order_by()
+            .values('bb').annotate(count=Count('pk')).values('count'))
+    return Coalesce(Subquery(counts), Value(0))
+
+
+def recount_bbs(queryset):
+    """
+    Пересчитывает счетчики объявлений queryset одним запросом UPDATE.
+    Возвращает количество обновленных объявлений.
+    """
+    return queryset.update(
+            comments_count=count_related(Comment, is_active=True),
+            images_count=count_related(AdditionalImage),
+            )
+
+
+def recount_all(batch_size=10000):
+    """
+    Пересчитывает счетчики всех объявлений диапазонами ключей по
+    batch_size, каждый диапазон в отдельной транзакции, чтобы не
+    блокировать запись в БД надолго. Генератор, выдающий количество
+    обновленных объявлений после каждого диапазона.
+    """
+    last_pk = Bb.objects.order_by('-pk').values_list('pk', flat=True).first()
+    if last_pk is None:
+        return
+    for start in range(0, last_pk + 1, batch_size):
+        with transaction.atomic():
+            yield recount_bbs(Bb.objects.filter(pk__gte=start, pk__lt=start + batch_size))
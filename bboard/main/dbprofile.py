@@ -0,0 +1,32 @@
+# Настройка подключений к SQLite по профилю из настройки DATABASES:
+# ключ PRAGMAS задает прагмы, выполняемые при каждом подключении, ключ
+# IMMEDIATE_TRANSACTIONS включает транзакции BEGIN IMMEDIATE.
+
+import types
+
+
+def begin_immediate(connection):
+    """
+    Начинает транзакцию с немедленным захватом блокировки записи. При
+    обычном BEGIN (DEFERRED) блокировка берется при первой записи, и если
+    другое подключение уже пишет, SQLite сразу возвращает "database is
+    locked", не дожидаясь busy_timeout. BEGIN IMMEDIATE ждет своей
+    очереди в начале транзакции.
+    """
+    connection.cursor().execute('BEGIN IMMEDIATE')
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Обработчик сигнала connection_created: применяет к новому
+    подключению к SQLite прагмы и режим транзакций из его настроек.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    settings_dict = connection.settings_dict
+    for name, value in (settings_dict.get('PRAGMAS') or {}).items():
+        connection.connection.execute('PRAGMA %s = %s' % (name, value))
+    if settings_dict.get('IMMEDIATE_TRANSACTIONS'):
+        # Django начинает транзакции atomic() этим методом
+        connection._start_transaction_under_autocommit = types.MethodType(
+                begin_immediate, connection)
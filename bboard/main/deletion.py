@@ -0,0 +1,90 @@
+# Массовое удаление объявлений и пользователей
+
+from collections import Counter
+
+from django.db import router, transaction
+from loguru import logger
+
+from .apps import bbs_deleted
+from .background import submit
+from .facets import facet_counts, change_facets
+from .models import AdvUser, Bb, AdditionalImage, Comment, TitleTrigram
+
+# размер порции ключей в одном запросе DELETE ... WHERE ... IN (...),
+# меньше ограничения SQLite на количество параметров запроса
+DELETE_CHUNK_SIZE = 900
+
+
+def chunked(items, size=DELETE_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def delete_bbs(queryset):
+    """
+    Удаляет объявления из queryset вместе с их комментариями,
+    дополнительными иллюстрациями и триграммами названий. Записи удаляются
+    запросами DELETE ... WHERE по порциям ключей, без загрузки объектов и без
+    сигналов post_delete для каждой записи. Вместо них отправляется один
+    сигнал bbs_deleted со списком ключей удаленных объявлений и рубриками,
+    в списках которых выводились удаленные объявления. Счетчики
+    сводной таблицы фасетов уменьшаются на число удаленных объявлений.
+
+    Файлы изображений удаляются в фоне после фиксации транзакции.
+    Возвращает количество удаленных объявлений.
+    """
+    using = router.db_for_write(Bb)
+    with transaction.atomic(using=using):
+        pks = list(queryset.using(using).values_list('pk', flat=True))
+        if not pks:
+            return 0
+        files = []
+        facets = Counter()
+        for chunk in chunked(pks):
+            bbs = Bb.objects.using(using).filter(pk__in=chunk)
+            ais = AdditionalImage.objects.using(using).filter(bb__in=chunk)
+            facets.update(facet_counts(bbs))
+            files += bbs.exclude(image='').values_list('image', flat=True)
+            files += ais.values_list('image', flat=True)
+            # _raw_delete() выполняет один DELETE без сборщика связанных
+            # объектов Collector и без отправки сигналов
+            Comment.objects.using(using).filter(bb__in=chunk)._raw_delete(using)
+            ais._raw_delete(using)
+            TitleTrigram.objects.using(using).filter(bb__in=chunk)._raw_delete(using)
+            bbs._raw_delete(using)
+        change_facets({facet: -count for facet, count in facets.items()})
+        bbs_deleted.send(sender=Bb, pks=pks,
+                rubrics={rubric for rubric, bucket in facets})
+        if files:
+            transaction.on_commit(
+                    lambda: submit(delete_files, files, pool='cleanup'),
+                    using=using
+                    )
+    return len(pks)
+
+
+def delete_users(queryset):
+    """
+    Удаляет пользователей из queryset вместе со всеми их объявлениями
+    в одной транзакции.
+    """
+    using = router.db_for_write(AdvUser)
+    with transaction.atomic(using=using):
+        pks = list(queryset.using(using).values_list('pk', flat=True))
+        delete_bbs(Bb.objects.filter(author__in=pks))
+        return AdvUser.objects.using(using).filter(pk__in=pks).delete()
+
+
+def delete_files(names):
+    """
+    Освобождает ссылки удаленных записей на файлы изображений. Основные и
+    дополнительные иллюстрации хранятся в одном хранилище; файл удаляется,
+    когда на него не остается ссылок, повторяющиеся имена освобождаются
+    одним запросом.
+    """
+    storage = Bb._meta.get_field('image').storage
+    for name, count in Counter(names).items():
+        try:
+            storage.release(name, count)
+        except Exception:
+            logger.exception(f'file {name} was not deleted')
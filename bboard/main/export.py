@@ -0,0 +1,93 @@
+# Выгрузка объявлений в форматах JSON Lines и CSV. Записи читаются из БД
+# порциями через итератор, названия рубрик и имя автора берутся тем же
+# запросом (соединением таблиц), а строки выгрузки формируются по одной,
+# так что расход памяти не зависит от количества объявлений.
+
+import csv
+import json
+
+from .models import Bb
+
+# размер порции записей, получаемых из БД за одно обращение
+EXPORT_CHUNK_SIZE = 2000
+
+# выгружаемые поля: имя в выгрузке и путь к полю модели Bb
+EXPORT_FIELDS = (
+        ('id', 'pk'),
+        ('title', 'title'),
+        ('content', 'content'),
+        ('price', 'price'),
+        ('contacts', 'contacts'),
+        ('created_at', 'created_at'),
+        ('rubric_id', 'rubric_id'),
+        ('rubric', 'rubric__name'),
+        ('super_rubric', 'rubric__super_rubric__name'),
+        ('author', 'author__username'),
+        ('image', 'image'),
+        )
+
+COLUMNS = [name for name, field in EXPORT_FIELDS]
+
+
+def export_queryset(rubric=None, since=None, until=None):
+    """
+    Активные объявления в порядке публикации, при необходимости - одной
+    рубрики и опубликованные в промежутке [since, until).
+    """
+    queryset = Bb.objects.filter(is_active=True)
+    if rubric:
+        queryset = queryset.filter(rubric=rubric)
+    if since:
+        queryset = queryset.filter(created_at__gte=since)
+    if until:
+        queryset = queryset.filter(created_at__lt=until)
+    return queryset.order_by('created_at', 'pk')
+
+
+def export_rows(queryset):
+    """
+    Генератор словарей с выгружаемыми значениями объявлений.
+    """
+    image_url = Bb._meta.get_field('image').storage.url
+    values = queryset.values_list(*(field for name, field in EXPORT_FIELDS))
+    for row in values.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        row = dict(zip(COLUMNS, row))
+        row['created_at'] = row['created_at'].isoformat()
+        row['image'] = image_url(row['image']) if row['image'] else ''
+        yield row
+
+
+def jsonl_lines(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+class Echo:
+    """
+    Псевдофайл для csv.writer: метод write() возвращает записанную строку,
+    вместо того чтобы накапливать ее.
+    """
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.DictWriter(Echo(), fieldnames=COLUMNS)
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+# форматы выгрузки: тип содержимого, генератор строк и расширение файла
+FORMATS = {
+        'jsonl': ('application/x-ndjson; charset=utf-8', jsonl_lines, 'jsonl'),
+        'csv': ('text/csv; charset=utf-8', csv_lines, 'csv'),
+        }
+
+
+def export_lines(queryset, format):
+    """
+    Генератор строк выгрузки набора объявлений в формате format.
+    """
+    content_type, lines, extension = FORMATS[format]
+    return lines(export_rows(queryset))
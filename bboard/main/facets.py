@@ -0,0 +1,146 @@
+# Фасеты списков объявлений: количество активных объявлений каждой
+# подрубрики в каждом ценовом интервале. Счетчики хранятся в сводной
+# таблице RubricFacet и меняются при сохранении и удалении объявлений,
+# поэтому вывод фасетов и числа объявлений рубрик в панели навигации не
+# требует подсчета GROUP BY по объявлениям. Сводка всех рубрик кэшируется
+# до следующего изменения количества объявлений (см. get_counts_generation()).
+
+from bisect import bisect_right
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Value, When
+
+from .caching import get_counts_generation
+from .models import Bb, RubricFacet
+
+# границы ценовых интервалов; интервал i включает цены от PRICE_BOUNDS[i - 1]
+# (включительно) до PRICE_BOUNDS[i]. После изменения границ сводную таблицу
+# нужно пересчитать командой recount_bbs
+PRICE_BOUNDS = (1000, 5000, 10000, 50000, 100000)
+
+FACETS_KEY = 'main:facets:%s'
+# сводки прежних поколений больше не читаются и удаляются из кэша по
+# истечении этого времени, с
+FACETS_TIMEOUT = 60 * 60
+
+
+def price_bucket(price):
+    """
+    Номер ценового интервала цены price.
+    """
+    return bisect_right(PRICE_BOUNDS, price)
+
+
+def bucket_range(bucket):
+    """
+    Границы ценового интервала: (нижняя, верхняя), None - без границы.
+    """
+    low = PRICE_BOUNDS[bucket - 1] if bucket > 0 else None
+    high = PRICE_BOUNDS[bucket] if bucket < len(PRICE_BOUNDS) else None
+    return low, high
+
+
+def bucket_label(bucket):
+    low, high = bucket_range(bucket)
+    if low is None:
+        return 'до %s' % high
+    if high is None:
+        return 'от %s' % low
+    return '%s - %s' % (low, high)
+
+
+BUCKET_CHOICES = [(bucket, bucket_label(bucket)) for bucket in range(len(PRICE_BOUNDS) + 1)]
+
+
+def bucket_expression():
+    """
+    Выражение SQL, вычисляющее номер ценового интервала объявления.
+    """
+    return Case(
+            *[When(price__lt=bound, then=Value(i)) for i, bound in enumerate(PRICE_BOUNDS)],
+            default=Value(len(PRICE_BOUNDS)),
+            output_field=IntegerField()
+            )
+
+
+def filter_by_price(queryset, bucket=None, price_min=None, price_max=None):
+    """
+    Отбирает объявления ценового интервала bucket и (или) диапазона цен
+    от price_min до price_max включительно.
+    """
+    if bucket is not None:
+        low, high = bucket_range(bucket)
+        if low is not None:
+            queryset = queryset.filter(price__gte=low)
+        if high is not None:
+            queryset = queryset.filter(price__lt=high)
+    if price_min is not None:
+        queryset = queryset.filter(price__gte=price_min)
+    if price_max is not None:
+        queryset = queryset.filter(price__lte=price_max)
+    return queryset
+
+
+def facet_counts(queryset):
+    """
+    Подсчитывает фасеты активных объявлений queryset одним запросом
+    GROUP BY. Возвращает Counter {(рубрика, интервал): количество}.
+    """
+    rows = (queryset.filter(is_active=True).order_by()
+            .annotate(bucket=bucket_expression())
+            .values_list('rubric', 'bucket').annotate(count=Count('pk')))
+    return Counter({(rubric, bucket): count for rubric, bucket, count in rows})
+
+
+def change_facets(changes):
+    """
+    Изменяет счетчики сводной таблицы на величины из словаря
+    {(рубрика, интервал): изменение}.
+    """
+    for (rubric, bucket), delta in changes.items():
+        if not delta:
+            continue
+        facet, created = RubricFacet.objects.get_or_create(
+                rubric_id=rubric, bucket=bucket, defaults={'count': delta})
+        if not created:
+            RubricFacet.objects.filter(pk=facet.pk).update(count=F('count') + delta)
+
+
+def rebuild_facets():
+    """
+    Заполняет сводную таблицу заново по всем объявлениям.
+    """
+    with transaction.atomic():
+        RubricFacet.objects.all().delete()
+        RubricFacet.objects.bulk_create([
+            RubricFacet(rubric_id=rubric, bucket=bucket, count=count)
+            for (rubric, bucket), count in facet_counts(Bb.objects.all()).items()
+            ])
+
+
+def get_facets():
+    """
+    Сводка фасетов всех рубрик: {рубрика: [количество в каждом интервале]}.
+    Читается из кэша; после изменения объявлений - одним запросом к сводной
+    таблице, размер которой не зависит от числа объявлений.
+    """
+    key = FACETS_KEY % get_counts_generation()
+    facets = cache.get(key)
+    if facets is None:
+        facets = {}
+        rows = RubricFacet.objects.filter(count__gt=0).values_list('rubric', 'bucket', 'count')
+        for rubric, bucket, count in rows:
+            counts = facets.setdefault(rubric, [0] * (len(PRICE_BOUNDS) + 1))
+            if bucket < len(counts):
+                counts[bucket] = count
+        cache.set(key, facets, FACETS_TIMEOUT)
+    return facets
+
+
+def get_rubric_counts():
+    """
+    Количество активных объявлений в каждой рубрике.
+    """
+    return {rubric: sum(counts) for rubric, counts in get_facets().items()}
@@ -14,8 +14,14 @@ from .models import SuperRubric, SubRubric
 from django.forms import inlineformset_factory
 from .models import Bb, AdditionalImage
 
+# импорт для подсказок в форме поиска
+from .trigrams import suggest
+
+# импорт для формы фильтрации объявлений рубрики
+from .facets import BUCKET_CHOICES
+
 # импорт для формы, связанной с моделью комментариев Comment
-from captcha.fields import CaptchaField
+from .captchas import PooledCaptchaField
 from .models import Comment
 
 
@@ -99,6 +105,85 @@ class SearchForm(forms.Form):
             label = '',
             )
 
+    def clean_keyword(self):
+        """
+        Убирает лишние пробелы из искомой фразы.
+        """
+        return ' '.join(self.cleaned_data['keyword'].split())
+
+    def get_suggestion(self):
+        """
+        Искомая фраза, исправленная по похожим названиям объявлений, для
+        подсказки "Возможно, вы искали", или пустая строка. Работает и для
+        заполненной формы, и для формы с начальными значениями.
+        """
+        return suggest(str(self['keyword'].value() or ''))
+
+
+class BbFilterForm(SearchForm):
+    """
+    Форма поиска по объявлениям рубрики с фильтрами по цене и выбором
+    порядка вывода. Ценовой интервал задается ссылками фасетов.
+    """
+    SORT_CHOICES = (
+            ('', 'По умолчанию'),
+            ('new', 'Сначала новые'),
+            ('price', 'Сначала дешевые'),
+            ('-price', 'Сначала дорогие'),
+            )
+
+    bucket = forms.TypedChoiceField(
+            required = False,
+            choices = BUCKET_CHOICES,
+            coerce = int,
+            empty_value = None,
+            widget = forms.HiddenInput,
+            )
+    price_min = forms.FloatField(
+            required = False,
+            min_value = 0,
+            label = '',
+            widget = forms.NumberInput(attrs={'placeholder': 'Цена от'}),
+            )
+    price_max = forms.FloatField(
+            required = False,
+            min_value = 0,
+            label = '',
+            widget = forms.NumberInput(attrs={'placeholder': 'Цена до'}),
+            )
+    sort = forms.ChoiceField(
+            required = False,
+            choices = SORT_CHOICES,
+            label = '',
+            )
+
+    def get_filters(self):
+        """
+        Заданные пользователем фильтры (без пустых значений).
+        """
+        return {name: value for name, value in self.cleaned_data.items()
+                if value not in (None, '')}
+
+
+class ExportForm(forms.Form):
+    """
+    Параметры выгрузки объявлений: формат, рубрика и промежуток дат
+    публикации (начало включается, конец - нет).
+    """
+    format = forms.ChoiceField(
+            required = False,
+            choices = (('jsonl', 'JSON Lines'), ('csv', 'CSV')),
+            )
+    rubric = forms.ModelChoiceField(
+            required = False,
+            queryset = SubRubric.objects.all(),
+            )
+    since = forms.DateTimeField(required = False)
+    until = forms.DateTimeField(required = False)
+
+    def clean_format(self):
+        return self.cleaned_data['format'] or 'jsonl'
+
 
 class BbForm(forms.ModelForm):
     """
@@ -128,7 +213,7 @@ class GuestCommentForm(forms.ModelForm):
     """
     Форма ввода комментариев, для гостей.
     """
-    captcha = CaptchaField(
+    captcha = PooledCaptchaField(
             label='Введите текст с картинки',
             error_messages={'invalid': 'Неправильный текст'}
             )
@@ -0,0 +1,64 @@
+# Создание уменьшенных копий изображений в нескольких форматах. Модуль не
+# зависит от Django и не обращается к БД: его функции выполняются в
+# процессах пула (см. main.variants), которым передаются пути к файлам.
+
+import json
+import os
+
+from PIL import Image, ImageOps
+
+try:
+    # необязательный модуль, добавляющий в Pillow поддержку AVIF
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+# форматы копий, от предпочтительного: расширение, формат Pillow, тип MIME.
+# Последний формат понимают все браузеры, он выводится в теге <img>
+FORMATS = (
+        ('avif', 'AVIF', 'image/avif'),
+        ('webp', 'WEBP', 'image/webp'),
+        ('jpg', 'JPEG', 'image/jpeg'),
+        )
+
+
+def available_formats():
+    """
+    Расширения форматов, которые Pillow умеет сохранять.
+    """
+    Image.init()
+    return [extension for extension, pil_format, mime in FORMATS if pil_format in Image.SAVE]
+
+
+def save_atomic(image, path, pil_format, quality):
+    """
+    Сохраняет файл под временным именем и переименовывает, чтобы файл не
+    был виден недописанным.
+    """
+    temporary = path + '.tmp'
+    image.save(temporary, pil_format, quality=quality)
+    os.replace(temporary, path)
+
+
+def render_variants(source, base, widths, extensions, quality):
+    """
+    Создает копии изображения source шириной widths (копии не шире
+    оригинала) в форматах extensions с именами base_<ширина>.<расширение>
+    и перечень созданных копий base.json, который записывается последним.
+    Возвращает перечень: {'widths': [...], 'formats': [...]}.
+    """
+    os.makedirs(os.path.dirname(base), exist_ok=True)
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        sizes = sorted({min(width, image.width) for width in widths})
+        for width in sizes:
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.LANCZOS) if width < image.width else image
+            for extension in extensions:
+                pil_format = next(f for e, f, mime in FORMATS if e == extension)
+                save_atomic(resized, '%s_%s.%s' % (base, width, extension), pil_format, quality)
+    manifest = {'widths': sizes, 'formats': list(extensions)}
+    with open(base + '.json.tmp', 'w') as output:
+        json.dump(manifest, output)
+    os.replace(base + '.json.tmp', base + '.json')
+    return manifest
@@ -0,0 +1,297 @@
+# Массовый импорт объявлений из файлов CSV и JSON Lines. Записи читаются
+# из файла по одной и обрабатываются порциями: изображения порции
+# проверяются и копируются в хранилище пулом рабочих потоков, затем
+# объявления и дополнительные иллюстрации создаются пакетными запросами
+# (bulk_create) в одной транзакции на порцию. После каждой порции
+# сохраняется контрольная точка, по которой прерванный импорт продолжается
+# с места остановки.
+
+import csv
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from PIL import Image
+
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from loguru import logger
+
+from .caching import bump_bbs_generation
+from .facets import price_bucket, change_facets
+from .models import AdvUser, SubRubric, Bb, AdditionalImage
+from .search import index_new_bbs
+from .trigrams import index_titles
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp')
+
+FALSE_VALUES = ('0', 'false', 'no', 'нет')
+
+
+def batches(iterable, size):
+    """
+    Разбивает последовательность любой длины на списки по size элементов,
+    не загружая ее в память целиком.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def read_records(path):
+    """
+    Генератор записей файла импорта (словарей). Формат определяется по
+    расширению: .csv - CSV с заголовком, остальные - JSON Lines.
+    Некорректная строка JSON дает запись с ключом _error.
+    """
+    with open(path, encoding='utf-8', newline='') as source:
+        if os.path.splitext(path)[1].lower() == '.csv':
+            yield from csv.DictReader(source)
+            return
+        for line in source:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                record = {'_error': 'некорректный JSON: %s' % e}
+            if not isinstance(record, dict):
+                record = {'_error': 'запись должна быть объектом JSON'}
+            yield record
+
+
+def image_sources(value, base_dir=''):
+    """
+    Пути к файлам изображений объявления. Значение поля - путь к файлу или
+    папке (берутся все изображения из нее по алфавиту); несколько путей
+    в CSV разделяются точкой с запятой, в JSON задаются списком.
+    Относительные пути отсчитываются от папки base_dir.
+    """
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(';')
+    paths = []
+    for item in value:
+        item = item.strip()
+        if not item:
+            continue
+        path = os.path.join(base_dir, item)
+        if os.path.isdir(path):
+            paths += sorted(os.path.join(path, name) for name in os.listdir(path)
+                    if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+        else:
+            paths.append(path)
+    return paths
+
+
+def copy_image(path):
+    """
+    Проверяет, что файл - изображение, и копирует его в хранилище.
+    Имя файла в хранилище определяется его содержимым, повторяющиеся
+    изображения не копируются повторно. Ссылки на файл добавляются вместе
+    с записями объявлений. Возвращает имя сохраненного файла.
+    """
+    with Image.open(path) as image:
+        image.verify()
+    storage = Bb._meta.get_field('image').storage
+    with open(path, 'rb') as source:
+        return storage.store(os.path.basename(path), File(source))
+
+
+class ImportReport:
+    """
+    Счетчики импорта и производительность.
+    """
+    def __init__(self, skipped_records=0):
+        self.started = time.perf_counter()
+        self.skipped_records = skipped_records
+        self.records = 0
+        self.imported = 0
+        self.rejected = 0
+        self.images = 0
+        self.image_errors = 0
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def __str__(self):
+        elapsed = max(self.elapsed, 1e-9)
+        return ('записей: %s, импортировано: %s, отклонено: %s, изображений: %s '
+                '(ошибок %s); %.1f с, %.0f объявлений/с, %.0f изображений/с' % (
+                    self.records, self.imported, self.rejected, self.images,
+                    self.image_errors, elapsed, self.imported / elapsed,
+                    self.images / elapsed))
+
+
+class BbImporter:
+    """
+    Импорт объявлений из файла path. Рубрика записи задается ключом или
+    названием подрубрики, автор - именем пользователя. Необязательные
+    поля: price, is_active, created_at, image (см. image_sources()).
+    """
+    def __init__(self, path, images_dir='', batch_size=1000, workers=4,
+            checkpoint=None, progress=None):
+        self.path = os.path.abspath(path)
+        self.images_dir = images_dir or os.path.dirname(self.path)
+        self.batch_size = batch_size
+        self.workers = workers
+        self.checkpoint = checkpoint
+        # функция, вызываемая с отчетом после каждой порции
+        self.progress = progress
+        self.rubrics = {}
+        for pk, name in SubRubric.objects.values_list('pk', 'name'):
+            self.rubrics[str(pk)] = self.rubrics[name] = pk
+        self.authors = {}
+        # рубрики, в списки которых добавлены объявления
+        self.listed_rubrics = set()
+
+    def load_checkpoint(self):
+        """
+        Количество записей, обработанных при прошлом запуске.
+        """
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return 0
+        with open(self.checkpoint, encoding='utf-8') as source:
+            data = json.load(source)
+        if data.get('input') != self.path:
+            raise ValueError('Контрольная точка %s относится к файлу %s' % (
+                self.checkpoint, data.get('input')))
+        return data['done']
+
+    def save_checkpoint(self, done):
+        if not self.checkpoint:
+            return
+        temp = self.checkpoint + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as output:
+            json.dump({'input': self.path, 'done': done}, output)
+        os.replace(temp, self.checkpoint)
+
+    def run(self):
+        done = self.load_checkpoint()
+        self.report = ImportReport(skipped_records=done)
+        records = islice(enumerate(read_records(self.path)), done, None)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for chunk in batches(records, self.batch_size):
+                    self.import_chunk(chunk, executor)
+                    self.save_checkpoint(chunk[-1][0] + 1)
+                    if self.progress:
+                        self.progress(self.report)
+        finally:
+            if self.listed_rubrics:
+                bump_bbs_generation(self.listed_rubrics, counts=True)
+        return self.report
+
+    def load_authors(self, usernames):
+        missing = set(usernames) - set(self.authors)
+        if missing:
+            self.authors.update(AdvUser.objects.filter(username__in=missing)
+                    .values_list('username', 'pk'))
+
+    def build_bb(self, record):
+        """
+        Объявление (еще не сохраненное), дата публикации и пути к файлам
+        изображений по записи файла импорта. Ошибки в записи вызывают
+        ValueError.
+        """
+        if '_error' in record:
+            raise ValueError(record['_error'])
+        for field in ('title', 'content', 'contacts'):
+            if not str(record.get(field) or '').strip():
+                raise ValueError('не заполнено поле %s' % field)
+        title = str(record['title']).strip()
+        if len(title) > Bb._meta.get_field('title').max_length:
+            raise ValueError('слишком длинное название')
+        rubric = self.rubrics.get(str(record.get('rubric', '')).strip())
+        if rubric is None:
+            raise ValueError('неизвестная рубрика %s' % record.get('rubric'))
+        author = self.authors.get(record.get('author'))
+        if author is None:
+            raise ValueError('неизвестный автор %s' % record.get('author'))
+        try:
+            price = float(record.get('price') or 0)
+        except (TypeError, ValueError):
+            raise ValueError('некорректная цена %s' % record.get('price'))
+        created_at = None
+        if record.get('created_at'):
+            created_at = parse_datetime(str(record['created_at']))
+            if created_at is None:
+                raise ValueError('некорректная дата %s' % record['created_at'])
+            if timezone.is_naive(created_at):
+                created_at = timezone.make_aware(created_at)
+        is_active = str(record.get('is_active', '1')).strip().lower() not in FALSE_VALUES
+        bb = Bb(rubric_id=rubric, author_id=author, title=title,
+                content=str(record['content']), contacts=str(record['contacts']),
+                price=price, is_active=is_active)
+        return bb, created_at, image_sources(record.get('image'), self.images_dir)
+
+    def copy_image(self, path):
+        try:
+            return copy_image(path)
+        except Exception as e:
+            logger.warning(f'image {path} was not imported: {e}')
+            return None
+
+    def import_chunk(self, chunk, executor):
+        self.report.records += len(chunk)
+        self.load_authors(record.get('author') for number, record in chunk
+                if isinstance(record.get('author'), str))
+        prepared = []
+        for number, record in chunk:
+            try:
+                prepared.append(self.build_bb(record))
+            except ValueError as e:
+                self.report.rejected += 1
+                logger.warning(f'{self.path}, record {number + 1} was rejected: {e}')
+        # изображения всей порции копируются параллельно
+        names = iter(executor.map(self.copy_image,
+            [path for bb, created_at, paths in prepared for path in paths]))
+        bbs = []
+        additional = []
+        saved = []
+        for bb, created_at, paths in prepared:
+            images = [name for name in (next(names) for path in paths) if name]
+            self.report.images += len(images)
+            self.report.image_errors += len(paths) - len(images)
+            saved += images
+            if images:
+                bb.image = images[0]
+                bb.images_count = len(images) - 1
+            bbs.append(bb)
+            additional.append((bb, created_at, images[1:]))
+        storage = Bb._meta.get_field('image').storage
+        try:
+            with transaction.atomic():
+                Bb.objects.bulk_create(bbs)
+                # bulk_create() ставит дату публикации по auto_now_add
+                dated = []
+                for bb, created_at, images in additional:
+                    if created_at:
+                        bb.created_at = created_at
+                        dated.append(bb)
+                if dated:
+                    Bb.objects.bulk_update(dated, ['created_at'])
+                AdditionalImage.objects.bulk_create([
+                    AdditionalImage(bb=bb, image=name)
+                    for bb, created_at, images in additional for name in images])
+                index_new_bbs(bbs)
+                index_titles(bbs)
+                storage.add_references(Counter(saved))
+                change_facets(Counter((bb.rubric_id, price_bucket(bb.price))
+                    for bb in bbs if bb.is_active))
+        except Exception:
+            # скопированные файлы без записей в БД не нужны
+            storage.discard(saved)
+            raise
+        self.report.imported += len(bbs)
+        self.listed_rubrics.update(bb.rubric_id for bb in bbs if bb.is_active)
@@ -0,0 +1,193 @@
+# Замеры времени обработки запросов: общее время, количество и суммарное
+# время SQL-запросов, время рендеринга шаблонов. Замеры текущего запроса
+# хранятся в контекстной переменной, а сводные гистограммы по
+# контроллерам накапливаются в памяти процесса.
+
+import threading
+import time
+from contextvars import ContextVar
+
+from django.template.backends.django import DjangoTemplates, Template
+
+# верхние границы интервалов гистограммы времени ответа, мс
+HISTOGRAM_BOUNDS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_current = ContextVar('request_timing', default=None)
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+class RequestTiming:
+    """
+    Замеры одного запроса. Время хранится в секундах.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total = 0.0
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        # глубина вложенного рендеринга: время учитывается только у
+        # внешнего шаблона, чтобы не сложить его с вложенными
+        self.template_depth = 0
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+
+    def as_dict(self):
+        return {
+                'total_ms': round(self.total * 1000, 3),
+                'db_queries': self.db_queries,
+                'db_ms': round(self.db_time * 1000, 3),
+                'template_ms': round(self.template_time * 1000, 3),
+                }
+
+    def server_timing(self):
+        """
+        Значение заголовка Server-Timing.
+        """
+        return ', '.join((
+            'db;desc="%s queries";dur=%.3f' % (self.db_queries, self.db_time * 1000),
+            'tpl;dur=%.3f' % (self.template_time * 1000),
+            'total;dur=%.3f' % (self.total * 1000),
+            ))
+
+
+def start_timing():
+    """
+    Начинает замеры нового запроса и возвращает токен для stop_timing().
+    """
+    timing = RequestTiming()
+    return timing, _current.set(timing)
+
+
+def stop_timing(token):
+    _current.reset(token)
+
+
+def get_current_timing():
+    return _current.get()
+
+
+def query_timer(execute, sql, params, many, context):
+    """
+    Обертка выполнения SQL-запросов, считающая запросы и их суммарное
+    время в замерах текущего запроса.
+    """
+    timing = _current.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timing.db_queries += 1
+        timing.db_time += time.perf_counter() - start
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """
+    Обработчик сигнала connection_created: подключает query_timer к новому
+    подключению. Обертка ставится на все время жизни подключения, поэтому
+    учитывает и запросы, выполняемые в потоках sync_to_async() при работе
+    под ASGI (замеры запроса попадают туда вместе с контекстом).
+    """
+    if query_timer not in connection.execute_wrappers:
+        # в начало списка, так как connection.execute_wrapper() при выходе
+        # снимает последнюю обертку
+        connection.execute_wrappers.insert(0, query_timer)
+
+
+class TimedTemplate(Template):
+    """
+    Шаблон, время рендеринга которого добавляется к замерам запроса.
+    """
+    def render(self, context=None, request=None):
+        timing = _current.get()
+        if timing is None:
+            return super().render(context, request)
+        timing.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timing.template_depth -= 1
+            if not timing.template_depth:
+                timing.template_time += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    Шаблонизатор Django, выдающий шаблоны с замером времени рендеринга.
+    Подключается в параметре BACKEND настройки TEMPLATES.
+    """
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+class Histogram:
+    """
+    Сводные замеры одного контроллера: количество запросов, суммы и
+    максимум, распределение времени ответа по интервалам HISTOGRAM_BOUNDS
+    (последний интервал - все, что дольше).
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+
+    def add(self, timing):
+        total_ms = timing.total * 1000
+        self.count += 1
+        self.total += timing.total
+        self.max = max(self.max, timing.total)
+        self.db_queries += timing.db_queries
+        self.db_time += timing.db_time
+        self.template_time += timing.template_time
+        for i, bound in enumerate(HISTOGRAM_BOUNDS):
+            if total_ms <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def as_dict(self):
+        labels = ['<=%s' % bound for bound in HISTOGRAM_BOUNDS]
+        labels.append('>%s' % HISTOGRAM_BOUNDS[-1])
+        return {
+                'count': self.count,
+                'mean_ms': round(self.total * 1000 / self.count, 3),
+                'max_ms': round(self.max * 1000, 3),
+                'mean_db_queries': round(self.db_queries / self.count, 2),
+                'mean_db_ms': round(self.db_time * 1000 / self.count, 3),
+                'mean_template_ms': round(self.template_time * 1000 / self.count, 3),
+                'buckets': dict(zip(labels, self.buckets)),
+                }
+
+
+def record(view_name, timing):
+    with _histograms_lock:
+        if view_name not in _histograms:
+            _histograms[view_name] = Histogram()
+        _histograms[view_name].add(timing)
+
+
+def dump_histograms(reset=False):
+    """
+    Возвращает сводные замеры всех контроллеров; при reset=True
+    накопленные данные после этого сбрасываются.
+    """
+    with _histograms_lock:
+        result = {name: histogram.as_dict()
+                for name, histogram in sorted(_histograms.items())}
+        if reset:
+            _histograms.clear()
+    return result
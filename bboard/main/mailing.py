@@ -0,0 +1,116 @@
+# Фоновая пакетная отправка писем с требованием активации
+
+import threading
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import transaction
+from django.utils import timezone
+from loguru import logger
+
+from .background import submit
+from .models import ActivationLetter
+from .utilities import make_activation_message
+
+# в пределах процесса письма отправляет только один поток
+_delivery_lock = threading.Lock()
+
+
+def enqueue_activation_letters(users):
+    """
+    Ставит письма с требованием активации в очередь. Отправка начнется
+    в фоне после фиксации транзакции и не задерживает ответ на запрос.
+    """
+    letters = ActivationLetter.objects.bulk_create(
+            [ActivationLetter(user=user) for user in users]
+            )
+    if letters:
+        transaction.on_commit(lambda: submit(deliver_pending, pool='mail'))
+    return letters
+
+
+def claim_batch(now):
+    """
+    Забирает пакет писем, время отправки которых подошло. Письма пакета
+    помечаются общим ключом, а следующая попытка откладывается на время
+    аренды: если процесс упадет во время отправки, письма вернутся в очередь.
+    """
+    pks = list(ActivationLetter.objects.filter(
+            status=ActivationLetter.PENDING,
+            next_attempt_at__lte=now
+            ).values_list('pk', flat=True)[:settings.ACTIVATION_MAIL_BATCH_SIZE])
+    if not pks:
+        return []
+    batch = uuid.uuid4().hex
+    lease = now + timedelta(seconds=settings.ACTIVATION_MAIL_LEASE)
+    ActivationLetter.objects.filter(
+            pk__in=pks,
+            status=ActivationLetter.PENDING,
+            next_attempt_at__lte=now
+            ).update(batch=batch, next_attempt_at=lease)
+    return list(ActivationLetter.objects.filter(batch=batch).select_related('user'))
+
+
+def retry_later(letter, error, now):
+    """
+    Записывает неудачную попытку. Задержка перед следующей попыткой
+    удваивается; после ACTIVATION_MAIL_MAX_ATTEMPTS попыток письмо
+    считается недоставленным.
+    """
+    letter.attempts += 1
+    letter.last_error = str(error)
+    if letter.attempts >= settings.ACTIVATION_MAIL_MAX_ATTEMPTS:
+        letter.status = ActivationLetter.FAILED
+    else:
+        delay = settings.ACTIVATION_MAIL_RETRY_DELAY * 2 ** (letter.attempts - 1)
+        letter.next_attempt_at = now + timedelta(seconds=delay)
+    letter.save(update_fields=('attempts', 'last_error', 'status', 'next_attempt_at'))
+
+
+def deliver_batch(letters, now):
+    """
+    Отправляет пакет писем через одно соединение с SMTP-сервером.
+    Возвращает количество отправленных писем.
+    """
+    sent = 0
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        logger.warning(f'SMTP connection failed: {e}')
+        for letter in letters:
+            retry_later(letter, e, now)
+        return sent
+    try:
+        for letter in letters:
+            try:
+                connection.send_messages([make_activation_message(letter.user)])
+            except Exception as e:
+                retry_later(letter, e, now)
+            else:
+                letter.attempts += 1
+                letter.status = ActivationLetter.SENT
+                letter.sent_at = timezone.now()
+                letter.save(update_fields=('attempts', 'status', 'sent_at'))
+                sent += 1
+    finally:
+        connection.close()
+    return sent
+
+
+def deliver_pending():
+    """
+    Отправляет пакетами все письма, время отправки которых подошло.
+    Возвращает количество отправленных писем.
+    """
+    sent = 0
+    with _delivery_lock:
+        while True:
+            now = timezone.now()
+            letters = claim_batch(now)
+            if not letters:
+                break
+            sent += deliver_batch(letters, now)
+    return sent
@@ -0,0 +1,64 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from main.benchmark import environment_info, pick_fixture, run_load, seeded_database
+
+
+class Command(BaseCommand):
+    """
+    Сравнивает обслуживание страниц, только читающих данные, под WSGI
+    (синхронные контроллеры, пул потоков) и под ASGI (асинхронные
+    контроллеры main.async_views): запросы в секунду, время ответа,
+    количество потоков и пиковый объем выделенной памяти при большом
+    количестве одновременных запросов. Выводит результаты в формате JSON.
+    """
+    help = 'Сравнивает производительность сайта под WSGI и ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000,
+                help='Количество запросов в прогоне')
+        parser.add_argument('--concurrency', type=int, default=100,
+                help='Количество одновременных запросов')
+        parser.add_argument('--servers', default='wsgi,asgi',
+                help='Сравниваемые интерфейсы через запятую')
+        parser.add_argument('--bbs', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--no-page-cache', action='store_true',
+                help='Отключить кэширование страниц для гостей')
+        parser.add_argument('--output', default=None,
+                help='Файл для записи результатов (по умолчанию - стандартный вывод)')
+
+    def handle(self, *args, **options):
+        servers = [server.strip() for server in options['servers'].split(',')]
+        dataset = {'bbs': options['bbs'], 'seed': options['seed']}
+        results = {}
+        with seeded_database(self.stderr, options['no_page_cache'], database_file=True,
+                **dataset):
+            user, bb = pick_fixture()
+            if bb is None:
+                raise CommandError('Нет объявлений для замера')
+            urls = [
+                    reverse('main:index'),
+                    reverse('main:by_rubric', kwargs={'pk': bb.rubric_id}),
+                    reverse('main:detail', kwargs={'rubric_pk': bb.rubric_id, 'pk': bb.pk}),
+                    reverse('main:other', kwargs={'page': 'about'}),
+                    ]
+            for server in servers:
+                self.stderr.write('%s...' % server)
+                results[server] = run_load(server, urls, options['requests'],
+                        options['concurrency'])
+        report = {
+                'environment': environment_info(),
+                'dataset': dataset,
+                'page_cache': not options['no_page_cache'],
+                'urls': urls,
+                'servers': results,
+                }
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                output.write(text + '\n')
+        else:
+            self.stdout.write(text)
@@ -0,0 +1,53 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.benchmark import (default_scenarios, environment_info, pick_fixture,
+        run_benchmark, seeded_database)
+from main.management.commands.seed_bboard import SEED_PASSWORD
+
+
+class Command(BaseCommand):
+    """
+    Замеряет время ответа, количество SQL-запросов и расход памяти для
+    каждого маршрута main.urls и выводит результаты в формате JSON.
+    По умолчанию замер выполняется на временной тестовой БД, заполненной
+    командой seed_bboard, поэтому рабочая БД не изменяется.
+    """
+    help = 'Замеряет производительность всех контроллеров приложения main'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20,
+                help='Количество замеров каждого маршрута')
+        parser.add_argument('--warmup', type=int, default=2,
+                help='Количество прогревочных запросов перед замером')
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--bbs', type=int, default=1000)
+        parser.add_argument('--comments', type=int, default=5)
+        parser.add_argument('--images', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--no-page-cache', action='store_true',
+                help='Отключить кэширование страниц для гостей')
+        parser.add_argument('--output', default=None,
+                help='Файл для записи результатов (по умолчанию - стандартный вывод)')
+
+    def handle(self, *args, **options):
+        dataset = {key: options[key] for key in ('users', 'bbs', 'comments', 'images', 'seed')}
+        with seeded_database(self.stderr, options['no_page_cache'], **dataset):
+            user, bb = pick_fixture()
+            if bb is None:
+                raise CommandError('Нет объявлений для замера')
+            results = run_benchmark(default_scenarios(user, bb), user, SEED_PASSWORD,
+                    iterations=options['iterations'], warmup=options['warmup'])
+        report = {
+                'environment': environment_info(),
+                'dataset': dataset,
+                'page_cache': not options['no_page_cache'],
+                'views': results,
+                }
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                output.write(text + '\n')
+        else:
+            self.stdout.write(text)
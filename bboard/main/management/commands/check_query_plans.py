@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from main.queryplans import check_query_plans
+
+
+class Command(BaseCommand):
+    """
+    Выводит планы запросов основных страниц сайта и завершается ошибкой,
+    если какой-либо запрос просматривает таблицу целиком или сортирует
+    записи во временном B-дереве.
+    """
+    help = 'Проверяет планы запросов основных страниц сайта'
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Проверка поддерживается только для SQLite')
+        failed = []
+        for name, (plan, problems) in check_query_plans().items():
+            self.stdout.write(name)
+            for line in plan:
+                self.stdout.write('    ' + line)
+            if problems:
+                failed.append(name)
+        if failed:
+            raise CommandError('Неудачные планы запросов: %s' % ', '.join(failed))
+        self.stdout.write(self.style.SUCCESS('Все запросы используют индексы'))
@@ -0,0 +1,73 @@
+from collections import Counter, defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from main.caching import bump_bbs_generation
+from main.deletion import chunked
+from main.models import Bb, AdditionalImage
+from main.storage import is_blob_name
+
+MODELS = (Bb, AdditionalImage)
+
+
+class Command(BaseCommand):
+    """
+    Переносит изображения объявлений, сохраненные под прежними именами по
+    отметке времени, в хранилище с именами по хэшу содержимого: файл
+    копируется под новым именем (одинаковые файлы - в один), записи
+    переключаются на новое имя, старый файл удаляется. Имена обрабатываются
+    порциями, каждая порция в отдельной транзакции. Миниатюры для новых
+    имен создает команда generate_thumbnails.
+    """
+    help = 'Переносит изображения объявлений в хранилище по хэшу содержимого'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                help='Количество имен файлов, переносимых в одной транзакции')
+
+    def handle(self, *args, **options):
+        storage = Bb._meta.get_field('image').storage
+        refs = Counter()
+        for model in MODELS:
+            rows = (model.objects.exclude(image='').order_by()
+                    .values_list('image').annotate(count=Count('pk')))
+            refs.update({name: count for name, count in rows if not is_blob_name(name)})
+        moved = merged = missing = 0
+        for batch in chunked(sorted(refs), options['batch_size']):
+            renamed = {}
+            for name in batch:
+                if not storage.exists(name):
+                    self.stderr.write('%s: файл не найден' % name)
+                    missing += 1
+                    continue
+                with storage.open(name) as source:
+                    new_name = storage.get_blob_name(name, source)
+                    if storage.exists(new_name):
+                        merged += 1
+                    else:
+                        storage.store(name, source)
+                renamed[name] = new_name
+            with transaction.atomic():
+                for model in MODELS:
+                    pks = defaultdict(list)
+                    rows = model.objects.filter(image__in=list(renamed)).values_list('pk', 'image')
+                    for pk, name in rows:
+                        pks[renamed[name]].append(pk)
+                    for new_name, new_pks in pks.items():
+                        for chunk in chunked(new_pks):
+                            model.objects.filter(pk__in=chunk).update(image=new_name)
+                new_refs = Counter()
+                for name, new_name in renamed.items():
+                    new_refs[new_name] += refs[name]
+                storage.add_references(new_refs)
+            # старые файлы удаляются только после переключения записей
+            for name in renamed:
+                storage.release(name, refs[name])
+            moved += len(renamed)
+        if moved:
+            bump_bbs_generation()
+        self.stdout.write(self.style.SUCCESS(
+            'Перенесено файлов: %s, из них объединено с одинаковыми: %s, '
+            'не найдено: %s' % (moved, merged, missing)))
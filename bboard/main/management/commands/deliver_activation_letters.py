@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.mailing import deliver_pending
+
+
+class Command(BaseCommand):
+    """
+    Отправляет письма с требованием активации, время отправки которых
+    подошло, в том числе повторные попытки после ошибок. Запускается
+    по расписанию или постоянно, с ключом --loop.
+    """
+    help = 'Отправляет письма с требованием активации из очереди'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+                '--loop', type=int, default=0, metavar='SECONDS',
+                help='Проверять очередь постоянно с указанным интервалом'
+                )
+
+    def handle(self, *args, **options):
+        while True:
+            sent = deliver_pending()
+            self.stdout.write('Отправлено писем: %s' % sent)
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.export import export_lines, export_queryset
+from main.forms import ExportForm
+
+
+class Command(BaseCommand):
+    """
+    Выгружает активные объявления в формате JSON Lines или CSV в файл или
+    в стандартный вывод. Параметры те же, что у адреса export/bbs/.
+    """
+    help = 'Выгружает объявления в формате JSON Lines или CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', default='jsonl', choices=('jsonl', 'csv'))
+        parser.add_argument('--rubric', help='Ключ подрубрики')
+        parser.add_argument('--since', help='Начало промежутка дат публикации')
+        parser.add_argument('--until', help='Конец промежутка (не включается)')
+        parser.add_argument('--output', help='Файл выгрузки (по умолчанию - '
+                'стандартный вывод)')
+
+    def handle(self, *args, **options):
+        form = ExportForm({key: options[key]
+            for key in ('format', 'rubric', 'since', 'until') if options[key]})
+        if not form.is_valid():
+            raise CommandError(form.errors.as_text())
+        data = form.cleaned_data
+        queryset = export_queryset(data['rubric'], data['since'], data['until'])
+        lines = export_lines(queryset, data['format'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from main.models import Bb
+from main.thumbnails import generate_thumbnails
+
+
+class Command(BaseCommand):
+    """
+    Создает недостающие миниатюры для всех изображений объявлений.
+    Файлы обрабатываются параллельно пулом рабочих потоков.
+    """
+    help = 'Создает недостающие миниатюры изображений объявлений'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+                '--workers', type=int, default=4,
+                help='Количество рабочих потоков (по умолчанию 4)'
+                )
+
+    def handle(self, *args, **options):
+        names = Bb.objects.exclude(image='').values_list('image', flat=True).iterator()
+        created = failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for result in executor.map(self.generate, names):
+                if result is None:
+                    failed += 1
+                else:
+                    created += result
+        self.stdout.write(self.style.SUCCESS(
+            'Создано миниатюр: %s, ошибок: %s' % (created, failed)
+            ))
+
+    def generate(self, name):
+        try:
+            return generate_thumbnails(name)
+        except Exception as e:
+            self.stderr.write('%s: %s' % (name, e))
+            return None
+        finally:
+            connections.close_all()
@@ -0,0 +1,43 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+
+from main.imaging import render_variants
+from main.models import Bb, AdditionalImage
+from main.variants import cache_manifest, read_manifest, render_arguments
+
+
+class Command(BaseCommand):
+    """
+    Создает недостающие уменьшенные копии изображений объявлений для
+    страниц объявлений, например, для файлов, загруженных до появления
+    копий. Изображения обрабатываются параллельно пулом процессов.
+    """
+    help = 'Создает недостающие копии изображений для страниц объявлений'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+                '--processes', type=int, default=4,
+                help='Количество процессов (по умолчанию 4)'
+                )
+
+    def handle(self, *args, **options):
+        names = set(Bb.objects.exclude(image='').values_list('image', flat=True))
+        names.update(AdditionalImage.objects.values_list('image', flat=True))
+        names = sorted(name for name in names if read_manifest(name) is None)
+        created = failed = 0
+        with ProcessPoolExecutor(max_workers=options['processes'],
+                mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = {executor.submit(render_variants, *render_arguments(name)): name
+                    for name in names}
+            for future in as_completed(futures):
+                try:
+                    cache_manifest(futures[future], future.result())
+                    created += 1
+                except Exception as e:
+                    self.stderr.write('%s: %s' % (futures[future], e))
+                    failed += 1
+        self.stdout.write(self.style.SUCCESS(
+            'Созданы копии изображений: %s, ошибок: %s' % (created, failed)
+            ))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.importing import BbImporter
+
+
+class Command(BaseCommand):
+    """
+    Импортирует объявления из файла CSV или JSON Lines. Объявления
+    создаются порциями, изображения копируются пулом рабочих потоков.
+    Прерванный импорт продолжается с последней контрольной точки.
+    """
+    help = 'Импортирует объявления из файла CSV или JSON Lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл импорта (.csv или .jsonl)')
+        parser.add_argument('--images-dir', default='',
+                help='Папка, от которой отсчитываются пути к изображениям '
+                '(по умолчанию - папка файла импорта)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                help='Количество объявлений в порции (одна транзакция)')
+        parser.add_argument('--workers', type=int, default=4,
+                help='Количество потоков, копирующих изображения')
+        parser.add_argument('--checkpoint', default=None,
+                help='Файл контрольной точки (по умолчанию - <файл импорта>.checkpoint)')
+        parser.add_argument('--restart', action='store_true',
+                help='Начать импорт сначала, не учитывая контрольную точку')
+
+    def handle(self, *args, **options):
+        checkpoint = options['checkpoint'] or options['path'] + '.checkpoint'
+        importer = BbImporter(options['path'], images_dir=options['images_dir'],
+                batch_size=options['batch_size'], workers=options['workers'],
+                checkpoint=checkpoint, progress=self.progress)
+        if options['restart']:
+            importer.save_checkpoint(0)
+        try:
+            report = importer.run()
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+        if report.skipped_records:
+            self.stdout.write('Пропущено записей, импортированных ранее: %s'
+                    % report.skipped_records)
+        self.stdout.write(self.style.SUCCESS('Импорт завершен: %s' % report))
+
+    def progress(self, report):
+        self.stderr.write(str(report))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from main.caching import bump_bbs_generation
+from main.counters import recount_all
+from main.facets import rebuild_facets
+
+
+class Command(BaseCommand):
+    """
+    Пересчитывает счетчики комментариев и дополнительных иллюстраций всех
+    объявлений и сводную таблицу фасетов рубрик. Нужна после изменений
+    в обход сигналов моделей: пакетных update() и bulk_create(), правки БД
+    вручную, смены границ ценовых интервалов.
+    """
+    help = 'Пересчитывает счетчики объявлений и фасеты рубрик'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000,
+                help='Количество объявлений, пересчитываемых в одной транзакции')
+
+    def handle(self, *args, **options):
+        updated = 0
+        for count in recount_all(options['batch_size']):
+            updated += count
+        rebuild_facets()
+        bump_bbs_generation()
+        self.stdout.write(self.style.SUCCESS('Пересчитано объявлений: %s' % updated))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from main.captchas import refill_pool, REFILL_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    """
+    Удаляет просроченные задания captcha и дополняет пул заранее
+    нарисованных заданий. Запускается периодически (например, cron), пул
+    также пополняется в фоне, когда заданий в нем не остается.
+    """
+    help = 'Пополняет пул заданий captcha и удаляет просроченные задания'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=None,
+                help='Количество действительных заданий в пуле (по умолчанию CAPTCHA_POOL_SIZE)')
+        parser.add_argument('--batch-size', type=int, default=REFILL_BATCH_SIZE,
+                help='Количество заданий, создаваемых одним запросом')
+
+    def handle(self, *args, **options):
+        reaped, created = refill_pool(options['size'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            'Удалено заданий: %s, создано: %s' % (reaped, created)))
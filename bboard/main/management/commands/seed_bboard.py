@@ -0,0 +1,151 @@
+import io
+import random
+import uuid
+from collections import Counter
+
+from PIL import Image
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main.caching import bump_bbs_generation, invalidate_rubric_tree
+from main.facets import rebuild_facets
+from main.models import AdvUser, SuperRubric, SubRubric, Bb, Comment
+from main.search import is_available, rebuild_index
+from main.trigrams import index_titles
+
+# пароль всех созданных пользователей
+SEED_PASSWORD = 'vvvvvvvv11'
+
+WORDS = (
+        'ноутбук', 'телевизор', 'гараж', 'велосипед', 'диван', 'холодильник',
+        'смартфон', 'куртка', 'коляска', 'шкаф', 'монитор', 'палатка',
+        'новый', 'б/у', 'срочно', 'недорого', 'отличный', 'рабочий',
+        'торг', 'обмен', 'доставка', 'самовывоз', 'гарантия', 'комплект',
+        )
+
+
+class Command(BaseCommand):
+    """
+    Заполняет БД синтетическими данными для замеров производительности:
+    пользователи, дерево рубрик, объявления с изображениями и комментарии.
+    Записи создаются пакетами через bulk_create, после чего перестраиваются
+    поисковый индекс и сводная таблица фасетов, индексируются триграммы
+    названий и сбрасываются кэши.
+    """
+    help = 'Заполняет БД синтетическими данными для замеров производительности'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10,
+                help='Количество пользователей')
+        parser.add_argument('--super-rubrics', type=int, default=3,
+                help='Количество надрубрик')
+        parser.add_argument('--sub-rubrics', type=int, default=4,
+                help='Количество подрубрик в каждой надрубрике')
+        parser.add_argument('--bbs', type=int, default=1000,
+                help='Количество объявлений')
+        parser.add_argument('--comments', type=int, default=5,
+                help='Количество комментариев к каждому объявлению')
+        parser.add_argument('--images', type=int, default=10,
+                help='Количество разных изображений, раздаваемых объявлениям '
+                '(0 - объявления без изображений)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                help='Размер пакета bulk_create')
+        parser.add_argument('--seed', type=int, default=None,
+                help='Начальное значение генератора случайных чисел')
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        # метка прогона делает имена пользователей и рубрик уникальными
+        tag = uuid.uuid4().hex[:6]
+        with transaction.atomic():
+            users = self.create_users(tag, options['users'], batch_size)
+            rubrics = self.create_rubrics(tag, options['super_rubrics'],
+                    options['sub_rubrics'])
+            images = self.create_images(options['images'], rnd)
+            bbs = self.create_bbs(options['bbs'], users, rubrics, images, rnd,
+                    batch_size, options['comments'])
+            comments = self.create_comments(bbs, options['comments'], rnd, batch_size)
+            if is_available():
+                rebuild_index(Bb.objects.all())
+            rebuild_facets()
+            index_titles(bbs)
+        invalidate_rubric_tree()
+        bump_bbs_generation()
+        self.stdout.write(self.style.SUCCESS(
+            'Создано: пользователей %s, рубрик %s, объявлений %s, комментариев %s '
+            '(метка %s, пароль %s)' % (len(users), len(rubrics), len(bbs), comments,
+                tag, SEED_PASSWORD)
+            ))
+
+    def create_users(self, tag, count, batch_size):
+        # хеширование пароля долгое, поэтому хеш вычисляется один раз
+        password = make_password(SEED_PASSWORD)
+        users = [AdvUser(username='bench-%s-%s' % (tag, i),
+                    email='bench-%s-%s@example.com' % (tag, i),
+                    password=password, is_activated=True)
+                for i in range(count)]
+        return AdvUser.objects.bulk_create(users, batch_size=batch_size)
+
+    def create_rubrics(self, tag, super_count, sub_count):
+        rubrics = []
+        for i in range(super_count):
+            super_rubric = SuperRubric.objects.create(name='Раздел %s-%s' % (tag, i), order=i)
+            rubrics += SubRubric.objects.bulk_create(
+                    [SubRubric(name='Рубрика %s-%s-%s' % (tag, i, j), order=j,
+                        super_rubric=super_rubric)
+                    for j in range(sub_count)])
+        return rubrics
+
+    def create_images(self, count, rnd):
+        """
+        Сохраняет в хранилище count небольших изображений.
+        """
+        field = Bb._meta.get_field('image')
+        names = []
+        for i in range(count):
+            content = io.BytesIO()
+            color = tuple(rnd.randrange(256) for _ in range(3))
+            Image.new('RGB', (640, 480), color).save(content, 'PNG')
+            name = field.generate_filename(None, 'seed.png')
+            names.append(field.storage.save(name, ContentFile(content.getvalue())))
+        return names
+
+    def create_bbs(self, count, users, rubrics, images, rnd, batch_size, comments):
+        bbs = []
+        for i in range(count):
+            words = rnd.sample(WORDS, 6)
+            bbs.append(Bb(
+                rubric=rnd.choice(rubrics),
+                author=rnd.choice(users),
+                title=' '.join(words[:2])[:40],
+                content=' '.join(words),
+                price=rnd.randrange(100, 100000),
+                contacts='+7 900 000-00-00',
+                image=images[i % len(images)] if images else '',
+                # комментарии создаются без сигналов, поэтому счетчик
+                # заполняется сразу
+                comments_count=comments,
+                ))
+        bbs = Bb.objects.bulk_create(bbs, batch_size=batch_size)
+        # одна ссылка на каждое изображение учтена при его сохранении,
+        # остальные ссылки объявлений добавляются разом
+        refs = Counter(bb.image.name for bb in bbs if bb.image) - Counter(images)
+        Bb._meta.get_field('image').storage.add_references(refs)
+        return bbs
+
+    def create_comments(self, bbs, per_bb, rnd, batch_size):
+        created = 0
+        comments = []
+        for bb in bbs:
+            for i in range(per_bb):
+                comments.append(Comment(bb=bb, author='гость %s' % i,
+                    content=' '.join(rnd.sample(WORDS, 4))))
+            if len(comments) >= batch_size:
+                created += len(Comment.objects.bulk_create(comments))
+                comments = []
+        created += len(Comment.objects.bulk_create(comments))
+        return created
@@ -0,0 +1,39 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    """
+    Обновляет реплики SQLite, перечисленные в настройке DATABASE_REPLICAS,
+    копируя в них основную БД средствами резервного копирования SQLite
+    (копирование безопасно и при работающем сайте). Нужна для проверки
+    работы с репликами на локальной машине; настоящие реплики других СУБД
+    обновляет сама СУБД.
+    """
+    help = 'Копирует основную БД SQLite в файлы реплик'
+
+    def handle(self, *args, **options):
+        primary = connections['default']
+        if primary.vendor != 'sqlite':
+            raise CommandError('Копирование поддерживается только для SQLite')
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('Реплики не заданы (переменная окружения '
+                    'BBOARD_DATABASE_REPLICAS)')
+        source = sqlite3.connect(primary.settings_dict['NAME'])
+        try:
+            for alias in settings.DATABASE_REPLICAS:
+                # подключение Django к реплике закрывается на время копирования
+                connections[alias].close()
+                name = connections[alias].settings_dict['NAME']
+                target = sqlite3.connect(name)
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write('%s: %s' % (alias, name))
+        finally:
+            source.close()
+        self.stdout.write(self.style.SUCCESS('Реплики обновлены'))
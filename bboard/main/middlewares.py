@@ -1,31 +1,54 @@
-# Обработчик контекста
+# Обработчик контекста и посредники
+
+import asyncio
+from urllib.parse import urlencode
+
+from django.conf import settings
+from loguru import logger
+
+from .caching import get_rubric_tree
+from .facets import get_rubric_counts
+from .instrumentation import record, start_timing, stop_timing
+from .routers import start_tracking_writes, stop_tracking_writes
+
+# параметры запроса, задающие искомое слово и фильтры списка объявлений
+FILTER_PARAMS = ('keyword', 'bucket', 'price_min', 'price_max', 'sort')
 
-from .models import SubRubric
 
 def bboard_context_processor(request):
     """
     Обработчик контекста, добавляющий во все запросы к шаблонам переменную
-    rubrics, содержащую список всех подрубрик. Нужен чтобы не передавать эту
-    переменную во всех контроллерах.
+    rubrics, содержащую дерево рубрик (надрубрики с вложенными подрубриками),
+    и переменную rubric_counts с количеством активных объявлений в каждой
+    рубрике. Нужен чтобы не передавать эти переменные во всех контроллерах.
+    Дерево и количество объявлений берутся из кэша и запросов к БД не
+    требуют. Асинхронные контроллеры читают дерево заранее, не переходя в
+    поток, и передают его в атрибуте запроса rubric_tree.
 
     Также нужен, чтобы внести две переменные, хранящие страницу пагинатора и 
-    поисковое слово для возврата на эти страницы после просмотра подробностей
-    объявления, найденного поиском, или отображенного на странице пагинатора.
+    поисковое слово (вместе с фильтрами по цене и порядком вывода) для
+    возврата на эти страницы после просмотра подробностей объявления,
+    найденного поиском, или отображенного на странице пагинатора.
     """
     # добавляет список всех рубрик в контест всех шаблонов
     context = {}
-    context['rubrics'] = SubRubric.objects.all()
+    context['rubrics'] = getattr(request, 'rubric_tree', None)
+    if context['rubrics'] is None:
+        context['rubrics'] = get_rubric_tree()
+    context['rubric_counts'] = get_rubric_counts()
 
     # блок кода для комфортного возврата на страницу пагинатора
     # и на список найденных объявлений после просмотра подробностей
     context['keyword'] = ''
     context['all'] = ''
-    if 'keyword' in request.GET:
-        keyword = request.GET['keyword']
-        if keyword:
-            context['keyword'] = '?keyword=' + keyword
-            context['all'] = context['keyword']
-    if 'page' in request.GET:
+    params = [(name, request.GET[name]) for name in FILTER_PARAMS if request.GET.get(name)]
+    if params:
+        context['keyword'] = '?' + urlencode(params)
+        context['all'] = context['keyword']
+    if 'cursor' in request.GET:
+        # курсор уже содержит искомое слово и фильтры
+        context['all'] = '?cursor=' + request.GET['cursor']
+    elif 'page' in request.GET:
         page = request.GET['page']
         if page != '1':
             if context['all']:
@@ -33,3 +56,88 @@ def bboard_context_processor(request):
             else:
                 context['all'] = '?page=' + page
     return context
+
+
+class AsyncCapableMiddleware:
+    """
+    Основа посредников, работающих и под WSGI, и под ASGI без переключения
+    в поток: если следующий обработчик - сопрограмма, посредник тоже
+    объявляет себя сопрограммой (так же поступает MiddlewareMixin).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        state = self.before(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.cleanup(state)
+        return self.after(request, response, state)
+
+    async def __acall__(self, request):
+        state = self.before(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.cleanup(state)
+        return self.after(request, response, state)
+
+
+class RequestTimingMiddleware(AsyncCapableMiddleware):
+    """
+    Посредник, замеряющий обработку каждого запроса: общее время,
+    количество и время SQL-запросов, время рендеринга шаблонов. Замеры
+    отправляются в журнал, добавляются в сводную гистограмму контроллера
+    и, если задана настройка SERVER_TIMING, выводятся в заголовке
+    Server-Timing. Должен стоять первым в списке MIDDLEWARE.
+    """
+    def before(self, request):
+        return start_timing()
+
+    def cleanup(self, state):
+        stop_timing(state[1])
+
+    def after(self, request, response, state):
+        timing = state[0]
+        timing.finish()
+        match = request.resolver_match
+        view_name = match.view_name if match else 'unresolved'
+        record(view_name, timing)
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = timing.server_timing()
+        data = timing.as_dict()
+        logger.bind(view=view_name, method=request.method, path=request.path,
+                status=response.status_code, **data).debug(
+                        f'{request.method} {request.path} -> {view_name} '
+                        f'{response.status_code} {data["total_ms"]} ms, '
+                        f'{data["db_queries"]} queries')
+        return response
+
+
+class ReplicaStickinessMiddleware(AsyncCapableMiddleware):
+    """
+    Посредник, отслеживающий запись в БД при обработке запроса. Если
+    запрос изменил данные, читаемые с реплик (объявления, рубрики,
+    комментарии), клиенту ставится cookie, с которой его запросы в течение
+    REPLICA_STICKY_SECONDS читаются с основной БД (см. main.routers).
+    """
+    def before(self, request):
+        return start_tracking_writes()
+
+    def cleanup(self, state):
+        stop_tracking_writes(state[1])
+
+    def after(self, request, response, state):
+        if state[0].wrote:
+            response.set_cookie(settings.REPLICA_STICKY_COOKIE, '1',
+                    max_age=settings.REPLICA_STICKY_SECONDS, httponly=True,
+                    samesite='Lax')
+        return response
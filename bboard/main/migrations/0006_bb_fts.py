@@ -0,0 +1,68 @@
+import re
+
+from django.db import migrations
+
+# копия имени таблицы и нормализации текста из main.search на момент
+# создания миграции: последующие изменения модуля не должны менять
+# то, как миграция заполняет индекс
+FTS_TABLE = 'main_bb_fts'
+
+RU_ENDINGS = (
+        'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+        'ией', 'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие',
+        'ах', 'ях', 'ов', 'ев', 'ом', 'ем', 'ам', 'ям', 'ую', 'юю',
+        'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+        )
+
+MIN_STEM_LENGTH = 3
+
+WORD_RE = re.compile(r'\w+')
+
+
+def stem(word):
+    for ending in RU_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def normalize_text(text):
+    text = text.casefold().replace('ё', 'е')
+    return ' '.join(stem(word) for word in WORD_RE.findall(text))
+
+
+def create_fts_index(apps, schema_editor):
+    """
+    Создает виртуальную таблицу FTS5 и заполняет ее существующими
+    объявлениями. На СУБД, отличных от SQLite, ничего не делает.
+    """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Bb = apps.get_model('main', 'Bb')
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+                "CREATE VIRTUAL TABLE %s USING fts5(title, content, tokenize='unicode61')" % FTS_TABLE
+                )
+        cursor.executemany(
+                'INSERT INTO %s (rowid, title, content) VALUES (%%s, %%s, %%s)' % FTS_TABLE,
+                [(pk, normalize_text(title), normalize_text(content))
+                    for pk, title, content in Bb.objects.values_list('pk', 'title', 'content')]
+                )
+
+
+def drop_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS %s' % FTS_TABLE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_comment'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_index, drop_fts_index),
+    ]
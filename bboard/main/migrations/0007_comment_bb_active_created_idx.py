@@ -0,0 +1,17 @@
+# Generated by Django 4.0.4 on 2026-10-18 14:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_bb_fts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['bb', 'is_active', 'created_at', 'id'], name='comment_bb_active_created_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.0.4 on 2026-10-18 14:14
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_comment_bb_active_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivationLetter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает отправки'), ('sent', 'Отправлено'), ('failed', 'Не доставлено')], default='pending', max_length=10, verbose_name='Состояние')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Попыток отправки')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Следующая попытка')),
+                ('batch', models.CharField(blank=True, max_length=32, verbose_name='Пакет отправки')),
+                ('last_error', models.TextField(blank=True, verbose_name='Последняя ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Поставлено в очередь')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Отправлено')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Письмо активации',
+                'verbose_name_plural': 'Письма активации',
+                'ordering': ['next_attempt_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='activationletter',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='letter_status_next_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.0.4 on 2026-10-18 14:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_activationletter'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='comment_bb_active_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='bb',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['created_at', 'id'], name='bb_active_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bb',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['rubric', 'created_at', 'id'], name='bb_rubric_active_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bb',
+            index=models.Index(fields=['author', 'created_at', 'id'], name='bb_author_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['bb', 'created_at', 'id'], name='comment_bb_active_created_idx'),
+        ),
+    ]
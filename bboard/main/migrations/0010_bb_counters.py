@@ -0,0 +1,45 @@
+# Generated by Django 4.0.4 on 2026-10-18 14:38
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    """
+    Заполняет счетчики существующих объявлений.
+    """
+    Bb = apps.get_model('main', 'Bb')
+    AdditionalImage = apps.get_model('main', 'AdditionalImage')
+    Comment = apps.get_model('main', 'Comment')
+
+    def count_related(model, **filters):
+        counts = (model.objects.filter(bb=OuterRef('pk'), **filters).order_by()
+                .values('bb').annotate(count=Count('pk')).values('count'))
+        return Coalesce(Subquery(counts), Value(0))
+
+    Bb.objects.update(
+            comments_count=count_related(Comment, is_active=True),
+            images_count=count_related(AdditionalImage),
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bb',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Активных комментариев'),
+        ),
+        migrations.AddField(
+            model_name='bb',
+            name='images_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Дополнительных иллюстраций'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 4.0.4 on 2026-10-18 14:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Case, Count, IntegerField, Value, When
+
+# границы ценовых интервалов на момент создания миграции (копия
+# main.facets.PRICE_BOUNDS): последующая смена границ выполняется
+# пересчетом командой recount_bbs и не должна менять эту миграцию
+PRICE_BOUNDS = (1000, 5000, 10000, 50000, 100000)
+
+
+def bucket_expression():
+    return Case(
+            *[When(price__lt=bound, then=Value(i)) for i, bound in enumerate(PRICE_BOUNDS)],
+            default=Value(len(PRICE_BOUNDS)),
+            output_field=IntegerField()
+            )
+
+
+def fill_facets(apps, schema_editor):
+    """
+    Заполняет сводную таблицу фасетов по существующим объявлениям.
+    """
+    Bb = apps.get_model('main', 'Bb')
+    RubricFacet = apps.get_model('main', 'RubricFacet')
+    rows = (Bb.objects.filter(is_active=True).order_by()
+            .annotate(bucket=bucket_expression())
+            .values_list('rubric', 'bucket').annotate(count=Count('pk')))
+    RubricFacet.objects.bulk_create([
+        RubricFacet(rubric_id=rubric, bucket=bucket, count=count)
+        for rubric, bucket, count in rows
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_bb_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RubricFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.SmallIntegerField(verbose_name='Ценовой интервал')),
+                ('count', models.IntegerField(default=0, verbose_name='Активных объявлений')),
+            ],
+            options={
+                'verbose_name': 'Фасет рубрики',
+                'verbose_name_plural': 'Фасеты рубрик',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='bb',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['rubric', 'price', 'id'], name='bb_rubric_active_price_idx'),
+        ),
+        migrations.AddField(
+            model_name='rubricfacet',
+            name='rubric',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.subrubric', verbose_name='Рубрика'),
+        ),
+        migrations.AddConstraint(
+            model_name='rubricfacet',
+            constraint=models.UniqueConstraint(fields=('rubric', 'bucket'), name='rubric_facet_unique'),
+        ),
+        migrations.RunPython(fill_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.0.4 on 2026-10-18 14:47
+
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# копия разбиения на триграммы из main.trigrams на момент создания
+# миграции: последующие изменения модуля не должны менять то, как
+# миграция заполняет индекс
+WORD_RE = re.compile(r'\w+')
+
+
+def trigrams(text):
+    result = set()
+    for word in WORD_RE.findall(text.casefold().replace('ё', 'е')):
+        padded = '  %s ' % word
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def fill_trigrams(apps, schema_editor):
+    """
+    Заполняет индекс триграммами названий существующих объявлений.
+    """
+    Bb = apps.get_model('main', 'Bb')
+    TitleTrigram = apps.get_model('main', 'TitleTrigram')
+    TitleTrigram.objects.bulk_create((
+        TitleTrigram(bb_id=pk, trigram=trigram)
+        for pk, title in Bb.objects.values_list('pk', 'title').iterator()
+        for trigram in trigrams(title)
+        ), batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_rubric_facets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TitleTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3, verbose_name='Триграмма')),
+                ('bb', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.bb', verbose_name='Объявление')),
+            ],
+            options={
+                'verbose_name': 'Триграмма названия',
+                'verbose_name_plural': 'Триграммы названий',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='titletrigram',
+            constraint=models.UniqueConstraint(fields=('trigram', 'bb'), name='title_trigram_unique'),
+        ),
+        migrations.RunPython(fill_trigrams, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.0.4 on 2026-10-18 14:54
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count
+import main.storage
+import main.utilities
+
+
+def fill_blobs(apps, schema_editor):
+    """
+    Заводит счетчики ссылок на файлы существующих объявлений и
+    дополнительных иллюстраций; один файл может быть назначен нескольким
+    записям (например, созданным командой seed_bboard).
+    """
+    refs = Counter()
+    for model_name in ('Bb', 'AdditionalImage'):
+        model = apps.get_model('main', model_name)
+        rows = (model.objects.exclude(image='').order_by()
+                .values_list('image').annotate(count=Count('pk')))
+        refs.update(dict(rows.iterator()))
+    MediaBlob = apps.get_model('main', 'MediaBlob')
+    MediaBlob.objects.bulk_create(
+            (MediaBlob(name=name, refs=count) for name, count in refs.items()),
+            batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_title_trigrams'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Имя файла')),
+                ('refs', models.PositiveIntegerField(default=0, verbose_name='Ссылок')),
+            ],
+            options={
+                'verbose_name': 'Файл изображения',
+                'verbose_name_plural': 'Файлы изображений',
+            },
+        ),
+        migrations.AlterField(
+            model_name='additionalimage',
+            name='image',
+            field=models.ImageField(storage=main.storage.ContentAddressedStorage(), upload_to=main.utilities.get_timestamp_path, verbose_name='Изображение'),
+        ),
+        migrations.AlterField(
+            model_name='bb',
+            name='image',
+            field=models.ImageField(blank=True, storage=main.storage.ContentAddressedStorage(), upload_to=main.utilities.get_timestamp_path, verbose_name='Изображение'),
+        ),
+        migrations.RunPython(fill_blobs, migrations.RunPython.noop),
+    ]
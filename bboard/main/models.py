@@ -1,8 +1,10 @@
-from django.db import models
+from django.db import models, router, transaction
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 
 # импорт для модели объявлений и модели дополнительных изображений
 from .utilities import get_timestamp_path
+from .storage import is_blob_name, media_storage
 
 class AdvUser(AbstractUser):
     """
@@ -20,13 +22,13 @@ class AdvUser(AbstractUser):
 
     def delete(self, *args, **kwargs):
         """
-        Используется менеджер обратной связи для перебора связанных
-        с пользователем объявлений, для удаления всех его файлов в БД
-        с помощью django_cleanup.
+        Все объявления пользователя удаляются массово, несколькими запросами,
+        а их файлы - в фоне после фиксации транзакции.
         """
-        for bb in self.bb_set.all():
-            bb.delete()
-        super().delete(*args, **kwargs)
+        from .deletion import delete_bbs
+        with transaction.atomic():
+            delete_bbs(self.bb_set.all())
+            return super().delete(*args, **kwargs)
 
     class Meta(AbstractUser.Meta):
         pass
@@ -103,7 +105,26 @@ class SubRubric(Rubric):
         verbose_name_plural = 'Подрубрики'
 
 
-class Bb(models.Model):
+class ImageBlobMixin:
+    """
+    Сохранение записи с изображением из хранилища media_storage. Ссылка на
+    загруженный файл добавляется при сохранении файла, поэтому запись и
+    ссылка сохраняются в одной транзакции: если запись не сохранится,
+    ссылка отменяется вместе с ней, а файл, на который не осталось ссылок,
+    удаляется.
+    """
+    def save(self, *args, **kwargs):
+        uploaded = self.image and not self.image._committed
+        try:
+            with transaction.atomic(using=router.db_for_write(type(self), instance=self)):
+                super().save(*args, **kwargs)
+        except Exception:
+            if uploaded and is_blob_name(self.image.name):
+                self.image.storage.discard([self.image.name])
+            raise
+
+
+class Bb(ImageBlobMixin, models.Model):
     """
     Модель объявлений. Связана с двумя первичными моделями -
     SubRubric и Advuser.
@@ -130,6 +151,7 @@ class Bb(models.Model):
     image = models.ImageField(
             blank = True,
             upload_to = get_timestamp_path,
+            storage = media_storage,
             verbose_name = 'Изображение'
             )
     author = models.ForeignKey(
@@ -147,25 +169,128 @@ class Bb(models.Model):
             db_index = True,
             verbose_name = 'Опубликовано'
             )
+    # Денормализованные счетчики связанных записей, поддерживаемые
+    # обработчиками сигналов (см. модуль counters). Позволяют выводить их
+    # в списках объявлений и не запрашивать пустые связи без лишних
+    # запросов к БД.
+    comments_count = models.PositiveIntegerField(
+            default = 0,
+            editable = False,
+            verbose_name = 'Активных комментариев'
+            )
+    images_count = models.PositiveIntegerField(
+            default = 0,
+            editable = False,
+            verbose_name = 'Дополнительных иллюстраций'
+            )
 
     def delete(self, *args, **kwargs):
         """
-        Переопределенный метод для удаления всех связанных с объявлениями 
-        дополнительных иллюстраций. Используется менеджер обратной связи.
-        При удалении возникает сигнал post_delete, который перехватывается
-        утилитой django_cleanup, которая и удаляет все файлы в БД.
+        Переопределенный метод, удаляющий объявление вместе с комментариями
+        и дополнительными иллюстрациями тем же путем, что и массовое удаление.
+        Файлы изображений удаляются в фоне после фиксации транзакции.
+        Возвращает, как и Model.delete(), пару (количество, {модель:
+        количество}).
         """
-        for ai in self.additionalimage_set.all():
-            ai.delete()
-        super().delete(*args, **kwargs)
+        from .deletion import delete_bbs
+        deleted = delete_bbs(Bb.objects.filter(pk=self.pk))
+        return deleted, {self._meta.label: deleted}
 
     class Meta:
         verbose_name_plural = 'Объявления'
         verbose_name = 'Объявление'
         ordering = ['-created_at']
+        # Составные индексы под выборки контроллеров. Условие is_active
+        # Django передает в SQL как WHERE "is_active" (без сравнения), по
+        # такому условию SQLite не ищет в индексе, поэтому индексы активных
+        # записей сделаны частичными.
+        indexes = [
+                # активные объявления, новые первыми (главная страница)
+                models.Index(
+                    fields=['created_at', 'id'],
+                    condition=models.Q(is_active=True),
+                    name='bb_active_created_idx'
+                    ),
+                # активные объявления рубрики, новые первыми (by_rubric)
+                models.Index(
+                    fields=['rubric', 'created_at', 'id'],
+                    condition=models.Q(is_active=True),
+                    name='bb_rubric_active_created_idx'
+                    ),
+                # активные объявления рубрики по цене (фильтр по
+                # диапазону цен и сортировка по цене в by_rubric)
+                models.Index(
+                    fields=['rubric', 'price', 'id'],
+                    condition=models.Q(is_active=True),
+                    name='bb_rubric_active_price_idx'
+                    ),
+                # объявления пользователя (profile)
+                models.Index(
+                    fields=['author', 'created_at', 'id'],
+                    name='bb_author_created_idx'
+                    ),
+                ]
 
 
-class AdditionalImage(models.Model):
+class TitleTrigram(models.Model):
+    """
+    Триграмма названия объявления; индекс нечеткого поиска по названиям
+    (см. модуль trigrams).
+    """
+    trigram = models.CharField(
+            max_length=3,
+            verbose_name='Триграмма'
+            )
+    bb = models.ForeignKey(
+            Bb,
+            on_delete=models.CASCADE,
+            verbose_name='Объявление'
+            )
+
+    class Meta:
+        verbose_name_plural = 'Триграммы названий'
+        verbose_name = 'Триграмма названия'
+        constraints = [
+                # выборка объявлений по триграммам без обращения к таблице
+                models.UniqueConstraint(
+                    fields=['trigram', 'bb'],
+                    name='title_trigram_unique'
+                    ),
+                ]
+
+
+class RubricFacet(models.Model):
+    """
+    Сводная таблица фасетов: количество активных объявлений подрубрики
+    в ценовом интервале (см. модуль facets).
+    """
+    rubric = models.ForeignKey(
+            SubRubric,
+            on_delete=models.CASCADE,
+            verbose_name='Рубрика'
+            )
+    bucket = models.SmallIntegerField(
+            verbose_name='Ценовой интервал'
+            )
+    # не PositiveIntegerField: рассогласование счетчика не должно мешать
+    # сохранению объявлений, его исправляет команда recount_bbs
+    count = models.IntegerField(
+            default=0,
+            verbose_name='Активных объявлений'
+            )
+
+    class Meta:
+        verbose_name_plural = 'Фасеты рубрик'
+        verbose_name = 'Фасет рубрики'
+        constraints = [
+                models.UniqueConstraint(
+                    fields=['rubric', 'bucket'],
+                    name='rubric_facet_unique'
+                    ),
+                ]
+
+
+class AdditionalImage(ImageBlobMixin, models.Model):
     """
     Модель дополнительных изображений.
     """
@@ -176,6 +301,7 @@ class AdditionalImage(models.Model):
             )
     image = models.ImageField(
             upload_to = get_timestamp_path,
+            storage = media_storage,
             verbose_name = 'Изображение'
             )
 
@@ -184,6 +310,26 @@ class AdditionalImage(models.Model):
         verbose_name = 'Дополнительная иллюстрация'
 
 
+class MediaBlob(models.Model):
+    """
+    Файл изображения в хранилище media_storage и количество записей,
+    ссылающихся на него (см. модуль storage).
+    """
+    name = models.CharField(
+            max_length=100,
+            unique=True,
+            verbose_name='Имя файла'
+            )
+    refs = models.PositiveIntegerField(
+            default=0,
+            verbose_name='Ссылок'
+            )
+
+    class Meta:
+        verbose_name_plural = 'Файлы изображений'
+        verbose_name = 'Файл изображения'
+
+
 class Comment(models.Model):
     """
     Модель комментария. Связана с моделью объявлений.
@@ -215,3 +361,76 @@ class Comment(models.Model):
         verbose_name_plural = 'Комментарии'
         verbose_name = 'Комментарий'
         ordering = ['created_at',]
+        indexes = [
+                # выборка активных комментариев объявления по дате
+                models.Index(
+                    fields=['bb', 'created_at', 'id'],
+                    condition=models.Q(is_active=True),
+                    name='comment_bb_active_created_idx'
+                    ),
+                ]
+
+
+class ActivationLetter(models.Model):
+    """
+    Письмо с требованием активации, поставленное в очередь на отправку.
+    Хранит состояние доставки: письма отправляются в фоне пакетами,
+    неудачные попытки повторяются с нарастающей задержкой.
+    """
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUSES = (
+            (PENDING, 'Ожидает отправки'),
+            (SENT, 'Отправлено'),
+            (FAILED, 'Не доставлено'),
+            )
+
+    user = models.ForeignKey(
+            AdvUser,
+            on_delete=models.CASCADE,
+            verbose_name='Пользователь'
+            )
+    status = models.CharField(
+            max_length=10,
+            choices=STATUSES,
+            default=PENDING,
+            verbose_name='Состояние'
+            )
+    attempts = models.PositiveSmallIntegerField(
+            default=0,
+            verbose_name='Попыток отправки'
+            )
+    next_attempt_at = models.DateTimeField(
+            default=timezone.now,
+            verbose_name='Следующая попытка'
+            )
+    batch = models.CharField(
+            max_length=32,
+            blank=True,
+            verbose_name='Пакет отправки'
+            )
+    last_error = models.TextField(
+            blank=True,
+            verbose_name='Последняя ошибка'
+            )
+    created_at = models.DateTimeField(
+            auto_now_add=True,
+            verbose_name='Поставлено в очередь'
+            )
+    sent_at = models.DateTimeField(
+            null=True,
+            blank=True,
+            verbose_name='Отправлено'
+            )
+
+    class Meta:
+        verbose_name_plural = 'Письма активации'
+        verbose_name = 'Письмо активации'
+        ordering = ['next_attempt_at']
+        indexes = [
+                models.Index(
+                    fields=['status', 'next_attempt_at'],
+                    name='letter_status_next_idx'
+                    ),
+                ]
@@ -0,0 +1,100 @@
+# Информационные странички сайта ("О сайте" и т.п.), выводимые
+# контроллером other_page
+
+import hashlib
+import threading
+from pathlib import Path
+
+from django.contrib.messages import get_messages
+from django.template import engines
+from django.template.loader import get_template
+
+from .caching import get_counts_generation, get_rubric_tree_version
+
+# папка шаблонов информационных страничек; имя файла без расширения
+# служит адресом странички
+PAGES_DIR = 'main/pages'
+
+# откомпилированные шаблоны страничек: {имя: шаблон}
+_templates = None
+_templates_lock = threading.Lock()
+
+# странички, отрисованные для гостей: {имя: (версия, содержимое, ETag)}
+_rendered = {}
+
+
+def discover_pages():
+    """
+    Находит шаблоны информационных страничек во всех папках шаблонов
+    и компилирует их. Выполняется один раз, при запуске сайта.
+    """
+    templates = {}
+    for directory in engines['django'].template_dirs:
+        for path in sorted(Path(directory, PAGES_DIR).glob('*.html')):
+            if path.stem not in templates:
+                templates[path.stem] = get_template('%s/%s' % (PAGES_DIR, path.name))
+    return templates
+
+
+def get_pages():
+    """
+    Словарь откомпилированных шаблонов страничек, составляется однажды.
+    """
+    global _templates
+    if _templates is None:
+        with _templates_lock:
+            if _templates is None:
+                _templates = discover_pages()
+    return _templates
+
+
+def get_page_template(page):
+    """
+    Шаблон странички page или None, если такой странички нет. Неизвестные
+    адреса отклоняются поиском в словаре, без обращения к загрузчику
+    шаблонов и файловой системе.
+    """
+    return get_pages().get(page)
+
+
+def make_etag(content):
+    return '"%s"' % hashlib.md5(content).hexdigest()
+
+
+def page_version():
+    """
+    Версия отрисованной странички: панель навигации выводит дерево рубрик
+    и количество объявлений в них, поэтому страничка устаревает при
+    изменении рубрик и количества объявлений.
+    """
+    return get_rubric_tree_version(), get_counts_generation()
+
+
+def render_page(request, page, template):
+    """
+    Возвращает содержимое странички и его ETag. Для гостей страничка
+    отрисовывается один раз и далее выдается из памяти, пока не изменится
+    панель навигации (см. page_version()).
+    """
+    if request.user.is_authenticated or len(get_messages(request)):
+        content = template.render(request=request).encode()
+        return content, make_etag(content)
+    version = page_version()
+    rendered = _rendered.get(page)
+    if rendered is None or rendered[0] != version:
+        content = template.render(request=request).encode()
+        rendered = (version, content, make_etag(content))
+        _rendered[page] = rendered
+    return rendered[1], rendered[2]
+
+
+def get_rendered_page(page):
+    """
+    Содержимое и ETag странички, уже отрисованной для гостей при текущей
+    версии (см. page_version()), или None. Обходится без отрисовки и без
+    обращений к БД.
+    """
+    rendered = _rendered.get(page)
+    if rendered is None or rendered[0] != page_version():
+        return None
+    return rendered[1], rendered[2]
@@ -0,0 +1,90 @@
+# Пагинация по ключу (keyset): следующая порция объявлений (комментариев)
+# выбирается условием на (created_at, id) последней показанной записи (или
+# на другое поле сортировки, например (price, id)), а не смещением OFFSET, поэтому глубокие страницы выбираются так же быстро,
+# как первая, и не требуют подсчета COUNT(*).
+
+from django.core import signing
+from django.db.models import Q
+
+CURSOR_SALT = 'main.pagination.cursor'
+
+
+def make_cursor(obj, field='created_at', **filters):
+    """
+    Формирует непрозрачный подписанный курсор, указывающий на позицию
+    после записи obj (объявления или комментария) в порядке сортировки по
+    полю field. В курсор также записываются фильтры (например, искомое
+    слово), чтобы следующие порции выбирались с теми же условиями.
+    """
+    value = getattr(obj, field)
+    if hasattr(value, 'isoformat'):
+        value = value.isoformat()
+    data = {field: value, 'pk': obj.pk}
+    data.update(filters)
+    return signing.dumps(data, salt=CURSOR_SALT, compress=True)
+
+
+def read_cursor(cursor):
+    """
+    Расшифровывает курсор. Поддельный или испорченный курсор считается
+    отсутствующим - выдача начинается сначала.
+    """
+    if not cursor:
+        return {}
+    try:
+        data = signing.loads(cursor, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return data
+
+
+class KeysetPage:
+    """
+    Порция объявлений и курсор для получения следующей порции.
+    """
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return bool(self.next_cursor)
+
+
+def keyset_queryset(queryset, cursor_data, per_page, descending=True, field='created_at'):
+    """
+    Набор записей, следующих за позицией из курсора, в порядке убывания
+    (field, id) или, при descending=False, возрастания. Выбирается на
+    одну запись больше, чтобы без отдельного запроса узнать, есть ли
+    следующая порция.
+    """
+    if descending:
+        queryset = queryset.order_by('-' + field, '-pk')
+    else:
+        queryset = queryset.order_by(field, 'pk')
+    value = cursor_data.get(field)
+    pk = cursor_data.get('pk')
+    if value is not None and pk:
+        # курсор подписан, поэтому значение заведомо корректно
+        value = queryset.model._meta.get_field(field).to_python(value)
+        lookup = 'lt' if descending else 'gt'
+        q = (Q(**{'%s__%s' % (field, lookup): value})
+                | Q(**{field: value, 'pk__%s' % lookup: pk}))
+        queryset = queryset.filter(q)
+    return queryset[:per_page + 1]
+
+
+def keyset_page(queryset, cursor_data, per_page, descending=True, field='created_at',
+        **filters):
+    """
+    Возвращает порцию записей, следующих за позицией из курсора, и курсор
+    следующей порции. Фильтры filters записываются в курсор.
+    """
+    object_list = list(keyset_queryset(queryset, cursor_data, per_page, descending, field))
+    next_cursor = ''
+    if len(object_list) > per_page:
+        object_list = object_list[:per_page]
+        next_cursor = make_cursor(object_list[-1], field, **filters)
+    return KeysetPage(object_list, next_cursor)
@@ -0,0 +1,82 @@
+# Проверка планов запросов основных страниц сайта (EXPLAIN QUERY PLAN)
+
+import re
+
+from django.db import connection
+from django.utils import timezone
+
+from .pagination import keyset_queryset
+from .export import export_queryset
+from .facets import filter_by_price
+from .views import (latest_bbs, rubric_bbs, user_bbs, active_comments,
+        BBS_PER_PAGE, COMMENTS_PER_PAGE)
+
+# полный просмотр таблицы без индекса: "SCAN main_bb" (в старых версиях
+# SQLite - "SCAN TABLE main_bb"), но не "SCAN main_bb USING INDEX ..."
+FULL_SCAN_RE = re.compile(r'^SCAN (TABLE )?\w+$')
+TEMP_SORT = 'USE TEMP B-TREE'
+
+
+def view_querysets():
+    """
+    Запросы, которые выполняют контроллеры, с характерными значениями
+    параметров. Поисковые запросы не проверяются: результаты сортируются
+    по релевантности (bm25), что по определению требует временного
+    B-дерева, но его объем ограничен числом совпадений. По той же причине
+    не проверяется выборка по диапазону цен в порядке дат: SQLite выбирает
+    объявления диапазона по индексу цен и сортирует только их.
+    """
+    cursor = {'created_at': timezone.now().isoformat(), 'pk': 1}
+    price_cursor = {'price': 1000, 'pk': 1}
+    return {
+            'index': latest_bbs()[:10],
+            'by_rubric': rubric_bbs(1)[:BBS_PER_PAGE],
+            'by_rubric (count)': rubric_bbs(1).order_by(),
+            'by_rubric (keyset)': keyset_queryset(rubric_bbs(1), cursor, BBS_PER_PAGE),
+            'by_rubric (price)': keyset_queryset(
+                rubric_bbs(1), {}, BBS_PER_PAGE, descending=False, field='price'),
+            'by_rubric (price, keyset)': keyset_queryset(
+                rubric_bbs(1), price_cursor, BBS_PER_PAGE, field='price'),
+            'by_rubric (price range, count)': filter_by_price(
+                rubric_bbs(1), price_min=1000, price_max=2000).order_by(),
+            'by_rubric (price range, price)': keyset_queryset(
+                filter_by_price(rubric_bbs(1), 2), {}, BBS_PER_PAGE, descending=False,
+                field='price'),
+            'profile': user_bbs(1),
+            'detail (comments)': keyset_queryset(
+                active_comments(1), {}, COMMENTS_PER_PAGE, descending=False),
+            'detail (comments, keyset)': keyset_queryset(
+                active_comments(1), cursor, COMMENTS_PER_PAGE, descending=False),
+            'export': export_queryset(),
+            'export (rubric, dates)': export_queryset(1, timezone.now(), timezone.now()),
+            }
+
+
+def explain(queryset):
+    """
+    Возвращает строки плана запроса набора записей.
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def find_plan_problems(plan):
+    """
+    Строки плана, означающие полный просмотр таблицы или сортировку
+    во временном B-дереве.
+    """
+    return [line for line in plan if FULL_SCAN_RE.match(line) or TEMP_SORT in line]
+
+
+def check_query_plans():
+    """
+    Проверяет планы всех запросов. Возвращает словарь
+    {название: (план, проблемные строки плана)}.
+    """
+    results = {}
+    for name, queryset in view_querysets().items():
+        plan = explain(queryset)
+        results[name] = (plan, find_plan_problems(plan))
+    return results
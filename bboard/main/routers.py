@@ -0,0 +1,114 @@
+# Маршрутизация запросов к БД: чтение объявлений и рубрик в контроллерах,
+# помеченных декоратором read_replica, выполняется на одной из реплик,
+# все остальные запросы и любая запись - на основной БД. Пользователь,
+# только что изменивший читаемые с реплик данные, некоторое время читает с
+# основной БД (cookie REPLICA_STICKY_COOKIE), чтобы сразу увидеть свои
+# изменения, даже если реплики от нее отстают.
+
+import random
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+
+PRIMARY = 'default'
+
+# модели, чтение которых допускается с реплик; пользователи, сессии и
+# очередь писем всегда читаются с основной БД, так как сразу после
+# записи нужны в актуальном виде
+REPLICATED_MODELS = {
+        'main.rubric', 'main.superrubric', 'main.subrubric',
+        'main.bb', 'main.additionalimage', 'main.comment',
+        }
+
+# реплика, выбранная для текущего запроса (None - основная БД)
+_replica = ContextVar('replica', default=None)
+
+# признак записи читаемых с реплик данных при обработке текущего запроса
+_writes = ContextVar('writes', default=None)
+
+
+class WriteTracker:
+    def __init__(self):
+        self.wrote = False
+
+
+def get_replicas():
+    return settings.DATABASE_REPLICAS
+
+
+def choose_replica():
+    """
+    Реплика для очередного запроса выбирается случайно, так что нагрузка
+    распределяется между всеми репликами поровну.
+    """
+    replicas = get_replicas()
+    return random.choice(replicas) if replicas else None
+
+
+def is_sticky(request):
+    """
+    Недавно писавший в БД пользователь читает с основной БД.
+    """
+    return settings.REPLICA_STICKY_COOKIE in request.COOKIES
+
+
+def read_replica(view):
+    """
+    Декоратор контроллеров, только читающих данные: GET- и HEAD-запросы
+    выполняются на реплике, выбранной для всего запроса. Остальные
+    запросы и запросы недавно писавших пользователей обрабатываются на
+    основной БД.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or is_sticky(request):
+            return view(request, *args, **kwargs)
+        token = _replica.set(choose_replica())
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _replica.reset(token)
+    return wrapper
+
+
+def start_tracking_writes():
+    tracker = WriteTracker()
+    return tracker, _writes.set(tracker)
+
+
+def stop_tracking_writes(token):
+    _writes.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Маршрутизатор БД, подключается в настройке DATABASE_ROUTERS. Реплики
+    перечисляются в настройке DATABASE_REPLICAS.
+    """
+    def db_for_read(self, model, **hints):
+        replica = _replica.get()
+        if replica and model._meta.label_lower in REPLICATED_MODELS:
+            return replica
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        # запись остальных моделей (сессий, заданий captcha при выводе
+        # страницы гостю) не влияет на чтение с реплик
+        tracker = _writes.get()
+        if tracker is not None and model._meta.label_lower in REPLICATED_MODELS:
+            tracker.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # на репликах те же записи, что и на основной БД
+        databases = {PRIMARY, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # реплики получают структуру БД вместе с данными
+        if db in get_replicas():
+            return False
+        return None
@@ -0,0 +1,243 @@
+# Полнотекстовый поиск по объявлениям
+
+import re
+from array import array
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .caching import LRUCache, get_bbs_generation
+from .models import Bb
+from .trigrams import similar_titles, suggest
+
+# имя виртуальной таблицы FTS5, rowid в ней совпадает с ключом объявления
+FTS_TABLE = 'main_bb_fts'
+
+# веса столбцов title и content для функции ранжирования bm25()
+FTS_WEIGHTS = (10.0, 1.0)
+
+# окончания, отсекаемые при нормализации русских слов, от длинных к коротким
+RU_ENDINGS = (
+        'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+        'ией', 'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие',
+        'ах', 'ях', 'ов', 'ев', 'ом', 'ем', 'ам', 'ям', 'ую', 'юю',
+        'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+        )
+
+# минимальная длина основы слова, остающейся после отсечения окончания
+MIN_STEM_LENGTH = 3
+
+WORD_RE = re.compile(r'\w+')
+
+# размер порции ключей при удалении записей из индекса
+UNINDEX_CHUNK_SIZE = 900
+
+# наибольшее количество объявлений в результатах общего поиска
+SEARCH_RESULTS_LIMIT = 1000
+
+
+def is_available():
+    """
+    Индекс FTS5 есть только в SQLite, на других СУБД поиск выполняется
+    старым способом - через icontains.
+    """
+    return connection.vendor == 'sqlite'
+
+
+def stem(word):
+    """
+    Упрощенный стеммер: отсекает у слова одно типичное русское окончание,
+    чтобы "ноутбука" и "ноутбуки" находились по одному запросу.
+    """
+    for ending in RU_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text):
+    """
+    Разбивает текст на нормализованные слова: нижний регистр (в том числе
+    для кириллицы), ё заменяется на е, окончания отсекаются.
+    """
+    text = text.casefold().replace('ё', 'е')
+    return [stem(word) for word in WORD_RE.findall(text)]
+
+
+def normalize_text(text):
+    return ' '.join(tokenize(text))
+
+
+def build_match_query(keyword):
+    """
+    Строит выражение MATCH для FTS5: каждое слово ищется по префиксу,
+    слова объединяются через AND. Пустая строка - искать нечего.
+    """
+    return ' '.join('"%s"*' % word for word in tokenize(keyword))
+
+
+def index_bb(bb):
+    """
+    Добавляет объявление в поисковый индекс или обновляет его запись.
+    """
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE, [bb.pk])
+        cursor.execute(
+                'INSERT INTO %s (rowid, title, content) VALUES (%%s, %%s, %%s)' % FTS_TABLE,
+                [bb.pk, normalize_text(bb.title), normalize_text(bb.content)]
+                )
+
+
+def index_new_bbs(bbs):
+    """
+    Добавляет в поисковый индекс объявления, которых в нем еще нет
+    (созданные методом bulk_create(), не отправляющим сигналов), одним
+    пакетным запросом.
+    """
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+                'INSERT INTO %s (rowid, title, content) VALUES (%%s, %%s, %%s)' % FTS_TABLE,
+                [(bb.pk, normalize_text(bb.title), normalize_text(bb.content)) for bb in bbs]
+                )
+
+
+def unindex_bbs(pks):
+    """
+    Удаляет объявления с указанными ключами из поискового индекса.
+    Ключи передаются порциями, чтобы не превысить ограничение SQLite на
+    количество параметров запроса.
+    """
+    pks = list(pks)
+    if not pks or not is_available():
+        return
+    with connection.cursor() as cursor:
+        for i in range(0, len(pks), UNINDEX_CHUNK_SIZE):
+            chunk = pks[i:i + UNINDEX_CHUNK_SIZE]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(
+                    'DELETE FROM %s WHERE rowid IN (%s)' % (FTS_TABLE, placeholders),
+                    chunk
+                    )
+
+
+def rebuild_index(bbs):
+    """
+    Полностью перестраивает индекс по переданному набору объявлений.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s' % FTS_TABLE)
+        cursor.executemany(
+                'INSERT INTO %s (rowid, title, content) VALUES (%%s, %%s, %%s)' % FTS_TABLE,
+                ((pk, normalize_text(title), normalize_text(content))
+                    for pk, title, content in bbs.values_list('pk', 'title', 'content').iterator())
+                )
+
+
+def search_bbs(queryset, keyword, ranked=True):
+    """
+    Фильтрует набор объявлений по искомым словам. Ключи найденных
+    объявлений берутся из индекса FTS5, поэтому время поиска зависит от
+    количества совпадений, а не от размера таблицы. При ranked=True
+    результаты упорядочиваются по релевантности (bm25), затем по дате.
+    """
+    match = build_match_query(keyword)
+    if not match:
+        return queryset
+    if not is_available():
+        q = Q(title__icontains=keyword) | Q(content__icontains=keyword)
+        return queryset.filter(q)
+    queryset = queryset.filter(pk__in=RawSQL(
+            'SELECT rowid FROM %s WHERE %s MATCH %%s' % (FTS_TABLE, FTS_TABLE),
+            (match,)
+            ))
+    if ranked:
+        rank_sql = 'SELECT bm25(%s, %s, %s) FROM %s WHERE %s MATCH %%s AND rowid = %s.id' % (
+                FTS_TABLE, FTS_WEIGHTS[0], FTS_WEIGHTS[1], FTS_TABLE, FTS_TABLE,
+                queryset.model._meta.db_table
+                )
+        queryset = queryset.annotate(search_rank=RawSQL(rank_sql, (match,)))
+        queryset = queryset.order_by('search_rank', '-created_at')
+    return queryset
+
+
+class SearchResults:
+    """
+    Результаты общего поиска: ключи найденных активных объявлений в порядке
+    релевантности и ключи их надрубрик, в двух компактных массивах.
+    """
+    def __init__(self, ids=(), groups=(), fuzzy=False):
+        self.ids = array('q', ids)
+        self.groups = array('q', groups)
+        # True - точных совпадений нет, найдены похожие названия
+        self.fuzzy = fuzzy
+        # исправленная искомая фраза, если точных совпадений нет
+        self.suggestion = ''
+
+    def __len__(self):
+        return len(self.ids)
+
+    def group_counts(self):
+        """
+        Количество найденных объявлений в каждой надрубрике: список пар
+        (надрубрика, количество) в порядке самого релевантного объявления
+        надрубрики.
+        """
+        counts = {}
+        for group in self.groups:
+            counts[group] = counts.get(group, 0) + 1
+        return list(counts.items())
+
+    def in_group(self, group):
+        """
+        Ключи найденных объявлений надрубрики group.
+        """
+        return array('q', (pk for pk, pk_group in zip(self.ids, self.groups)
+                if pk_group == group))
+
+
+def find_bbs(keyword, limit=SEARCH_RESULTS_LIMIT):
+    """
+    Ищет активные объявления всех рубрик, упорядочивая их по релевантности.
+    Выбираются только ключи объявлений и их надрубрик. Если точных
+    совпадений нет, ищутся объявления с похожими названиями (по индексу
+    триграмм), от самых похожих, и исправленная искомая фраза.
+    """
+    rows = search_bbs(Bb.objects.filter(is_active=True), keyword).values_list(
+            'pk', 'rubric__super_rubric')[:limit]
+    results = SearchResults()
+    for pk, group in rows:
+        results.ids.append(pk)
+        results.groups.append(group)
+    if not results:
+        ids = [pk for similarity, pk, title in similar_titles(keyword)]
+        groups = dict(Bb.objects.filter(pk__in=ids).values_list('pk', 'rubric__super_rubric'))
+        results = SearchResults(ids, [groups[pk] for pk in ids], fuzzy=True)
+        results.suggestion = suggest(keyword)
+    return results
+
+
+_search_results = LRUCache(settings.SEARCH_CACHE_SIZE)
+
+
+def get_search_results(keyword):
+    """
+    Результаты общего поиска по искомой фразе keyword. Хранятся в памяти
+    процесса под ключом (нормализованная фраза, поколение списков
+    объявлений): повторный запрос той же фразы, записанной иначе, не
+    обращается к БД, а после изменения объявлений результаты ищутся заново.
+    """
+    query = normalize_text(keyword)
+    if not query:
+        return SearchResults()
+    key = (query, get_bbs_generation())
+    results = _search_results.get(key)
+    if results is None:
+        results = find_bbs(keyword)
+        _search_results.set(key, results)
+    return results
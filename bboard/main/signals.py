@@ -0,0 +1,245 @@
+# Обработчики сигналов моделей приложения
+
+from django.db import transaction
+from django.db.models.signals import post_init, pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from captcha.models import CaptchaStore
+
+from .apps import bbs_deleted
+from .models import Bb, AdditionalImage, Comment, MediaBlob, Rubric, SuperRubric, SubRubric
+from . import search
+from .captchas import delete_images
+from .caching import invalidate_rubric_tree, bump_bbs_generation
+from .counters import change_counters, recount_bbs
+from .facets import price_bucket, change_facets
+from .trigrams import reindex_title
+from .thumbnails import schedule_thumbnails
+from .variants import schedule_variants, delete_variants
+
+# состояние записи, загруженной без нужных обработчику полей
+UNKNOWN = object()
+
+# поля объявления, определяющие его фасет
+FACET_FIELDS = ('rubric_id', 'price', 'is_active')
+
+
+def bb_facet(values):
+    """
+    Фасет, в котором учтено объявление со значениями полей values:
+    (рубрика, ценовой интервал) или None для неактивного объявления.
+    """
+    if not all(name in values for name in FACET_FIELDS):
+        return UNKNOWN
+    if not values['is_active']:
+        return None
+    return values['rubric_id'], price_bucket(values['price'])
+
+
+def stored_facet(pk, using):
+    """
+    Фасет объявления pk по значениям из БД, прочитанным одним запросом по
+    ключу; None, если такого объявления нет.
+    """
+    values = Bb.objects.using(using).filter(pk=pk).values(*FACET_FIELDS).first()
+    return None if values is None else bb_facet(values)
+
+
+@receiver(post_init, sender=Bb)
+def bb_loaded(sender, instance, **kwargs):
+    """
+    Запоминает фасет и название загруженного объявления, чтобы при
+    сохранении изменить сводную таблицу фасетов без чтения из БД и не
+    перестраивать триграммы неизмененного названия.
+    """
+    instance._facet = bb_facet(instance.__dict__)
+    instance._title = instance.__dict__.get('title')
+
+
+@receiver(pre_save, sender=Bb)
+@receiver(pre_delete, sender=Bb)
+def bb_changing(sender, instance, using, raw=False, **kwargs):
+    """
+    Фасет объявления, загруженного без нужных полей (only(), defer()),
+    читается из БД перед его сохранением или удалением. Так же читается
+    фасет объявления, загружаемого из фикстуры (loaddata): записанное в
+    фикстуре объявление может заменить уже сохраненное.
+    """
+    if raw or instance._facet is UNKNOWN:
+        instance._facet = None if instance.pk is None else stored_facet(instance.pk, using)
+
+
+def move_facet(old, new):
+    """
+    Переносит объявление из фасета old в фасет new.
+    """
+    if old != new:
+        changes = {}
+        if old is not None:
+            changes[old] = -1
+        if new is not None:
+            changes[new] = changes.get(new, 0) + 1
+        change_facets(changes)
+
+
+@receiver(post_save, sender=Bb)
+def bb_saved(sender, instance, created, using, raw=False, **kwargs):
+    """
+    Поддерживает поисковый индекс, триграммы названия и сводную таблицу
+    фасетов в актуальном состоянии при сохранении объявления, в том числе
+    при загрузке фикстур. Устаревают списки рубрик, в которых объявление
+    выводилось и выводится теперь. Миниатюры изображения создаются в фоне
+    после фиксации транзакции, а не при первом выводе списка объявлений.
+    """
+    old_facet = None if created else instance._facet
+    facet = bb_facet(instance.__dict__)
+    if facet is UNKNOWN:
+        # сохранены не все поля фасета (update_fields)
+        facet = stored_facet(instance.pk, using)
+    move_facet(old_facet, facet)
+    instance._facet = facet
+    title = instance.__dict__.get('title')
+    if raw or created or title != instance._title:
+        reindex_title(instance)
+        instance._title = title
+    search.index_bb(instance)
+    rubrics = {f[0] for f in (old_facet, facet) if f is not None}
+    if rubrics:
+        bump_bbs_generation(rubrics, counts=old_facet != facet)
+    if instance.image:
+        name = instance.image.name
+        transaction.on_commit(lambda: schedule_thumbnails(name))
+        transaction.on_commit(lambda: schedule_variants(name))
+
+
+@receiver(post_delete, sender=Bb)
+def bb_deleted(sender, instance, **kwargs):
+    move_facet(instance._facet, None)
+    search.unindex_bbs([instance.pk])
+    if instance._facet is not None:
+        bump_bbs_generation([instance._facet[0]], counts=True)
+
+
+@receiver(bbs_deleted)
+def bbs_bulk_deleted(sender, pks, rubrics=(), **kwargs):
+    search.unindex_bbs(pks)
+    if rubrics:
+        bump_bbs_generation(rubrics, counts=True)
+
+
+def bump_listed_bbs(*bb_ids):
+    """
+    Начинает новое поколение списков рубрик объявлений bb_ids: карточка
+    объявления в списках выводит счетчики комментариев и дополнительных
+    иллюстраций. Неактивные объявления в списках не выводятся.
+    """
+    rubrics = set(Bb.objects.filter(pk__in=bb_ids, is_active=True)
+            .values_list('rubric', flat=True))
+    if rubrics:
+        bump_bbs_generation(rubrics)
+
+
+@receiver(post_save, sender=AdditionalImage)
+def additional_image_saved(sender, instance, created, raw=False, **kwargs):
+    """
+    Новая иллюстрация увеличивает счетчик иллюстраций объявления. Копии
+    изображения для страницы объявления создаются в фоне после фиксации
+    транзакции.
+    """
+    if created and not raw:
+        change_counters(instance.bb_id, images=1)
+        bump_listed_bbs(instance.bb_id)
+    if instance.image:
+        name = instance.image.name
+        transaction.on_commit(lambda: schedule_variants(name))
+
+
+@receiver(post_delete, sender=AdditionalImage)
+def additional_image_deleted(sender, instance, **kwargs):
+    change_counters(instance.bb_id, images=-1)
+    bump_listed_bbs(instance.bb_id)
+
+
+@receiver(post_init, sender=Comment)
+def comment_loaded(sender, instance, **kwargs):
+    """
+    Запоминает, в счетчике какого объявления учтен комментарий (None -
+    не учтен), чтобы при сохранении изменить счетчики без чтения из БД.
+    Отложенные поля (only(), defer()) здесь не загружаются: состояние
+    такого комментария неизвестно, и счетчик его объявления при
+    изменении пересчитывается целиком.
+    """
+    values = instance.__dict__
+    if 'bb_id' in values and 'is_active' in values:
+        instance._counted_in = values['bb_id'] if values['is_active'] else None
+    else:
+        instance._counted_in = UNKNOWN
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, raw=False, **kwargs):
+    """
+    Поддерживает счетчик активных комментариев объявления при добавлении
+    комментария, его модерации (смене is_active) и переносе к другому
+    объявлению.
+    """
+    if raw:
+        return
+    counted_in = None if created else instance._counted_in
+    now_in = instance.bb_id if instance.is_active else None
+    instance._counted_in = now_in
+    if counted_in is UNKNOWN:
+        recount_bbs(Bb.objects.filter(pk=instance.bb_id))
+    elif counted_in != now_in:
+        if counted_in is not None:
+            change_counters(counted_in, comments=-1)
+        if now_in is not None:
+            change_counters(now_in, comments=1)
+    else:
+        return
+    # счетчик мог измениться и у прежнего объявления комментария
+    bump_listed_bbs(*{instance.bb_id, counted_in} - {None, UNKNOWN})
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    if instance._counted_in is UNKNOWN:
+        recount_bbs(Bb.objects.filter(pk=instance.bb_id))
+    elif instance._counted_in is not None:
+        change_counters(instance._counted_in, comments=-1)
+    else:
+        return
+    bump_listed_bbs(instance.bb_id)
+
+
+@receiver(post_delete, sender=MediaBlob)
+def media_blob_deleted(sender, instance, **kwargs):
+    """
+    Вместе с последней ссылкой на файл изображения удаляются его копии.
+    """
+    delete_variants(instance.name)
+
+
+@receiver(post_save, sender=Rubric)
+@receiver(post_save, sender=SuperRubric)
+@receiver(post_save, sender=SubRubric)
+@receiver(post_delete, sender=Rubric)
+@receiver(post_delete, sender=SuperRubric)
+@receiver(post_delete, sender=SubRubric)
+def rubric_changed(sender, **kwargs):
+    """
+    Сбрасывает кэшированное дерево рубрик при любом изменении рубрик;
+    кэшированные страницы, выводящие его, устаревают вместе с ним. Общий
+    поиск группирует найденные объявления по надрубрикам, поэтому
+    устаревают и его результаты.
+    """
+    invalidate_rubric_tree()
+    bump_bbs_generation(())
+
+
+@receiver(post_delete, sender=CaptchaStore)
+def captcha_deleted(sender, instance, **kwargs):
+    """
+    Решенное задание удаляется библиотекой при проверке ответа, вместе с
+    ним удаляются изображения задания из пула.
+    """
+    delete_images(instance.hashkey)
@@ -0,0 +1,25 @@
+// Подгрузка следующих порций записей (объявлений, комментариев) без
+// перезагрузки страницы. Ссылка с классом load-more содержит адрес
+// фрагмента (data-url), курсор следующей порции (data-cursor) и
+// идентификатор списка, в конец которого добавляется фрагмент (data-target).
+// Курсор очередной порции сервер передает в заголовке X-Next-Cursor.
+document.addEventListener('click', function (event) {
+    var more = event.target.closest('.load-more');
+    if (!more) {
+        return;
+    }
+    event.preventDefault();
+    var url = more.dataset.url + '?cursor=' + encodeURIComponent(more.dataset.cursor);
+    fetch(url).then(function (response) {
+        var cursor = response.headers.get('X-Next-Cursor');
+        return response.text().then(function (html) {
+            document.getElementById(more.dataset.target).insertAdjacentHTML('beforeend', html);
+            if (cursor) {
+                more.dataset.cursor = cursor;
+                more.href = '?cursor=' + encodeURIComponent(cursor);
+            } else {
+                more.parentNode.remove();
+            }
+        });
+    });
+});
@@ -0,0 +1,151 @@
+# Хранилище изображений объявлений с адресацией по содержимому. Имя файла -
+# хэш SHA-256 его содержимого, файлы раскладываются по вложенным папкам по
+# первым символам хэша (ab/cd/abcd...jpg), поэтому ни одна папка не
+# разрастается, а одинаковые файлы хранятся в одном экземпляре. Количество
+# записей, ссылающихся на файл, хранится в модели MediaBlob: сохранение
+# увеличивает счетчик, удаление (в том числе django_cleanup и delete_bbs())
+# уменьшает его, и файл удаляется вместе с последней ссылкой.
+
+import hashlib
+import os
+import re
+import uuid
+
+from django.apps import apps
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import router, transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+BLOB_NAME_RE = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+
+
+def get_blob_model():
+    # модели импортируют хранилище, поэтому модель берется из реестра
+    return apps.get_model('main', 'MediaBlob')
+
+
+def content_digest(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def blob_name(digest, filename):
+    """
+    Имя файла в хранилище: две вложенные папки по первым символам хэша,
+    расширение исходного файла сохраняется.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    return '%s/%s/%s%s' % (digest[:2], digest[2:4], digest, extension)
+
+
+def is_blob_name(name):
+    """
+    Сохранен ли файл name по хэшу содержимого (а не под прежним именем по
+    отметке времени).
+    """
+    return bool(BLOB_NAME_RE.match(name))
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Файловое хранилище с именами по хэшу содержимого и подсчетом ссылок.
+    Имя, предложенное при сохранении, определяет только расширение файла.
+    """
+    def get_blob_db(self):
+        return router.db_for_write(get_blob_model())
+
+    def get_blob_name(self, name, content):
+        if name is None:
+            name = content.name
+        return blob_name(content_digest(content), name)
+
+    def save(self, name, content, max_length=None):
+        """
+        Сохраняет файл, если такого содержимого еще нет, и добавляет ссылку
+        на него. Счетчик меняется раньше проверки файла и в той же
+        транзакции, поэтому одновременное удаление последней ссылки не
+        удалит только что сохраненный файл. Файл поля модели сохраняется
+        при сохранении записи, и модели сохраняют запись в транзакции (см.
+        models.ImageBlobMixin), поэтому ссылка на файл отменяется, если
+        запись не сохранилась.
+        """
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.get_blob_name(name, content)
+        with transaction.atomic(using=self.get_blob_db()):
+            self.add_references({name: 1})
+            if not self.exists(name):
+                self.write_blob(name, content)
+        return name
+
+    def store(self, name, content):
+        """
+        Сохраняет файл, не добавляя ссылку на него, без обращения к БД, -
+        для параллельного копирования файлов рабочими потоками. Ссылки на
+        сохраненные файлы добавляются затем add_references() вместе с
+        записями, а файлы, записи которых не сохранились, удаляются
+        discard(). Возвращает имя файла.
+        """
+        name = self.get_blob_name(name, content)
+        if not self.exists(name):
+            self.write_blob(name, content)
+        return name
+
+    def write_blob(self, name, content):
+        """
+        Записывает файл под временным именем и переименовывает, чтобы
+        одновременные сохранения одного содержимого не видели недописанный
+        файл.
+        """
+        temporary = self._save('%s.%s.tmp' % (name, uuid.uuid4().hex), content)
+        os.replace(self.path(temporary), self.path(name))
+
+    def add_references(self, counts):
+        """
+        Увеличивает счетчики ссылок на файлы на величины из словаря
+        {имя: количество}, например, когда один файл назначается многим
+        записям, созданным bulk_create().
+        """
+        blobs = get_blob_model().objects.using(self.get_blob_db())
+        for name, count in counts.items():
+            if not count:
+                continue
+            blob, created = blobs.get_or_create(name=name, defaults={'refs': count})
+            if not created:
+                blobs.filter(pk=blob.pk).update(refs=F('refs') + count)
+
+    def release(self, name, count=1):
+        """
+        Уменьшает счетчик ссылок на файл name на count и удаляет файл, если
+        ссылок не осталось. Файлы без счетчика (сохраненные до появления
+        этого хранилища) удаляются сразу.
+        """
+        using = self.get_blob_db()
+        with transaction.atomic(using=using):
+            blobs = get_blob_model().objects.using(using).filter(name=name)
+            if blobs.filter(refs__gt=count).update(refs=F('refs') - count):
+                return
+            blobs.delete()
+            super().delete(name)
+
+    def delete(self, name):
+        self.release(name)
+
+    def discard(self, names):
+        """
+        Удаляет сохраненные методом store() файлы names, на которые нет
+        ссылок.
+        """
+        names = set(names)
+        referenced = set(get_blob_model().objects.using(self.get_blob_db())
+                .filter(name__in=names).values_list('name', flat=True))
+        for name in names - referenced:
+            super().delete(name)
+
+
+media_storage = ContentAddressedStorage()
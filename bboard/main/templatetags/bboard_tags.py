@@ -0,0 +1,43 @@
+from django import template
+from django.templatetags.static import static
+from easy_thumbnails.alias import aliases
+from easy_thumbnails.files import get_thumbnailer
+
+from ..thumbnails import schedule_thumbnails
+from ..variants import picture_sources
+
+register = template.Library()
+
+
+@register.simple_tag
+def ready_thumbnail(image, alias):
+    """
+    Интернет-адрес готовой миниатюры. В отличие от тега thumbnail из
+    easy_thumbnails, миниатюру не создает: если ее еще нет, создание
+    ставится в очередь, а выводится изображение-заглушка.
+    """
+    options = aliases.get(alias, target=image)
+    thumbnail = get_thumbnailer(image).get_thumbnail(dict(options, ALIAS=alias), generate=False)
+    if thumbnail:
+        return thumbnail.url
+    schedule_thumbnails(image.name)
+    return static('main/empty.png')
+
+
+@register.inclusion_tag('main/picture.html')
+def picture(image, css_class, sizes):
+    """
+    Тег <picture> с готовыми уменьшенными копиями изображения в нескольких
+    форматах; браузер выбирает формат и ширину копии по sizes. Пока копий
+    нет, выводится оригинал, а их создание ставится в очередь.
+    """
+    return {'image': image, 'css_class': css_class, 'sizes': sizes,
+            'variants': picture_sources(image.name)}
+
+
+@register.filter
+def count_of(counts, pk):
+    """
+    Количество объявлений рубрики pk из словаря counts (rubric_counts).
+    """
+    return counts.get(pk, 0)
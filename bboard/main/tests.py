@@ -1,3 +1,1245 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+from asgiref.sync import sync_to_async
+from loguru import logger
+
+from django.conf import settings
+from django.core import mail, serializers
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections, IntegrityError, OperationalError
+from django.http import Http404
+from django.test import (AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase,
+        override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import AdvUser, SuperRubric, SubRubric, Bb, AdditionalImage, Comment
+from .models import ActivationLetter, RubricFacet, TitleTrigram, MediaBlob
+from .search import search_bbs, tokenize
+from . import search
+from .trigrams import similar_titles, suggest, trigrams
+from .caching import get_bbs_generation, get_rubric_tree, LRUCache
+from .templatetags.bboard_tags import ready_thumbnail
+from . import thumbnails, variants
+from .storage import is_blob_name
+from .variants import generate_variants, get_variants, picture_sources, variant_name
+from .deletion import delete_bbs
+from .mailing import deliver_pending, enqueue_activation_letters
+from .views import other_page
+from .queryplans import check_query_plans
+from .benchmark import default_scenarios, percentile, pick_fixture, run_benchmark
+from .instrumentation import dump_histograms
+from .routers import (ReplicaRouter, read_replica, start_tracking_writes,
+        stop_tracking_writes)
+from .importing import BbImporter
+from .facets import facet_counts, get_facets, rebuild_facets
+from .captchas import image_name, pick_challenge, refill_pool
+from captcha.models import CaptchaStore
+from . import async_views
+from .benchmark import async_urlconf
+from . import urls as main_urls
+
+# замеры каждого запроса, отладочные сообщения контроллеров, ожидаемые
+# ошибки импорта и пустого пула captcha в журнале не нужны
+logger.disable('main.middlewares')
+logger.disable('main.views')
+logger.disable('main.importing')
+logger.disable('main.captchas')
+
+
+class BboardTestCase(TestCase):
+    """
+    Общая заготовка тестов: надрубрика, подрубрика и пользователь.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.super_rubric = SuperRubric.objects.create(name='Техника')
+        cls.rubric = SubRubric.objects.create(name='Ноутбуки', super_rubric=cls.super_rubric)
+        cls.user = AdvUser.objects.create_user(username='seller', password='vvvvvvvv11')
+
+    def setUp(self):
+        # кэш не откатывается вместе с транзакцией теста
+        cache.clear()
+
+    def make_image(self, name='photo.png', size=(200, 150), color='red'):
+        content = io.BytesIO()
+        Image.new('RGB', size, color).save(content, 'PNG')
+        return SimpleUploadedFile(name, content.getvalue(), content_type='image/png')
+
+    def create_bb(self, title='Товар', content='Описание', **kwargs):
+        kwargs.setdefault('rubric', self.rubric)
+        kwargs.setdefault('author', self.user)
+        return Bb.objects.create(title=title, content=content, contacts='тел. 123', **kwargs)
+
+
+class SearchTests(BboardTestCase):
+    def test_tokenize_folds_case_and_endings(self):
+        self.assertEqual(tokenize('НОУТБУКИ Ёлочные'), tokenize('ноутбук елочная'))
+
+    def test_search_finds_inflected_cyrillic_words(self):
+        bb = self.create_bb(title='Ноутбук HP', content='Почти новый')
+        self.create_bb(title='Телевизор', content='Рубин')
+        found = search_bbs(Bb.objects.all(), 'ноутбуки')
+        self.assertEqual(list(found), [bb])
+
+    def test_title_match_ranked_above_content_match(self):
+        in_content = self.create_bb(title='Сумка', content='подойдет для ноутбука')
+        in_title = self.create_bb(title='Ноутбук', content='Рабочий')
+        found = search_bbs(Bb.objects.all(), 'ноутбук')
+        self.assertEqual(list(found), [in_title, in_content])
+
+    def test_index_follows_updates_and_deletes(self):
+        bb = self.create_bb(title='Гараж')
+        bb.title = 'Сарай'
+        bb.save()
+        self.assertFalse(search_bbs(Bb.objects.all(), 'гараж').exists())
+        self.assertTrue(search_bbs(Bb.objects.all(), 'сарай').exists())
+        bb.delete()
+        self.assertFalse(search_bbs(Bb.objects.all(), 'сарай').exists())
+
+    def test_by_rubric_uses_search(self):
+        bb = self.create_bb(title='Ноутбук')
+        self.create_bb(title='Мышь')
+        url = reverse('main:by_rubric', kwargs={'pk': self.rubric.pk})
+        response = self.client.get(url, {'keyword': '  НОУТБУКИ '})
+        self.assertEqual(list(response.context['bbs']), [bb])
+
+
+@override_settings(PAGE_CACHE_TIMEOUT=0)
+class GlobalSearchTests(BboardTestCase):
+    def setUp(self):
+        super().setUp()
+        search._search_results.clear()
+        self.addCleanup(search._search_results.clear)
+        other_super = SuperRubric.objects.create(name='Дом', order=1)
+        self.other = SubRubric.objects.create(name='Мебель', super_rubric=other_super)
+        self.in_title = self.create_bb(title='Ноутбук', content='Рабочий')
+        self.in_content = self.create_bb(title='Стол', content='Подойдет для ноутбука',
+                rubric=self.other)
+        self.create_bb(title='Ноутбук старый', is_active=False)
+        self.create_bb(title='Мышь')
+
+    def test_results_are_ranked_and_grouped(self):
+        response = self.client.get(reverse('main:search'), {'keyword': 'ноутбуки'})
+        self.assertEqual(response.context['total'], 2)
+        sections = response.context['sections']
+        self.assertEqual([section['name'] for section in sections], ['Техника', 'Дом'])
+        self.assertEqual([section['bbs'] for section in sections],
+                [[self.in_title], [self.in_content]])
+        response = self.client.get(reverse('main:search'),
+                {'keyword': 'ноутбуки', 'group': self.other.super_rubric_id})
+        self.assertEqual([section['bbs'] for section in response.context['sections']],
+                [[self.in_content]])
+
+    def test_repeated_query_is_served_from_id_cache(self):
+        url = reverse('main:search')
+        self.client.get(url, {'keyword': 'Ноутбуки'})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'keyword': ' ноутбука', 'page': 1})
+        self.assertEqual(response.context['total'], 2)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('MATCH', queries[0]['sql'])
+        # после изменения объявлений результаты ищутся заново
+        self.create_bb(title='Ноутбук новый')
+        response = self.client.get(url, {'keyword': 'ноутбук'})
+        self.assertEqual(response.context['total'], 3)
+
+    def test_lru_cache_evicts_least_recently_used(self):
+        lru = LRUCache(2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual((lru.get('a'), lru.get('c'), len(lru)), (1, 3, 2))
+
+
+class TrigramTests(BboardTestCase):
+    def indexed(self, bb):
+        return set(TitleTrigram.objects.filter(bb=bb).values_list('trigram', flat=True))
+
+    def test_index_follows_title_changes(self):
+        bb = self.create_bb(title='Ноутбук')
+        self.assertEqual(self.indexed(bb), trigrams('Ноутбук'))
+        bb.title = 'Планшет'
+        bb.save()
+        self.assertEqual(self.indexed(bb), trigrams('планшет'))
+        delete_bbs(Bb.objects.filter(pk=bb.pk))
+        self.assertFalse(TitleTrigram.objects.exists())
+
+    def test_misspelled_words_are_found_and_corrected(self):
+        laptop = self.create_bb(title='Ноутбук Самсунг')
+        self.create_bb(title='Телевизор')
+        with self.assertNumQueries(2):
+            found = similar_titles('нотбук')
+        self.assertEqual([pk for similarity, pk, title in found], [laptop.pk])
+        self.assertEqual(suggest('нотбук самсунк'), 'ноутбук самсунг')
+        self.assertEqual(suggest('ноутбук'), '')
+
+    def test_inactive_bbs_do_not_take_candidate_slots(self):
+        for i in range(3):
+            self.create_bb(title='Ноутбук Самсунг', is_active=False)
+        laptop = self.create_bb(title='Ноутбук Самсунги')
+        found = similar_titles('ноутбук самсунг', limit=2)
+        self.assertEqual([pk for similarity, pk, title in found], [laptop.pk])
+
+    @override_settings(PAGE_CACHE_TIMEOUT=0)
+    def test_search_pages_suggest_corrections(self):
+        search._search_results.clear()
+        self.addCleanup(search._search_results.clear)
+        laptop = self.create_bb(title='Ноутбук')
+        url = reverse('main:by_rubric', kwargs={'pk': self.rubric.pk})
+        response = self.client.get(url, {'keyword': 'нотбук'})
+        self.assertEqual(response.context['suggestion'], 'ноутбук')
+        response = self.client.get(reverse('main:search'), {'keyword': 'нотбук'})
+        self.assertTrue(response.context['fuzzy'])
+        self.assertEqual(response.context['sections'][0]['bbs'], [laptop])
+        self.assertContains(response, 'Возможно, вы искали')
+
+
+class RubricTreeTests(BboardTestCase):
+    def test_tree_groups_sub_rubrics(self):
+        other = SubRubric.objects.create(name='Планшеты', super_rubric=self.super_rubric, order=-1)
+        tree = get_rubric_tree()
+        self.assertEqual(len(tree), 1)
+        self.assertEqual(tree[0].name, 'Техника')
+        self.assertEqual([r.pk for r in tree[0].sub_rubrics], [other.pk, self.rubric.pk])
+
+    def test_tree_is_served_without_queries(self):
+        get_rubric_tree()
+        with self.assertNumQueries(0):
+            get_rubric_tree()
+
+    def test_tree_is_invalidated_on_rubric_change(self):
+        get_rubric_tree()
+        self.rubric.name = 'Ноутбуки б/у'
+        self.rubric.save()
+        self.assertEqual(get_rubric_tree()[0].sub_rubrics[0].name, 'Ноутбуки б/у')
+        super_rubric = SuperRubric.objects.create(name='Недвижимость')
+        SubRubric.objects.create(name='Гаражи', super_rubric=super_rubric)
+        self.assertEqual([node.name for node in get_rubric_tree()], ['Недвижимость', 'Техника'])
+
+
+@override_settings(PAGE_CACHE_TIMEOUT=0)
+class QueryBudgetTests(BboardTestCase):
+    """
+    Количество запросов к БД у страниц-списков не должно зависеть от числа
+    выводимых объявлений. Каждая страница проверяется с одним и с
+    несколькими объявлениями, число запросов сверяется с бюджетом.
+    Кэширование страниц для гостей отключено.
+    """
+    def count_queries(self, url):
+        # первый запрос прогревает кэш дерева рубрик
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertQueryBudget(self, budget, url_name, login=False, url_kwargs=None):
+        if login:
+            self.client.force_login(self.user)
+        first = self.create_bb()
+        url = reverse(url_name, kwargs=url_kwargs(first) if url_kwargs else None)
+        single = self.count_queries(url)
+        for i in range(5):
+            self.create_bb(title='Товар %s' % i)
+        several = self.count_queries(url)
+        self.assertEqual(single, several)
+        self.assertLessEqual(several, budget)
+
+    def test_index(self):
+        self.assertQueryBudget(1, 'main:index')
+
+    def test_by_rubric(self):
+        # рубрика, COUNT(*) пагинатора, объявления
+        self.assertQueryBudget(3, 'main:by_rubric',
+                url_kwargs=lambda bb: {'pk': bb.rubric_id})
+
+    def test_profile(self):
+        # сессия, пользователь, объявления
+        self.assertQueryBudget(3, 'main:profile', login=True)
+
+    def test_detail(self):
+        # объявление, комментарии, задание captcha; пустые иллюстрации не
+        # запрашиваются
+        self.assertQueryBudget(3, 'main:detail',
+                url_kwargs=lambda bb: {'rubric_pk': bb.rubric_id, 'pk': bb.pk})
+
+    def test_profile_bb_detail(self):
+        # сессия, пользователь, объявление, комментарии
+        self.assertQueryBudget(4, 'main:profile_bb_detail', login=True,
+                url_kwargs=lambda bb: {'pk': bb.pk})
+
+
+class KeysetPaginationTests(BboardTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bbs = [self.create_bb(title='Ноутбук %s' % i) for i in range(3)]
+        self.bbs += [self.create_bb(title='Мышь %s' % i) for i in range(2)]
+        self.bbs.reverse()
+
+    def test_cursor_walks_all_ads_newest_first(self):
+        url = reverse('main:by_rubric', kwargs={'pk': self.rubric.pk})
+        response = self.client.get(url, {'cursor': ''})
+        seen = list(response.context['bbs'])
+        cursor = response.context['next_cursor']
+        while cursor:
+            response = self.client.get(url, {'cursor': cursor})
+            seen += response.context['bbs']
+            cursor = response.context['next_cursor']
+        self.assertEqual(seen, self.bbs)
+
+    def test_cursor_carries_keyword(self):
+        url = reverse('main:by_rubric', kwargs={'pk': self.rubric.pk})
+        with self.settings(BBS_PAGINATION_MODE='keyset'):
+            response = self.client.get(url, {'keyword': 'ноутбуки'})
+        more_url = reverse('main:by_rubric_more', kwargs={'pk': self.rubric.pk})
+        response = self.client.get(more_url, {'cursor': response.context['next_cursor']})
+        self.assertEqual(list(response.context['bbs']), [self.bbs[4]])
+        self.assertEqual(response['X-Next-Cursor'], '')
+
+    @override_settings(PAGE_CACHE_TIMEOUT=0)
+    def test_deep_page_costs_same_as_first(self):
+        more_url = reverse('main:by_rubric_more', kwargs={'pk': self.rubric.pk})
+        self.client.get(more_url)
+        with CaptureQueriesContext(connection) as first:
+            response = self.client.get(more_url)
+        cursor = response['X-Next-Cursor']
+        with CaptureQueriesContext(connection) as deep:
+            self.client.get(more_url, {'cursor': cursor})
+        self.assertEqual(len(first), len(deep))
+        self.assertNotIn('COUNT', deep[0]['sql'])
+
+
+class FacetTests(BboardTestCase):
+    def assertFacetsConsistent(self):
+        stored = {(facet.rubric_id, facet.bucket): facet.count
+                for facet in RubricFacet.objects.exclude(count=0)}
+        self.assertEqual(stored, dict(facet_counts(Bb.objects.all())))
+
+    def test_summary_follows_saves_and_deletes(self):
+        other = SubRubric.objects.create(name='Мыши', super_rubric=self.super_rubric)
+        cheap = self.create_bb(price=500)
+        dear = self.create_bb(price=20000)
+        self.create_bb(price=700, is_active=False)
+        self.assertEqual(get_facets()[self.rubric.pk], [1, 0, 0, 1, 0, 0])
+        cheap = Bb.objects.get(pk=cheap.pk)
+        cheap.price = 3000
+        cheap.save()
+        dear.rubric = other
+        dear.save()
+        self.assertFacetsConsistent()
+        Bb.objects.get(pk=dear.pk).delete()
+        self.assertFacetsConsistent()
+        # фасет объявления, загруженного без цены, читается по ключу, а не
+        # пересчетом всей сводки
+        hidden = Bb.objects.only('pk', 'rubric').get(pk=cheap.pk)
+        hidden.is_active = False
+        with CaptureQueriesContext(connection) as queries:
+            hidden.save(update_fields=['is_active'])
+        self.assertFalse([query for query in queries if 'GROUP BY' in query['sql']])
+        self.assertFacetsConsistent()
+        shown = Bb.objects.only('pk').get(pk=cheap.pk)
+        shown.is_active = True
+        shown.price = 60000
+        shown.save(update_fields=['is_active', 'price'])
+        self.assertFacetsConsistent()
+        Bb.objects.filter(pk=cheap.pk).only('pk').delete()
+        self.assertFacetsConsistent()
+        RubricFacet.objects.all().delete()
+        rebuild_facets()
+        self.assertFacetsConsistent()
+
+    def test_fixtures_keep_summary_and_trigrams(self):
+        bb = self.create_bb(title='Ноутбук', price=500)
+        data = json.loads(serializers.serialize('json', [bb]))
+        Bb.objects.filter(pk=bb.pk).delete()
+        path = os.path.join(tempfile.mkdtemp(), 'bbs.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        for price in (500, 20000):
+            data[0]['fields']['price'] = price
+            with open(path, 'w') as output:
+                json.dump(data, output)
+            call_command('loaddata', path, verbosity=0)
+            self.assertFacetsConsistent()
+        self.assertEqual([pk for similarity, pk, title in similar_titles('ноутбук')], [bb.pk])
+
+    def test_summary_is_read_in_one_query(self):
+        for price in (100, 2000, 60000, 60000):
+            self.create_bb(price=price)
+        with self.assertNumQueries(1):
+            get_facets()
+        with self.assertNumQueries(0):
+            facets = get_facets()
+        self.assertEqual(facets[self.rubric.pk], [1, 1, 0, 0, 2, 0])
+
+    def test_by_rubric_filters_and_sorts_by_price(self):
+        prices = (100, 3000, 2000, 60000, 4000)
+        bbs = {price: self.create_bb(title='Товар %s' % price, price=price) for price in prices}
+        url = reverse('main:by_rubric', kwargs={'pk': self.rubric.pk})
+        response = self.client.get(url)
+        self.assertContains(response, '1000 - 5000 руб. (3)')
+        self.assertContains(response, 'Ноутбуки <span class="badge badge-light">5</span>')
+        response = self.client.get(url, {'bucket': 1, 'sort': '-price'})
+        self.assertEqual(list(response.context['bbs']), [bbs[4000], bbs[3000]])
+        self.assertEqual(response.context['page'].paginator.count, 3)
+        with self.settings(BBS_PAGINATION_MODE='keyset'):
+            response = self.client.get(url, {'price_min': 2000, 'sort': 'price'})
+        seen = list(response.context['bbs'])
+        more_url = reverse('main:by_rubric_more', kwargs={'pk': self.rubric.pk})
+        cursor = response.context['next_cursor']
+        while cursor:
+            response = self.client.get(more_url, {'cursor': cursor})
+            seen += response.context['bbs']
+            cursor = response['X-Next-Cursor']
+        self.assertEqual(seen, [bbs[2000], bbs[3000], bbs[4000], bbs[60000]])
+
+
+class MediaTestCase(BboardTestCase):
+    """
+    Тесты, сохраняющие файлы, работают во временной папке MEDIA_ROOT,
+    фоновые задачи и создание копий изображений выполняются сразу.
+    """
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media_settings = override_settings(
+                MEDIA_ROOT=self.media_root,
+                BACKGROUND_WORKERS={'default': 0},
+                VARIANT_PROCESSES=0,
+                )
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+
+class ThumbnailTests(MediaTestCase):
+    def test_thumbnail_is_generated_on_save(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            bb = self.create_bb(image=self.make_image())
+        url = ready_thumbnail(bb.image, 'default')
+        self.assertIn('96x96', url)
+
+    def test_missing_thumbnail_is_not_generated_in_render(self):
+        # без фиксации транзакции миниатюра не создается
+        bb = self.create_bb(image=self.make_image())
+        # имя файла определяется содержимым и повторяется в других тестах,
+        # поэтому незавершенное создание миниатюр не должно им мешать
+        self.addCleanup(thumbnails._pending.discard, bb.image.name)
+        with mock.patch('main.thumbnails.submit') as submit:
+            url = ready_thumbnail(bb.image, 'default')
+        self.assertTrue(url.endswith('main/empty.png'))
+        submit.assert_called_once()
+
+
+class StorageTests(MediaTestCase):
+    def assertRefs(self, name, refs):
+        self.assertEqual(list(MediaBlob.objects.filter(name=name).values_list('refs', flat=True)),
+                [refs] if refs else [])
+        self.assertEqual(os.path.exists(os.path.join(self.media_root, name)), bool(refs))
+
+    def test_identical_images_are_stored_once(self):
+        bb = self.create_bb(image=self.make_image('a.PNG'))
+        other = self.create_bb(image=self.make_image('b.png'))
+        name = bb.image.name
+        self.assertTrue(is_blob_name(name))
+        self.assertTrue(name.endswith('.png'))
+        self.assertEqual(other.image.name, name)
+        self.assertRefs(name, 2)
+        # django_cleanup удаляет файл после фиксации транзакции
+        with self.captureOnCommitCallbacks(execute=True):
+            bb.delete()
+        self.assertRefs(name, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            delete_bbs(Bb.objects.filter(pk=other.pk))
+        self.assertRefs(name, 0)
+
+    def test_replaced_image_is_released(self):
+        bb = self.create_bb(image=self.make_image())
+        old_name = bb.image.name
+        bb.image = self.make_image(color='blue')
+        with self.captureOnCommitCallbacks(execute=True):
+            bb.save()
+        self.assertRefs(old_name, 0)
+        self.assertRefs(bb.image.name, 1)
+
+    def test_failed_save_keeps_no_reference(self):
+        bb = self.create_bb(image=self.make_image(color='blue'))
+        # отрицательный счетчик нарушает ограничение CHECK уже после
+        # сохранения файла
+        with self.assertRaises(IntegrityError):
+            self.create_bb(image=self.make_image(), comments_count=-1)
+        with self.assertRaises(IntegrityError):
+            self.create_bb(image=self.make_image(color='blue'), comments_count=-1)
+        self.assertEqual(list(MediaBlob.objects.values_list('name', 'refs')),
+                [(bb.image.name, 1)])
+        stored = [name for path, dirs, names in os.walk(self.media_root) for name in names]
+        self.assertEqual(stored, [os.path.basename(bb.image.name)])
+
+    def test_dedupe_command_moves_legacy_files(self):
+        names = []
+        for i in range(2):
+            name = 'legacy_%s.png' % i
+            with open(os.path.join(self.media_root, name), 'wb') as output:
+                output.write(self.make_image().read())
+            names.append(name)
+        first = self.create_bb(image=names[0])
+        second = self.create_bb(image=names[1])
+        AdditionalImage.objects.bulk_create([AdditionalImage(bb=first, image=names[1])])
+        MediaBlob.objects.bulk_create([MediaBlob(name=names[0], refs=1),
+                MediaBlob(name=names[1], refs=2)])
+        call_command('dedupe_media', batch_size=1, stdout=io.StringIO(), stderr=io.StringIO())
+        first.refresh_from_db()
+        second.refresh_from_db()
+        name = first.image.name
+        self.assertTrue(is_blob_name(name))
+        self.assertEqual(second.image.name, name)
+        self.assertEqual(first.additionalimage_set.get().image.name, name)
+        self.assertRefs(name, 3)
+        for legacy in names:
+            self.assertRefs(legacy, 0)
+
+
+class VariantTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def detail_url(self, bb):
+        return reverse('main:detail', kwargs={'rubric_pk': bb.rubric_id, 'pk': bb.pk})
+
+    def test_detail_page_uses_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            bb = self.create_bb(image=self.make_image(size=(800, 600)))
+            AdditionalImage.objects.create(bb=bb, image=self.make_image(color='blue'))
+        name = bb.image.name
+        # копии не шире оригинала
+        self.assertEqual(get_variants(name)['widths'], [180, 360, 600, 800])
+        response = self.client.get(self.detail_url(bb))
+        self.assertContains(response, '<source type="image/webp"', count=2)
+        self.assertContains(response, '%s%s 360w' % (settings.MEDIA_URL,
+                variant_name(name, 360, 'webp')))
+        self.assertContains(response, 'src="%s%s"' % (settings.MEDIA_URL,
+                variant_name(name, 800, 'jpg')))
+        self.assertNotContains(response, bb.image.url)
+
+    def test_original_is_shown_until_variants_are_ready(self):
+        bb = self.create_bb(image=self.make_image())
+        with mock.patch('main.variants.submit') as submit:
+            response = self.client.get(self.detail_url(bb))
+        self.addCleanup(variants._pending.discard, bb.image.name)
+        self.assertContains(response, 'src="%s"' % bb.image.url)
+        submit.assert_called_once()
+
+    def test_missing_variants_are_cached(self):
+        bb = self.create_bb(image=self.make_image())
+        name = bb.image.name
+        self.addCleanup(variants._pending.discard, name)
+        with mock.patch('main.variants.submit'), \
+                mock.patch('main.variants.read_manifest', return_value=None) as read:
+            self.assertIsNone(picture_sources(name))
+            self.assertIsNone(picture_sources(name))
+        read.assert_called_once_with(name)
+        # готовый перечень заменяет отметку об отсутствии копий
+        generate_variants(name)
+        self.assertEqual(get_variants(name)['widths'], [180, 200])
+
+    @override_settings(VARIANT_PROCESSES=1)
+    def test_variants_are_rendered_by_process_pool(self):
+        bb = self.create_bb(image=self.make_image())
+        manifest = generate_variants(bb.image.name)
+        self.assertEqual(manifest['widths'], [180, 200])
+        path = os.path.join(self.media_root, variant_name(bb.image.name, 180, 'webp'))
+        with Image.open(path) as image:
+            self.assertEqual((image.format, image.width), ('WEBP', 180))
+
+    def test_backfill_command_and_cleanup(self):
+        bb = self.create_bb(image=self.make_image())
+        name = bb.image.name
+        # отметка об отсутствии копий заменяется перечнем
+        self.assertIsNone(get_variants(name))
+        generation = get_bbs_generation()
+        call_command('generate_variants', processes=1, stdout=io.StringIO())
+        self.assertIsNotNone(get_variants(name))
+        # кэшированные списки объявлений копий не выводят
+        self.assertEqual(get_bbs_generation(), generation)
+        path = os.path.join(self.media_root, variant_name(name, 200, 'jpg'))
+        self.assertTrue(os.path.exists(path))
+        # копии удаляются вместе с последней ссылкой на файл
+        with self.captureOnCommitCallbacks(execute=True):
+            bb.delete()
+        self.assertIsNone(get_variants(name))
+        self.assertFalse(os.path.exists(path))
+
+
+class BulkDeletionTests(MediaTestCase):
+    def create_bbs(self, count):
+        bbs = []
+        for i in range(count):
+            bb = self.create_bb(title='Ноутбук %s' % i, image=self.make_image())
+            AdditionalImage.objects.create(bb=bb, image=self.make_image())
+            Comment.objects.create(bb=bb, author='гость', content='Продано?')
+            bbs.append(bb)
+        return bbs
+
+    def test_user_delete_removes_graph_and_files(self):
+        bbs = self.create_bbs(3)
+        files = [bb.image.path for bb in bbs]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertFalse(Bb.objects.exists())
+        self.assertFalse(AdditionalImage.objects.exists())
+        self.assertFalse(Comment.objects.exists())
+        self.assertFalse(search_bbs(Bb.objects.all(), 'ноутбук').exists())
+        self.assertFalse(any(os.path.exists(path) for path in files))
+
+    def test_bb_delete_returns_model_delete_result(self):
+        bb, = self.create_bbs(1)
+        self.assertEqual(bb.delete(), (1, {'main.Bb': 1}))
+
+    def test_query_count_does_not_depend_on_ads_count(self):
+        self.create_bbs(1)
+        with CaptureQueriesContext(connection) as one:
+            delete_bbs(Bb.objects.filter(author=self.user))
+        self.create_bbs(5)
+        with CaptureQueriesContext(connection) as several:
+            delete_bbs(Bb.objects.filter(author=self.user))
+        self.assertEqual(len(one), len(several))
+
+
+class CounterTests(MediaTestCase):
+    def assertCounters(self, bb, comments, images):
+        bb.refresh_from_db()
+        self.assertEqual((bb.comments_count, bb.images_count), (comments, images))
+
+    def test_counters_follow_comments_and_images(self):
+        bb = self.create_bb()
+        other = self.create_bb(title='Другой')
+        comment = Comment.objects.create(bb=bb, author='гость', content='Продано?')
+        Comment.objects.create(bb=bb, author='гость', content='Скрыт', is_active=False)
+        image = AdditionalImage.objects.create(bb=bb, image=self.make_image())
+        self.assertCounters(bb, 1, 1)
+        # модерация и перенос загруженного из БД комментария
+        comment = Comment.objects.get(pk=comment.pk)
+        comment.is_active = False
+        comment.save()
+        self.assertCounters(bb, 0, 1)
+        comment.is_active = True
+        comment.bb = other
+        comment.save()
+        self.assertCounters(bb, 0, 1)
+        self.assertCounters(other, 1, 0)
+        # комментарий, загруженный без is_active, пересчитывается целиком
+        Comment.objects.only('pk', 'bb').get(pk=comment.pk).delete()
+        self.assertCounters(other, 0, 0)
+        image.delete()
+        self.assertCounters(bb, 0, 0)
+
+    @override_settings(PAGE_CACHE_TIMEOUT=0)
+    def test_listing_shows_counters_without_extra_queries(self):
+        bb = self.create_bb()
+        Comment.objects.create(bb=bb, author='гость', content='Продано?')
+        AdditionalImage.objects.create(bb=bb, image=self.make_image())
+        # первый запрос прогревает кэш дерева рубрик
+        self.client.get(reverse('main:index'))
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('main:index'))
+        self.assertContains(response, 'Комментариев: 1, дополнительных фото: 1')
+
+    def test_recount_command_repairs_counters(self):
+        bb = self.create_bb()
+        Comment.objects.bulk_create([Comment(bb=bb, author='гость', content='Продано?')])
+        Bb.objects.filter(pk=bb.pk).update(images_count=7)
+        call_command('recount_bbs', batch_size=1, stdout=io.StringIO())
+        self.assertCounters(bb, 1, 0)
+
+
+class CaptchaPoolTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_refill_renders_images_in_advance(self):
+        self.assertEqual(refill_pool(3), (0, 3))
+        self.assertEqual(refill_pool(3), (0, 0))
+        for key in CaptchaStore.objects.values_list('hashkey', flat=True):
+            self.assertTrue(os.path.exists(os.path.join(self.media_root, image_name(key, 1))))
+        with mock.patch('main.views.captcha_image') as render:
+            response = self.client.get('/captcha/image/%s/' % key)
+        render.assert_not_called()
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(Image.open(io.BytesIO(response.content)).format, 'PNG')
+
+    def test_detail_picks_challenge_without_writes(self):
+        refill_pool(3)
+        bb = self.create_bb()
+        url = reverse('main:detail', kwargs={'rubric_pk': bb.rubric_id, 'pk': bb.pk})
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertFalse([q for q in queries if not q['sql'].startswith('SELECT')])
+        key = response.context['form']['captcha'].field.widget._key
+        self.assertTrue(CaptchaStore.objects.filter(hashkey=key).exists())
+        self.assertEqual(CaptchaStore.objects.count(), 3)
+
+    @override_settings(CAPTCHA_POOL_SIZE=2)
+    def test_empty_pool_falls_back_to_new_challenge(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            key = pick_challenge()
+        self.assertTrue(CaptchaStore.objects.filter(hashkey=key).exists())
+        # после фиксации транзакции пул пополнен в фоне
+        self.assertEqual(CaptchaStore.objects.count(), 1 + settings.CAPTCHA_POOL_SIZE)
+
+    def test_solved_and_expired_challenges_are_reaped(self):
+        refill_pool(3)
+        solved, expired, kept = CaptchaStore.objects.order_by('pk')
+        bb = self.create_bb()
+        url = reverse('main:detail', kwargs={'rubric_pk': bb.rubric_id, 'pk': bb.pk})
+        self.client.post(url, {'bb': bb.pk, 'author': 'гость', 'content': 'Продано?',
+                'captcha_0': solved.hashkey, 'captcha_1': solved.response})
+        self.assertEqual(bb.comment_set.count(), 1)
+        CaptchaStore.objects.filter(pk=expired.pk).update(expiration=timezone.now())
+        self.assertEqual(refill_pool(1), (1, 0))
+        self.assertEqual(list(CaptchaStore.objects.all()), [kept])
+        images = os.listdir(os.path.join(self.media_root, 'captcha_pool'))
+        self.assertEqual({name.split('.')[0].split('@')[0] for name in images}, {kept.hashkey})
+
+
+class PageCacheTests(BboardTestCase):
+    def test_anonymous_page_is_served_from_cache(self):
+        self.create_bb(title='Ноутбук')
+        url = reverse('main:by_rubric', kwargs={'pk': self.rubric.pk})
+        self.client.get(url, {'keyword': 'ноутбук'})
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'keyword': 'ноутбук'})
+        self.assertContains(response, 'Ноутбук')
+
+    def test_cache_is_keyed_by_query(self):
+        self.create_bb(title='Клавиатура')
+        self.create_bb(title='Мышь')
+        url = reverse('main:by_rubric', kwargs={'pk': self.rubric.pk})
+        self.client.get(url, {'keyword': 'клавиатура'})
+        response = self.client.get(url, {'keyword': 'мышь'})
+        self.assertContains(response, 'Мышь')
+        self.assertNotContains(response, 'Клавиатура')
+
+    def test_page_is_invalidated_by_changes(self):
+        url = reverse('main:index')
+        self.client.get(url)
+        bb = self.create_bb(title='Гараж')
+        self.assertContains(self.client.get(url), 'Гараж')
+        bb.delete()
+        self.assertNotContains(self.client.get(url), 'Гараж')
+        self.create_bb(title='Сарай')
+        self.client.get(url)
+        self.rubric.name = 'Ноутбуки и планшеты'
+        self.rubric.save()
+        self.assertContains(self.client.get(url), 'Ноутбуки и планшеты')
+
+    def test_changes_expire_only_affected_rubrics(self):
+        other = SubRubric.objects.create(name='Мыши', super_rubric=self.super_rubric)
+        garage = self.create_bb(title='Гараж')
+        self.create_bb(title='Сарай', rubric=other)
+        urls = [reverse('main:by_rubric', kwargs={'pk': rubric.pk})
+                for rubric in (self.rubric, other)]
+        info_url = reverse('main:other', kwargs={'page': 'about'})
+        for url in urls + [info_url]:
+            self.client.get(url)
+        # комментарий меняет только карточку объявления в списке его рубрики
+        Comment.objects.create(bb=garage, author='гость', content='Продано?')
+        with self.assertNumQueries(0):
+            self.client.get(urls[1])
+            self.client.get(info_url)
+        self.assertContains(self.client.get(urls[0]), 'Комментариев: 1')
+        # перенос объявления меняет списки обеих рубрик
+        garage.rubric = other
+        garage.save()
+        self.assertNotContains(self.client.get(urls[0]), 'Гараж')
+        self.assertContains(self.client.get(urls[1]), 'Гараж')
+        self.assertContains(self.client.get(info_url),
+                'Мыши <span class="badge badge-light">2</span>')
+
+    def test_authenticated_pages_are_not_cached(self):
+        self.client.force_login(self.user)
+        url = reverse('main:index')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertTrue(queries)
+
+
+class CommentPaginationTests(BboardTestCase):
+    def test_comments_are_served_in_pages(self):
+        bb = self.create_bb()
+        comments = [Comment.objects.create(bb=bb, author='гость', content='№%s' % i)
+                for i in range(25)]
+        Comment.objects.create(bb=bb, author='спамер', content='скрыт', is_active=False)
+        kwargs = {'rubric_pk': bb.rubric_id, 'pk': bb.pk}
+        response = self.client.get(reverse('main:detail', kwargs=kwargs))
+        self.assertEqual(list(response.context['comments']), comments[:20])
+        response = self.client.get(reverse('main:comments_more', kwargs=kwargs),
+                {'cursor': response.context['comments_cursor']})
+        self.assertEqual(list(response.context['comments']), comments[20:])
+        self.assertEqual(response['X-Next-Cursor'], '')
+
+
+class ActivationMailTests(BboardTestCase):
+    def register(self, username):
+        return self.client.post(reverse('main:register'), {
+            'username': username, 'email': '%s@example.com' % username,
+            'password1': 'vvvvvvvv11', 'password2': 'vvvvvvvv11',
+            })
+
+    def test_registration_does_not_send_mail(self):
+        response = self.register('buyer')
+        self.assertRedirects(response, reverse('main:register_done'))
+        self.assertEqual(len(mail.outbox), 0)
+        letter = ActivationLetter.objects.get(user__username='buyer')
+        self.assertEqual(letter.status, ActivationLetter.PENDING)
+
+    def test_batch_is_sent_over_one_connection(self):
+        for name in ('buyer1', 'buyer2', 'buyer3'):
+            self.register(name)
+        with mock.patch('main.mailing.get_connection', wraps=mail.get_connection) as get_connection:
+            self.assertEqual(deliver_pending(), 3)
+        get_connection.assert_called_once()
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertIn('/accounts/register/activate/', mail.outbox[0].body)
+        self.assertFalse(ActivationLetter.objects.exclude(status=ActivationLetter.SENT).exists())
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        enqueue_activation_letters([self.user])
+        connection = mock.Mock()
+        connection.send_messages.side_effect = OSError('connection refused')
+        with mock.patch('main.mailing.get_connection', return_value=connection):
+            self.assertEqual(deliver_pending(), 0)
+            # следующая попытка еще не наступила
+            self.assertEqual(deliver_pending(), 0)
+        letter = ActivationLetter.objects.get()
+        self.assertEqual(letter.attempts, 1)
+        self.assertEqual(letter.status, ActivationLetter.PENDING)
+        self.assertGreater(letter.next_attempt_at, letter.created_at)
+        self.assertEqual(connection.send_messages.call_count, 1)
+        ActivationLetter.objects.update(next_attempt_at=letter.created_at)
+        self.assertEqual(deliver_pending(), 1)
+
+
+class InfoPageTests(BboardTestCase):
+    def test_known_page_is_served_with_etag(self):
+        url = reverse('main:other', kwargs={'page': 'about'})
+        response = self.client.get(url)
+        self.assertContains(response, 'О сайте')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_unknown_and_view_templates_are_rejected(self):
+        for page in ('missing', 'login', 'profile'):
+            url = reverse('main:other', kwargs={'page': page})
+            self.assertEqual(self.client.get(url).status_code, 404)
+        request = RequestFactory().get('/missing/')
+        with mock.patch('django.template.loader.get_template') as get_template:
+            with self.assertRaises(Http404):
+                other_page(request, 'missing')
+        get_template.assert_not_called()
+
+    def test_page_follows_rubric_changes(self):
+        url = reverse('main:other', kwargs={'page': 'about'})
+        self.client.get(url)
+        SubRubric.objects.create(name='Планшеты', super_rubric=self.super_rubric)
+        self.assertContains(self.client.get(url), 'Планшеты')
+
+    def test_page_follows_bb_counts(self):
+        url = reverse('main:other', kwargs={'page': 'about'})
+        self.client.get(url)
+        self.create_bb()
+        self.create_bb(title='Еще товар')
+        self.assertContains(self.client.get(url), 'Ноутбуки <span class="badge badge-light">2</span>')
+
+
+class QueryPlanTests(BboardTestCase):
+    def test_view_queries_use_indexes(self):
+        for name, (plan, problems) in check_query_plans().items():
+            with self.subTest(name):
+                self.assertEqual(problems, [], '\n'.join(plan))
+
+
+@override_settings(PAGE_CACHE_TIMEOUT=0)
+class BenchmarkTests(MediaTestCase):
+    def test_percentile_uses_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 95), 7)
+
+    def test_seed_and_benchmark_every_route(self):
+        call_command('seed_bboard', users=2, super_rubrics=1, sub_rubrics=2, bbs=6,
+                comments=3, images=1, seed=1, stdout=io.StringIO())
+        self.assertEqual(Bb.objects.count(), 6)
+        self.assertEqual(Comment.objects.count(), 18)
+        user, bb = pick_fixture()
+        self.assertTrue(search_bbs(Bb.objects.all(), bb.title.split()[0]).exists())
+        scenarios = default_scenarios(user, bb)
+        # новый маршрут не должен остаться без замера
+        self.assertEqual({scenario.route for scenario in scenarios},
+                {pattern.name for pattern in main_urls.urlpatterns})
+        bbs_count = Bb.objects.count()
+        results = run_benchmark(scenarios, user, 'vvvvvvvv11', iterations=2, warmup=1)
+        for name in ('profile_bb_add_post', 'profile_bb_change_post',
+                'profile_bb_delete_post', 'profile_change_post', 'profile_delete_post'):
+            self.assertEqual(results[name]['status'], [302])
+        self.assertEqual(results['perf_stats']['status'], [200])
+        # каждый сценарий выполнил 4 запроса (прогрев, два замера, замер
+        # памяти): копии объявления для изменения остались, для удаления -
+        # удалены, и по объявлению добавлено каждым запросом добавления
+        self.assertEqual(Bb.objects.count(), bbs_count + 2 * 4)
+        for name, result in results.items():
+            with self.subTest(name):
+                self.assertLess(max(result['status']), 400)
+                self.assertIn('p95_ms', result)
+
+
+@override_settings(PAGE_CACHE_TIMEOUT=0, SERVER_TIMING=True)
+class InstrumentationTests(BboardTestCase):
+    def test_server_timing_header(self):
+        self.create_bb()
+        # первый запрос строит дерево рубрик
+        self.client.get(reverse('main:index'))
+        response = self.client.get(reverse('main:index'))
+        timing = response['Server-Timing']
+        self.assertIn('db;desc="1 queries"', timing)
+        self.assertRegex(timing, r'tpl;dur=(?!0\.000)[\d.]+')
+        self.assertIn('total;dur=', timing)
+
+    def test_histograms_are_dumped_for_staff_only(self):
+        dump_histograms(reset=True)
+        self.client.get(reverse('main:index'))
+        self.client.get(reverse('main:index'))
+        url = reverse('main:perf_stats')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        AdvUser.objects.create_user(username='admin', password='vvvvvvvv11', is_staff=True)
+        self.client.login(username='admin', password='vvvvvvvv11')
+        stats = self.client.get(url + '?reset=1').json()
+        self.assertEqual(stats['main:index']['count'], 2)
+        self.assertEqual(sum(stats['main:index']['buckets'].values()), 2)
+        self.assertNotIn('main:index', dump_histograms())
+
+
+class DatabaseProfileTests(SimpleTestCase):
+    """
+    Проверки профилей подключения на отдельном файле БД: тестовая БД
+    SQLite находится в памяти и журнал WAL не поддерживает.
+    """
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'concurrency.sqlite3')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.path))
+
+    def connect(self, profile, cleanup=True, **options):
+        settings_dict = {**connections['default'].settings_dict, 'NAME': self.path,
+                'OPTIONS': {}, 'PRAGMAS': {}, 'IMMEDIATE_TRANSACTIONS': False}
+        settings_dict.update(settings.DATABASE_PROFILES[profile])
+        settings_dict['OPTIONS'] = {**settings_dict['OPTIONS'], **options}
+        wrapper = connections['default'].__class__(settings_dict, alias='profile-%s' % profile)
+        if cleanup:
+            self.addCleanup(wrapper.close)
+        return wrapper
+
+    def create_table(self, wrapper):
+        cursor = wrapper.cursor()
+        cursor.execute('CREATE TABLE IF NOT EXISTS item (id integer)')
+        cursor.execute('INSERT INTO item VALUES (1)')
+
+    def test_readers_do_not_wait_for_writer(self):
+        for profile, blocked in (('default', True), ('production', False)):
+            with self.subTest(profile):
+                writer = self.connect(profile)
+                reader = self.connect(profile, timeout=0.2)
+                self.create_table(writer)
+                cursor = writer.cursor()
+                # при фиксации транзакции писатель держит монопольную блокировку
+                cursor.execute('BEGIN EXCLUSIVE')
+                cursor.execute('INSERT INTO item VALUES (2)')
+                try:
+                    if blocked:
+                        with self.assertRaises(OperationalError):
+                            reader.cursor().execute('SELECT count(*) FROM item')
+                    else:
+                        count = reader.cursor().execute('SELECT count(*) FROM item').fetchone()
+                        self.assertEqual(count, (1,))
+                finally:
+                    cursor.execute('COMMIT')
+                writer.close()
+                reader.close()
+                os.remove(self.path)
+
+    def test_concurrent_writers_wait_for_their_turn(self):
+        self.create_table(self.connect('production'))
+        errors = []
+
+        def write():
+            wrapper = self.connect('production', cleanup=False)
+            wrapper.ensure_connection()
+            try:
+                for i in range(10):
+                    # так начинает транзакцию atomic() (после ensure_connection())
+                    wrapper._start_transaction_under_autocommit()
+                    cursor = wrapper.cursor()
+                    count = cursor.execute('SELECT count(*) FROM item').fetchone()[0]
+                    # даем другим потокам вклиниться между чтением и записью
+                    time.sleep(0.001)
+                    cursor.execute('INSERT INTO item VALUES (%s)', [count + 1])
+                    cursor.execute('COMMIT')
+            except OperationalError as e:
+                errors.append(e)
+            finally:
+                wrapper.close()
+
+        threads = [threading.Thread(target=write) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        cursor = self.connect('production').cursor()
+        self.assertEqual(cursor.execute('SELECT count(DISTINCT id) FROM item').fetchone(), (41,))
+
+
+class ReplicaRoutingTests(BboardTestCase):
+    def route(self, request):
+        router = ReplicaRouter()
+
+        @read_replica
+        def view(request):
+            return (router.db_for_read(Bb), router.db_for_read(AdvUser),
+                    router.db_for_write(Bb))
+
+        return view(request)
+
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    def test_read_views_use_replica_for_content_only(self):
+        factory = RequestFactory()
+        self.assertEqual(self.route(factory.get('/')), ('replica', 'default', 'default'))
+        self.assertEqual(self.route(factory.post('/')), ('default', 'default', 'default'))
+        request = factory.get('/')
+        request.COOKIES[settings.REPLICA_STICKY_COOKIE] = '1'
+        self.assertEqual(self.route(request), ('default', 'default', 'default'))
+        self.assertEqual(ReplicaRouter().db_for_read(Bb), 'default')
+
+    def test_unreplicated_writes_do_not_stick(self):
+        tracker, token = start_tracking_writes()
+        self.addCleanup(stop_tracking_writes, token)
+        router = ReplicaRouter()
+        router.db_for_write(CaptchaStore)
+        router.db_for_write(AdvUser)
+        self.assertFalse(tracker.wrote)
+        router.db_for_write(Comment)
+        self.assertTrue(tracker.wrote)
+        # задание captcha, созданное для гостя при пустом пуле
+        bb = self.create_bb()
+        response = self.client.get(reverse('main:detail',
+            kwargs={'rubric_pk': bb.rubric_id, 'pk': bb.pk}))
+        self.assertTrue(CaptchaStore.objects.exists())
+        self.assertNotIn(settings.REPLICA_STICKY_COOKIE, response.cookies)
+
+    def test_writer_reads_own_writes_from_primary(self):
+        bb = self.create_bb()
+        url = reverse('main:detail', kwargs={'rubric_pk': bb.rubric_id, 'pk': bb.pk})
+        self.client.login(username='seller', password='vvvvvvvv11')
+        response = self.client.get(url)
+        self.assertNotIn(settings.REPLICA_STICKY_COOKIE, response.cookies)
+        response = self.client.post(url, {'bb': bb.pk, 'author': 'seller', 'content': 'Торг?'})
+        cookie = response.cookies[settings.REPLICA_STICKY_COOKIE]
+        self.assertEqual(cookie['max-age'], settings.REPLICA_STICKY_SECONDS)
+
+
+class ExportTests(BboardTestCase):
+    def test_jsonl_export_streams_active_bbs_in_one_query(self):
+        bbs = [self.create_bb(title='Товар %s' % i) for i in range(5)]
+        self.create_bb(title='Скрытый', is_active=False)
+        response = self.client.get(reverse('main:export_bbs'))
+        self.assertTrue(response.streaming)
+        with self.assertNumQueries(1):
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual([row['id'] for row in rows], [bb.pk for bb in bbs])
+        self.assertEqual(rows[0]['rubric'], 'Ноутбуки')
+        self.assertEqual(rows[0]['super_rubric'], 'Техника')
+        self.assertEqual(rows[0]['author'], 'seller')
+
+    def test_csv_export_filters_by_rubric_and_date(self):
+        other = SubRubric.objects.create(name='Планшеты', super_rubric=self.super_rubric)
+        bb = self.create_bb(title='Ноутбук, "почти" новый')
+        self.create_bb(rubric=other)
+        response = self.client.get(reverse('main:export_bbs'), {'format': 'csv',
+            'rubric': self.rubric.pk, 'since': bb.created_at.date().isoformat()})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        content = b''.join(response.streaming_content).decode()
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual([row['title'] for row in rows], [bb.title])
+        response = self.client.get(reverse('main:export_bbs'), {'rubric': 'нет'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_command(self):
+        bb = self.create_bb()
+        output = io.StringIO()
+        call_command('export_bbs', stdout=output)
+        self.assertEqual(json.loads(output.getvalue())['id'], bb.pk)
+
+
+class ImportTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.source_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source_dir)
+        os.mkdir(os.path.join(self.source_dir, 'gallery'))
+        for name, color in (('gallery/1.png', 'red'), ('gallery/2.png', 'green'),
+                ('single.png', 'blue')):
+            with open(os.path.join(self.source_dir, name), 'wb') as output:
+                output.write(self.make_image(color=color).read())
+        with open(os.path.join(self.source_dir, 'broken.png'), 'wb') as output:
+            output.write(b'not an image')
+
+    def write_jsonl(self, records, name='bbs.jsonl', mode='w'):
+        path = os.path.join(self.source_dir, name)
+        with open(path, mode, encoding='utf-8') as output:
+            for record in records:
+                output.write(json.dumps(record, ensure_ascii=False) + '\n')
+        return path
+
+    def record(self, title, **kwargs):
+        record = {'title': title, 'content': 'Описание', 'contacts': 'тел. 1',
+                'rubric': 'Ноутбуки', 'author': 'seller'}
+        record.update(kwargs)
+        return record
+
+    def test_import_creates_bbs_images_and_search_index(self):
+        path = self.write_jsonl([
+            self.record('Ноутбук', image='gallery', created_at='2020-05-01T10:00:00'),
+            self.record('Планшет', rubric=str(self.rubric.pk), image='single.png;broken.png'),
+            self.record('Чужой', author='nobody'),
+            self.record('Без рубрики', rubric='Нет такой'),
+            self.record('Мышь', price='12.5', is_active='нет'),
+            ])
+        report = BbImporter(path, batch_size=2, workers=2).run()
+        self.assertEqual((report.records, report.imported, report.rejected), (5, 3, 2))
+        self.assertEqual((report.images, report.image_errors), (3, 1))
+        laptop = Bb.objects.get(title='Ноутбук')
+        self.assertEqual(laptop.created_at.year, 2020)
+        self.assertEqual(laptop.additionalimage_set.count(), 1)
+        self.assertEqual(laptop.images_count, 1)
+        names = [laptop.image.name, laptop.additionalimage_set.get().image.name,
+                Bb.objects.get(title='Планшет').image.name]
+        self.assertEqual(len(set(names)), 3)
+        for name in names:
+            self.assertTrue(os.path.exists(os.path.join(self.media_root, name)))
+        self.assertFalse(Bb.objects.get(title='Мышь').is_active)
+        self.assertEqual(list(search_bbs(Bb.objects.all(), 'ноутбук')), [laptop])
+
+    def test_repeated_images_are_copied_once(self):
+        path = self.write_jsonl([self.record('Первый', image='single.png'),
+            self.record('Второй', image='single.png;gallery/1.png')])
+        BbImporter(path, workers=2).run()
+        name = Bb.objects.get(title='Первый').image.name
+        self.assertEqual(Bb.objects.get(title='Второй').image.name, name)
+        self.assertEqual(MediaBlob.objects.get(name=name).refs, 2)
+        self.assertEqual(MediaBlob.objects.count(), 2)
+
+    def test_import_resumes_from_checkpoint(self):
+        path = self.write_jsonl([self.record('Первый'), self.record('Второй')])
+        checkpoint = path + '.checkpoint'
+        BbImporter(path, checkpoint=checkpoint).run()
+        self.write_jsonl([self.record('Третий')], mode='a')
+        report = BbImporter(path, checkpoint=checkpoint).run()
+        self.assertEqual((report.skipped_records, report.imported), (2, 1))
+        self.assertEqual(Bb.objects.count(), 3)
+
+    def test_import_command_reads_csv(self):
+        path = os.path.join(self.source_dir, 'bbs.csv')
+        with open(path, 'w', encoding='utf-8', newline='') as output:
+            writer = csv.DictWriter(output, fieldnames=list(self.record('x')))
+            writer.writeheader()
+            writer.writerow(self.record('Монитор, 24"'))
+        output = io.StringIO()
+        call_command('import_bbs', path, stdout=output, stderr=io.StringIO())
+        self.assertIn('импортировано: 1', output.getvalue())
+        self.assertTrue(Bb.objects.filter(title='Монитор, 24"').exists())
+
+
+class AsyncViewTests(BboardTestCase):
+    def setUp(self):
+        super().setUp()
+        urlconf = override_settings(ROOT_URLCONF=async_urlconf())
+        urlconf.enable()
+        self.addCleanup(urlconf.disable)
+
+    def test_read_views_are_async(self):
+        for name in async_views.ASYNC_VIEWS.values():
+            self.assertTrue(asyncio.iscoroutinefunction(name))
+
+    async def test_cached_page_is_served_without_database(self):
+        bb = await sync_to_async(self.create_bb)(title='Клавиатура')
+        url = reverse('main:by_rubric', kwargs={'pk': bb.rubric_id})
+        response = await self.async_client.get(url)
+        self.assertContains(response, 'Клавиатура')
+        # повторный запрос не доходит до синхронного контроллера
+        sync_view = mock.Mock(__name__='by_rubric', rubric_kwarg='pk')
+        view = async_views.cached_page_view(sync_view)
+        cached = await view(AsyncRequestFactory().get(url), pk=bb.rubric_id)
+        sync_view.assert_not_called()
+        self.assertEqual(cached.content, response.content)
+
+    async def test_external_cache_is_read_in_thread(self):
+        bb = await sync_to_async(self.create_bb)(title='Клавиатура')
+        url = reverse('main:by_rubric', kwargs={'pk': bb.rubric_id})
+        await self.async_client.get(url)
+        loop_thread = threading.current_thread()
+        threads = []
+        get_cached_page = async_views.get_cached_page
+
+        def recording(*args):
+            threads.append(threading.current_thread())
+            return get_cached_page(*args)
+        sync_view = mock.Mock(__name__='by_rubric', rubric_kwarg='pk')
+        view = async_views.cached_page_view(sync_view)
+        with mock.patch('main.async_views.get_cached_page', recording):
+            with mock.patch('main.async_views.cache_in_process', return_value=False):
+                cached = await view(AsyncRequestFactory().get(url), pk=bb.rubric_id)
+            with mock.patch('main.async_views.cache_in_process', return_value=True):
+                await view(AsyncRequestFactory().get(url), pk=bb.rubric_id)
+        sync_view.assert_not_called()
+        self.assertContains(cached, 'Клавиатура')
+        self.assertNotEqual(threads[0], loop_thread)
+        self.assertEqual(threads[1], loop_thread)
+
+    async def test_rubric_tree_is_read_before_sync_view(self):
+        bb = await sync_to_async(self.create_bb)(title='Клавиатура')
+        await sync_to_async(get_rubric_tree)()
+        with mock.patch('main.middlewares.get_rubric_tree') as sync_read:
+            response = await self.async_client.get(reverse('main:detail',
+                kwargs={'rubric_pk': bb.rubric_id, 'pk': bb.pk}))
+        sync_read.assert_not_called()
+        self.assertContains(response, 'Ноутбуки <span')
+
+    async def test_detail_and_info_page(self):
+        bb = await sync_to_async(self.create_bb)(title='Клавиатура')
+        response = await self.async_client.get(reverse('main:detail',
+            kwargs={'rubric_pk': bb.rubric_id, 'pk': bb.pk}))
+        self.assertContains(response, 'Клавиатура')
+        url = reverse('main:other', kwargs={'page': 'about'})
+        response = await self.async_client.get(url)
+        # AsyncClient в Django 4.0 передает заголовки как есть
+        response = await self.async_client.get(url, **{'if-none-match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
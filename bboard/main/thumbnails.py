@@ -0,0 +1,51 @@
+# Заблаговременное создание миниатюр изображений объявлений
+
+from easy_thumbnails.alias import aliases
+from easy_thumbnails.files import get_thumbnailer
+
+from .background import submit
+from .caching import bump_bbs_generation
+from .models import Bb
+
+# имена файлов, миниатюры которых уже поставлены в очередь
+_pending = set()
+
+
+def generate_thumbnails(name):
+    """
+    Создает миниатюры файла name для всех псевдонимов из THUMBNAIL_ALIASES.
+    Уже существующие и не устаревшие миниатюры повторно не создаются.
+    Возвращает количество созданных миниатюр.
+    """
+    thumbnailer = get_thumbnailer(name)
+    created = 0
+    for alias, options in aliases.all(include_global=True).items():
+        options = dict(options, ALIAS=alias)
+        if not thumbnailer.get_thumbnail(options, generate=False):
+            thumbnailer.get_thumbnail(options, generate=True)
+            created += 1
+    return created
+
+
+def _generate_pending(name):
+    try:
+        if generate_thumbnails(name):
+            # в кэшированных списках объявлений с этим изображением вместо
+            # миниатюры выведена заглушка
+            rubrics = set(Bb.objects.filter(image=name, is_active=True)
+                    .values_list('rubric', flat=True))
+            if rubrics:
+                bump_bbs_generation(rubrics)
+    finally:
+        _pending.discard(name)
+
+
+def schedule_thumbnails(name):
+    """
+    Ставит создание миниатюр в очередь пула 'thumbnails'. Повторные вызовы
+    для файла, миниатюры которого еще создаются, игнорируются.
+    """
+    if not name or name in _pending:
+        return
+    _pending.add(name)
+    submit(_generate_pending, name, pool='thumbnails')
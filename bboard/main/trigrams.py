@@ -0,0 +1,126 @@
+# Нечеткий поиск по названиям объявлений с помощью триграмм. Название
+# разбивается на слова, каждое слово, дополненное пробелами (два в начале,
+# один в конце), - на тройки символов. Триграммы всех объявлений хранятся
+# в таблице TitleTrigram с индексом по триграмме, поэтому кандидаты,
+# похожие на искомую фразу, выбираются по совпадающим триграммам, и
+# стоимость поиска зависит от количества записей с этими триграммами, а не
+# от числа объявлений.
+
+import math
+import re
+
+from django.db.models import Count
+
+from .models import Bb, TitleTrigram
+
+WORD_RE = re.compile(r'\w+')
+
+# доля триграмм искомой фразы, которая должна найтись в названии
+MIN_WORD_SIMILARITY = 0.5
+
+# наименьшее сходство слова, предлагаемого взамен искомого
+MIN_SUGGESTION_SIMILARITY = 0.4
+
+# количество кандидатов, выбираемых по индексу триграмм
+CANDIDATES_LIMIT = 50
+
+
+def words(text):
+    """
+    Слова текста в нижнем регистре, ё заменяется на е.
+    """
+    return WORD_RE.findall(text.casefold().replace('ё', 'е'))
+
+
+def word_trigrams(word):
+    padded = '  %s ' % word
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def trigrams(text):
+    """
+    Множество триграмм всех слов текста.
+    """
+    result = set()
+    for word in words(text):
+        result |= word_trigrams(word)
+    return result
+
+
+def similarity(first, second):
+    """
+    Сходство двух множеств триграмм (коэффициент Жаккара).
+    """
+    if not first or not second:
+        return 0.0
+    common = len(first & second)
+    return common / (len(first) + len(second) - common)
+
+
+def index_titles(bbs):
+    """
+    Добавляет в индекс триграммы названий новых объявлений (созданных,
+    в том числе, методом bulk_create()) одним пакетным запросом.
+    """
+    TitleTrigram.objects.bulk_create([
+        TitleTrigram(bb_id=bb.pk, trigram=trigram)
+        for bb in bbs for trigram in trigrams(bb.title)
+        ])
+
+
+def reindex_title(bb):
+    """
+    Заменяет триграммы названия объявления в индексе.
+    """
+    TitleTrigram.objects.filter(bb=bb.pk).delete()
+    index_titles([bb])
+
+
+def similar_titles(text, limit=CANDIDATES_LIMIT):
+    """
+    Активные объявления, названия которых содержат не менее
+    MIN_WORD_SIMILARITY триграмм фразы text. Возвращает список
+    (сходство, ключ, название), от самых похожих: сначала по доле
+    найденных триграмм фразы, затем по сходству всего названия.
+    """
+    wanted = trigrams(text)
+    if not wanted:
+        return []
+    min_common = math.ceil(len(wanted) * MIN_WORD_SIMILARITY)
+    # неактивные объявления отсекаются до ограничения числа кандидатов,
+    # иначе они занимали бы места активных
+    candidates = dict(TitleTrigram.objects.filter(trigram__in=wanted, bb__is_active=True)
+            .values_list('bb').annotate(common=Count('pk'))
+            .filter(common__gte=min_common).order_by('-common')[:limit])
+    found = []
+    titles = Bb.objects.filter(pk__in=list(candidates)).values_list('pk', 'title')
+    for pk, title in titles:
+        score = (candidates[pk] / len(wanted), similarity(wanted, trigrams(title)))
+        found.append((score, pk, title))
+    found.sort(reverse=True)
+    return [(score[0], pk, title) for score, pk, title in found]
+
+
+def suggest(keyword):
+    """
+    Исправленная искомая фраза для подсказки "Возможно, вы искали": каждое
+    слово, которого нет в похожих названиях, заменяется самым похожим
+    словом из них. Пустая строка, если исправлять нечего.
+    """
+    original = words(keyword)
+    vocabulary = set()
+    for score, pk, title in similar_titles(keyword):
+        vocabulary.update(words(title))
+    if not vocabulary:
+        return ''
+    corrected = []
+    for word in original:
+        best, best_similarity = word, MIN_SUGGESTION_SIMILARITY
+        if word not in vocabulary:
+            wanted = word_trigrams(word)
+            for candidate in sorted(vocabulary):
+                candidate_similarity = similarity(wanted, word_trigrams(candidate))
+                if candidate_similarity > best_similarity:
+                    best, best_similarity = candidate, candidate_similarity
+        corrected.append(best)
+    return ' '.join(corrected) if corrected != original else ''
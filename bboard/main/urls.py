@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 #from .views import index, other_page, BBLoginView, profile, BBLogoutView, ChangeUserInfoView 
 from .views import *
@@ -5,8 +6,13 @@ from .views import *
 app_name = 'main'
 
 urlpatterns = [
+    path('<int:rubric_pk>/<int:pk>/comments/', comments_more, name='comments_more'),
     path('<int:rubric_pk>/<int:pk>/', detail, name='detail'),
+    path('<int:pk>/more/', by_rubric_more, name='by_rubric_more'),
     path('<int:pk>/', by_rubric, name='by_rubric'),
+    path('stats/perf/', perf_stats, name='perf_stats'),
+    path('export/bbs/', export_bbs, name='export_bbs'),
+    path('search/', search, name='search'),
     path('<str:page>/', other_page, name='other'),
     path('accounts/login/', BBLoginView.as_view(), name='login'),
     path('accounts/logout/', BBLogoutView.as_view(), name='logout'),
@@ -23,3 +29,8 @@ urlpatterns = [
     path('accounts/register/', RegisterUserView.as_view(), name='register'),
     path('', index, name='index'),
 ]
+
+if settings.ASYNC_VIEWS:
+    # под ASGI страницы, только читающие данные, выводят асинхронные контроллеры
+    from .async_views import use_async_views
+    urlpatterns = use_async_views(urlpatterns)
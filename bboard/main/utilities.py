@@ -1,5 +1,6 @@
 from django.template.loader import render_to_string
 from django.core.signing import Signer
+from django.core.mail import EmailMessage
 
 from bboard.settings import ALLOWED_HOSTS
 
@@ -9,9 +10,9 @@ from os.path import splitext
 
 signer = Signer()
 
-def send_activation_notification(user):
+def make_activation_message(user):
     """
-    Отправляет письмо с требованием активации и
+    Формирует письмо с требованием активации и
     с подписанной ссылкой на страничку активации.
     """
     if ALLOWED_HOSTS:
@@ -22,8 +23,11 @@ def send_activation_notification(user):
     context = {'user': user, 'host': host, 'sign': signer.sign(user.username)}
     subject = render_to_string('email/activation_letter_subject.txt', context)
     body_text = render_to_string('email/activation_letter_body.txt', context)
-    user.email_user(subject, body_text)
+    # перевод строки в конце шаблона недопустим в заголовке письма
+    return EmailMessage(subject.strip(), body_text, to=[user.email])
 
 
+# хранилище изображений объявлений (main.storage) берет из этого имени только
+# расширение, а сам файл называет по хэшу содержимого
 def get_timestamp_path(instance, filename):
     return '%s%s' % (datetime.now().timestamp(), splitext(filename)[1])
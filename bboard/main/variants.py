@@ -0,0 +1,182 @@
+# Адаптивные копии изображений объявлений для страниц объявлений: каждое
+# изображение заранее уменьшается до нескольких значений ширины и
+# сохраняется в современных форматах (WebP и, если доступен, AVIF) и в
+# JPEG. Копии создаются один раз на файл (имена файлов определяются их
+# содержимым, см. main.storage) процессами пула, поскольку кодирование
+# изображений занимает процессор, а не ожидает ввода-вывода. Перечень
+# созданных копий читается с диска и кэшируется.
+
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+
+from .background import submit
+from .imaging import FORMATS, available_formats, render_variants
+from .models import Bb
+
+# папка с копиями изображений в хранилище
+VARIANTS_DIR = 'variants'
+
+# ширина копий: основная иллюстрация выводится шириной 300 пикселей,
+# дополнительные - 180, с запасом для экранов высокой плотности
+VARIANT_WIDTHS = (180, 360, 600, 900)
+VARIANT_QUALITY = 80
+
+VARIANTS_KEY = 'main:variants:%s'
+VARIANTS_TIMEOUT = 24 * 60 * 60
+# отсутствие перечня кэшируется ненадолго, пока копии создаются; после
+# создания копий cache_manifest() заменяет это значение перечнем
+VARIANTS_MISSING_TIMEOUT = 60
+
+MIME_TYPES = {extension: mime for extension, pil_format, mime in FORMATS}
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+# имена файлов, копии которых уже поставлены в очередь
+_pending = set()
+
+
+def variant_base(name):
+    return '%s/%s' % (VARIANTS_DIR, os.path.splitext(name)[0])
+
+
+def variant_name(name, width, extension):
+    return '%s_%s.%s' % (variant_base(name), width, extension)
+
+
+def get_process_pool():
+    """
+    Пул процессов создается при первой отправке задачи. Процессы
+    запускаются заново (spawn), а не копированием многопоточного процесса
+    сайта.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                    max_workers=settings.VARIANT_PROCESSES,
+                    mp_context=multiprocessing.get_context('spawn')
+                    )
+        return _process_pool
+
+
+def render_arguments(name):
+    """
+    Аргументы imaging.render_variants() для файла name: только пути и
+    параметры, передаваемые в другой процесс.
+    """
+    source = Bb._meta.get_field('image').storage.path(name)
+    return (source, default_storage.path(variant_base(name)), VARIANT_WIDTHS,
+            available_formats(), VARIANT_QUALITY)
+
+
+def generate_variants(name):
+    """
+    Создает копии файла name в процессе пула (при VARIANT_PROCESSES = 0 -
+    в вызывающем потоке). Возвращает перечень созданных копий.
+    """
+    arguments = render_arguments(name)
+    if settings.VARIANT_PROCESSES <= 0:
+        manifest = render_variants(*arguments)
+    else:
+        manifest = get_process_pool().submit(render_variants, *arguments).result()
+    cache_manifest(name, manifest)
+    return manifest
+
+
+def cache_manifest(name, manifest):
+    """
+    Кэширует перечень созданных копий файла name, заменяя отметку об их
+    отсутствии.
+    """
+    cache.set(VARIANTS_KEY % name, manifest, VARIANTS_TIMEOUT)
+
+
+def read_manifest(name):
+    try:
+        with default_storage.open(variant_base(name) + '.json') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def get_variants(name):
+    """
+    Перечень готовых копий файла name: из кэша, иначе с диска. None, если
+    копии еще не созданы.
+    """
+    key = VARIANTS_KEY % name
+    manifest = cache.get(key)
+    if manifest is None:
+        manifest = read_manifest(name)
+        if manifest is None:
+            cache.set(key, False, VARIANTS_MISSING_TIMEOUT)
+        else:
+            cache_manifest(name, manifest)
+    return manifest or None
+
+
+def _generate_pending(name):
+    # копии выводятся только на некэшируемой странице объявления, поэтому
+    # кэшированные страницы после их создания не устаревают
+    try:
+        if read_manifest(name) is None:
+            generate_variants(name)
+    finally:
+        _pending.discard(name)
+
+
+def schedule_variants(name):
+    """
+    Ставит создание копий в очередь пула 'variants'. Повторные вызовы для
+    файла, копии которого еще создаются, игнорируются.
+    """
+    if not name or name in _pending:
+        return
+    _pending.add(name)
+    submit(_generate_pending, name, pool='variants')
+
+
+def delete_variants(name):
+    """
+    Удаляет копии файла name вместе с их перечнем.
+    """
+    manifest = read_manifest(name)
+    cache.delete(VARIANTS_KEY % name)
+    if manifest is None:
+        return
+    default_storage.delete(variant_base(name) + '.json')
+    for width in manifest['widths']:
+        for extension in manifest['formats']:
+            default_storage.delete(variant_name(name, width, extension))
+
+
+def picture_sources(name):
+    """
+    Данные для тега <picture>: источники <source> (тип MIME и srcset) в
+    порядке предпочтения, а также srcset и адрес наибольшей копии для тега
+    <img> в формате, который понимают все браузеры. None, если копии еще не
+    созданы (их создание ставится в очередь).
+    """
+    manifest = get_variants(name)
+    if manifest is None:
+        schedule_variants(name)
+        return None
+    srcsets = {extension: ', '.join('%s %sw' % (default_storage.url(
+                variant_name(name, width, extension)), width)
+                for width in manifest['widths'])
+            for extension in manifest['formats']}
+    fallback = manifest['formats'][-1]
+    return {
+            'sources': [{'type': MIME_TYPES[extension], 'srcset': srcsets[extension]}
+                for extension in manifest['formats'][:-1]],
+            'srcset': srcsets[fallback],
+            'src': default_storage.url(variant_name(name, manifest['widths'][-1], fallback)),
+            }
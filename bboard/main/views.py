@@ -1,7 +1,6 @@
 from django.shortcuts import redirect, render
 from django.http import HttpResponse, Http404
-from django.template import TemplateDoesNotExist
-from django.template.loader import get_template
+from django.utils.cache import get_conditional_response
 from django.contrib.auth.views import LoginView, LogoutView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.decorators import login_required
@@ -36,42 +35,112 @@ from django.contrib import messages
 # импорты для контроллера by_rubric - вывод объявлений по рубрикам, 
 # с пагинацией и поиском
 from django.core.paginator import Paginator
-from django.db.models import Q
 from .models import SubRubric, Bb
-from .forms import SearchForm
+from .forms import SearchForm, BbFilterForm
+from .search import search_bbs, get_search_results
+
+# импорты для фильтрации объявлений рубрики по цене и фасетов
+from urllib.parse import urlencode
+from .facets import bucket_label, filter_by_price, get_facets
+
+# импорты для пагинации по ключу и фрагмента бесконечной прокрутки
+from django.conf import settings
+from .pagination import read_cursor, keyset_page
+
+# импорт декоратора кэширования страниц для гостей
+from .caching import cache_anonymous_page, get_rubric_tree
+from .routers import read_replica
 
 # импорт для контроллера profile_bb_required - добавление объявлений
 from .forms import BbForm, AIFormSet
 
+# импорт для контроллера информационных страничек other_page
+from .pages import get_page_template, render_page
+
 # импорт и конфиг логгера
 from loguru import logger
 
+# импорт для контроллера выгрузки объявлений
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from .forms import ExportForm
+from .export import FORMATS, export_lines, export_queryset
+
+# импорт для контроллера сводных замеров производительности
+from django.http import JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from .instrumentation import dump_histograms
+
+# импорт для контроллера изображений заданий captcha из пула
+from captcha.views import captcha_image
+from .captchas import read_image
+
 # импорт для контроллера detail - вывод подробностей об объявлении
 # комментариев к объявлению и формы ввода комментария
 from .models import Comment
 from .forms import UserCommentForm, GuestCommentForm
 
 
+# Наборы записей, выводимые контроллерами. Для каждого из них в модели
+# есть составной индекс, покрывающий и фильтрацию, и сортировку; планы их
+# запросов проверяет команда check_query_plans.
+
+def latest_bbs():
+    """
+    Активные объявления, от новых к старым.
+    """
+    return Bb.objects.filter(is_active=True).select_related('rubric')
+
+
+def rubric_bbs(pk):
+    """
+    Активные объявления рубрики, от новых к старым.
+    """
+    return Bb.objects.filter(is_active=True, rubric=pk).select_related('rubric')
+
+
+def user_bbs(user_pk):
+    """
+    Все объявления пользователя, от новых к старым.
+    """
+    return Bb.objects.filter(author=user_pk).select_related('rubric__super_rubric')
+
+
+def active_comments(pk):
+    """
+    Активные комментарии к объявлению в порядке добавления.
+    """
+    return Comment.objects.filter(bb=pk, is_active=True)
+
+
+@read_replica
+@cache_anonymous_page
 def index(request):
     """
     Главная страничка. Выводится 10 последних объявлений.
     """
-    bbs = Bb.objects.filter(is_active=True)[:10]
+    bbs = latest_bbs()[:10]
     context = {'bbs': bbs}
     return render(request, 'main/index.html', context)
 
 
+@read_replica
 def other_page(request, page):
     """
-    Контроллер многих страничек с объявлениями. 
-    Адрес странички (имя шаблона странички) формируется на основе 
-    URL-параметра page.
+    Контроллер информационных страничек (о сайте и т.п.).
+    Шаблоны страничек находятся в папке main/pages, их список составляется
+    один раз, при запуске сайта; имя шаблона странички совпадает
+    с URL-параметром page. Ответ снабжается заголовком ETag, при совпадении
+    которого с присланным браузером возвращается код 304.
     """
-    try:
-        template = get_template('main/' + page + '.html')
-    except TemplateDoesNotExist:
+    template = get_page_template(page)
+    if template is None:
         raise Http404
-    return HttpResponse(template.render(request=request))
+    content, etag = render_page(request, page, template)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(content)
+    response['ETag'] = etag
+    return response
 
 
 class BBLoginView(LoginView):
@@ -86,7 +155,7 @@ def profile(request):
     """
     Страничка профиля. Вывод всех объявлений текущего пользователя.
     """
-    bbs = Bb.objects.filter(author=request.user.pk)
+    bbs = user_bbs(request.user.pk)
     context = {'bbs': bbs}
     return render(request, 'main/profile.html', context)
 
@@ -190,38 +259,189 @@ class DeleteUserView(LoginRequiredMixin, DeleteView):
         return get_object_or_404(queryset, pk=self.user_id)
 
 
+# количество объявлений на одной странице (в одной порции) рубрики
+BBS_PER_PAGE = 2
+
+# количество комментариев в одной порции на страничке объявления
+COMMENTS_PER_PAGE = 20
+
+
+# порядок вывода объявлений рубрики: поле сортировки и признак убывания;
+# без явного выбора найденные объявления упорядочиваются по релевантности
+BB_SORTS = {
+        'new': ('created_at', True),
+        'price': ('price', False),
+        '-price': ('price', True),
+        }
+
+
+@read_replica
+@cache_anonymous_page(rubric_kwarg='pk')
 def by_rubric(request, pk):
     """
-    Вывод списка всех обяъвлений рубрики, с пагинацией и фильтрацией 
-    в полях заголовка и описания по искомому слову.
-    """
-    rubric = get_object_or_404(SubRubric.objects, pk=pk)
-    bbs = Bb.objects.filter(is_active=True, rubric=pk)
-    if 'keyword' in request.GET:
-        keyword = request.GET['keyword']
-        q = Q(title__icontains=keyword) | Q(content__icontains=keyword)
-        bbs = bbs.filter(q)
-    else:
-        keyword = ''
-    form = SearchForm(initial={'keyword': keyword})
-    paginator = Paginator(bbs, 2)
-    if 'page' in request.GET:
-        page_num = request.GET['page']
+    Вывод списка всех обяъвлений рубрики, с пагинацией и полнотекстовым
+    поиском по заголовку и описанию. Найденные объявления упорядочиваются
+    по релевантности.
+
+    Объявления фильтруются по ценовому интервалу (фасету) и диапазону цен
+    и сортируются по дате или цене. Количество объявлений в каждом ценовом
+    интервале рубрики берется из сводной таблицы фасетов.
+
+    В режиме пагинации по ключу (параметр cursor или настройка
+    BBS_PAGINATION_MODE = 'keyset') объявления выводятся порциями, а
+    искомое слово и фильтры хранятся в курсоре.
+    """
+    rubric = get_object_or_404(SubRubric.objects.select_related('super_rubric'), pk=pk)
+    keyset = 'cursor' in request.GET or settings.BBS_PAGINATION_MODE == 'keyset'
+    cursor_data = read_cursor(request.GET.get('cursor'))
+    filters = {}
+    if cursor_data:
+        filters = cursor_filters(cursor_data)
+    elif request.GET:
+        filter_form = BbFilterForm(request.GET)
+        if filter_form.is_valid():
+            filters = filter_form.get_filters()
+    form = BbFilterForm(initial=filters)
+    context = {'rubric': rubric, 'form': form,
+            'facets': rubric_facets(pk, filters)}
+    if keyset:
+        page = rubric_keyset_page(pk, filters, cursor_data)
+        context['next_cursor'] = page.next_cursor
     else:
-        page_num = 1
-    page = paginator.get_page(page_num)
-    context = {'rubric': rubric, 'page': page, 'bbs': page.object_list, 'form': form}
+        bbs = filter_by_price(rubric_bbs(pk), filters.get('bucket'),
+                filters.get('price_min'), filters.get('price_max'))
+        sort = filters.get('sort')
+        if sort:
+            field, descending = BB_SORTS[sort]
+            bbs = search_bbs(bbs, filters.get('keyword', ''), ranked=False)
+            bbs = bbs.order_by(*(('-' + field, '-pk') if descending else (field, 'pk')))
+        else:
+            bbs = search_bbs(bbs, filters.get('keyword', ''))
+        paginator = Paginator(bbs, BBS_PER_PAGE)
+        if 'page' in request.GET:
+            page_num = request.GET['page']
+        else:
+            page_num = 1
+        page = paginator.get_page(page_num)
+        context['page'] = page
+    context['bbs'] = page.object_list
+    if filters.get('keyword') and not context['bbs']:
+        context['suggestion'] = form.get_suggestion()
     return render(request, 'main/by_rubric.html', context)
 
 
+@read_replica
+@cache_anonymous_page(rubric_kwarg='pk')
+def by_rubric_more(request, pk):
+    """
+    Фрагмент HTML со следующей порцией объявлений рубрики для бесконечной
+    прокрутки. Курсор следующей порции передается в заголовке X-Next-Cursor,
+    пустой заголовок означает, что объявлений больше нет.
+    """
+    cursor_data = read_cursor(request.GET.get('cursor'))
+    page = rubric_keyset_page(pk, cursor_filters(cursor_data), cursor_data)
+    context = {'bbs': page.object_list}
+    response = render(request, 'main/by_rubric_items.html', context)
+    response['X-Next-Cursor'] = page.next_cursor
+    return response
+
+
+def cursor_filters(cursor_data):
+    """
+    Искомое слово и фильтры, сохраненные в курсоре.
+    """
+    return {name: cursor_data[name] for name in BbFilterForm.base_fields
+            if name in cursor_data}
+
+
+def rubric_keyset_page(pk, filters, cursor_data):
+    """
+    Порция активных объявлений рубрики, следующая за позицией курсора.
+    """
+    bbs = filter_by_price(rubric_bbs(pk), filters.get('bucket'),
+            filters.get('price_min'), filters.get('price_max'))
+    bbs = search_bbs(bbs, filters.get('keyword', ''), ranked=False)
+    field, descending = BB_SORTS[filters.get('sort') or 'new']
+    return keyset_page(bbs, cursor_data, BBS_PER_PAGE, descending, field, **filters)
+
+
+def rubric_facets(pk, filters):
+    """
+    Ценовые интервалы рубрики с количеством активных объявлений в каждом
+    и ссылками, выбирающими интервал с сохранением остальных фильтров.
+    Количество не учитывает искомое слово и прочие фильтры: оно берется
+    из сводной таблицы и не требует запросов к объявлениям.
+    """
+    counts = get_facets().get(pk, ())
+    facets = []
+    for bucket, count in enumerate(counts):
+        if not count:
+            continue
+        params = {name: value for name, value in filters.items() if name != 'bucket'}
+        active = filters.get('bucket') == bucket
+        if not active:
+            params['bucket'] = bucket
+        facets.append({'label': bucket_label(bucket), 'count': count,
+            'active': active, 'query': urlencode(params)})
+    return facets
+
+
+# количество объявлений на одной странице общего поиска
+SEARCH_PER_PAGE = 20
+
+
+@read_replica
+@cache_anonymous_page
+def search(request):
+    """
+    Поиск по объявлениям всех рубрик. Найденные объявления упорядочиваются
+    по релевантности и группируются по надрубрикам; параметр group
+    оставляет объявления одной надрубрики.
+
+    Ключи найденных объявлений кэшируются в памяти процесса (см.
+    get_search_results()), поэтому при повторном запросе той же фразы из
+    БД выбираются только объявления выводимой страницы, по ключам. Там же
+    хранится подсказка "Возможно, вы искали" для фразы с опечаткой.
+    """
+    form = SearchForm(request.GET)
+    keyword = form.cleaned_data['keyword'] if form.is_valid() else ''
+    results = get_search_results(keyword)
+    super_rubrics = {node.pk: node.name for node in get_rubric_tree()}
+    groups = [{'pk': pk, 'name': super_rubrics.get(pk, ''), 'count': count}
+            for pk, count in results.group_counts()]
+    params = {'keyword': keyword}
+    ids = results.ids
+    if request.GET.get('group', '').isdigit():
+        group = int(request.GET['group'])
+        ids = results.in_group(group)
+        params['group'] = group
+    page = Paginator(ids, SEARCH_PER_PAGE).get_page(request.GET.get('page'))
+    page_ids = list(page.object_list)
+    found = Bb.objects.select_related('rubric__super_rubric').in_bulk(page_ids)
+    # объявления страницы по надрубрикам, в порядке релевантности
+    sections = {}
+    for pk in page_ids:
+        if pk in found:
+            bb = found[pk]
+            sections.setdefault(bb.rubric.super_rubric_id, []).append(bb)
+    context = {'form': form, 'query': keyword, 'total': len(results),
+            'fuzzy': results.fuzzy, 'suggestion': results.suggestion,
+            'groups': groups, 'group': params.get('group'), 'page': page,
+            'sections': [{'name': super_rubrics.get(pk, ''), 'bbs': bbs}
+                for pk, bbs in sections.items()],
+            'search_url': '?' + urlencode(params)}
+    return render(request, 'main/search.html', context)
+
+
+@read_replica
 def detail(request, rubric_pk, pk):
     """
     Отдельная страничка объявления. Вывод комментариев к объявлению.
     Форма ввода новых комментариев.
     """
-    bb = get_object_or_404(Bb, pk=pk)
-    ais = bb.additionalimage_set.all()
-    comments = Comment.objects.filter(bb=pk, is_active=True)
+    bb = get_object_or_404(Bb.objects.select_related('rubric'), pk=pk)
+    # по счетчику иллюстраций пустая выборка не запрашивается
+    ais = bb.additionalimage_set.all() if bb.images_count else ()
     initial = {'bb': bb.pk}
     if request.user.is_authenticated:
         initial['author'] = request.user.username
@@ -237,10 +457,34 @@ def detail(request, rubric_pk, pk):
         else:
             form = c_form
             messages.add_message(request, messages.WARNING, 'Комментарий не добавлен')
-    context = {'bb': bb, 'ais': ais, 'comments': comments, 'form': form}
+    comments = comments_page(pk, {})
+    context = {'bb': bb, 'ais': ais, 'form': form,
+            'comments': comments.object_list, 'comments_cursor': comments.next_cursor}
     return render(request, 'main/detail.html', context)
 
 
+@read_replica
+def comments_more(request, rubric_pk, pk):
+    """
+    Фрагмент HTML со следующей порцией комментариев к объявлению.
+    Курсор следующей порции передается в заголовке X-Next-Cursor.
+    """
+    comments = comments_page(pk, read_cursor(request.GET.get('cursor')))
+    context = {'comments': comments.object_list}
+    response = render(request, 'main/comment_items.html', context)
+    response['X-Next-Cursor'] = comments.next_cursor
+    return response
+
+
+def comments_page(pk, cursor_data):
+    """
+    Порция активных комментариев к объявлению в порядке добавления.
+    Выборка идет по составному индексу (bb, is_active, created_at, id),
+    поэтому ее стоимость не зависит от общего числа комментариев.
+    """
+    return keyset_page(active_comments(pk), cursor_data, COMMENTS_PER_PAGE, descending=False)
+
+
 @login_required
 def profile_bb_detail(request, pk):
     """
@@ -249,9 +493,9 @@ def profile_bb_detail(request, pk):
     Отображает также комментарии, форму для комментариев, кнопки удаления 
     и редактирования.
     """
-    bb = get_object_or_404(Bb, pk=pk)
-    ais = bb.additionalimage_set.all()
-    comments = Comment.objects.filter(bb=pk, is_active=True)
+    bb = get_object_or_404(Bb.objects.select_related('rubric'), pk=pk)
+    # по счетчику иллюстраций пустая выборка не запрашивается
+    ais = bb.additionalimage_set.all() if bb.images_count else ()
     initial = {'bb': bb.pk}
     initial['author'] = request.user.username
     form_class = UserCommentForm
@@ -264,7 +508,9 @@ def profile_bb_detail(request, pk):
         else:
             form = c_form
             messages.add_message(request, messages.WARNING, 'Комментарий не добавлен')
-    context = {'bb': bb, 'ais': ais, 'comments': comments, 'form': form}
+    comments = comments_page(pk, {})
+    context = {'bb': bb, 'ais': ais, 'form': form,
+            'comments': comments.object_list, 'comments_cursor': comments.next_cursor}
     return render(request, 'main/detail_user_registered.html', context)
 
 
@@ -304,8 +550,6 @@ def profile_bb_change(request, pk):
         if form.is_valid():
             logger.debug("form valid (debug)")
             bb = form.save()
-            logger.debug(f"request.POST is {request.POST}(debug)")
-            logger.debug(f"request.FILES is {request.FILES}(debug)")
             formset = AIFormSet(request.POST, request.FILES, instance=bb)
             if formset.is_valid():
                 logger.debug("formset valid (debug)")
@@ -334,3 +578,50 @@ def profile_bb_delete(request, pk):
     else:
         context = {'bb': bb}
         return render(request, 'main/profile_bb_delete.html', context)
+
+
+@read_replica
+def export_bbs(request):
+    """
+    Выгрузка активных объявлений в формате JSON Lines или CSV (параметр
+    format), при необходимости - одной рубрики (rubric) и за промежуток
+    времени (since, until). Выгрузка передается клиенту по мере чтения из
+    БД, без накопления в памяти.
+    """
+    form = ExportForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text(),
+                content_type='text/plain; charset=utf-8')
+    data = form.cleaned_data
+    queryset = export_queryset(data['rubric'], data['since'], data['until'])
+    # записи читаются уже после выхода из контроллера, поэтому выбранная
+    # маршрутизатором БД закрепляется за набором записей заранее
+    queryset = queryset.using(queryset.db)
+    content_type, lines, extension = FORMATS[data['format']]
+    response = StreamingHttpResponse(export_lines(queryset, data['format']),
+            content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="bbs.%s"' % extension
+    return response
+
+
+@staff_member_required
+def perf_stats(request):
+    """
+    Сводные замеры обработки запросов по контроллерам, накопленные этим
+    процессом, в формате JSON. Параметр reset сбрасывает накопленные
+    данные после выдачи. Доступно только персоналу.
+    """
+    stats = dump_histograms(reset='reset' in request.GET)
+    return JsonResponse(stats, json_dumps_params={'ensure_ascii': False, 'indent': 2})
+
+
+def pooled_captcha_image(request, key, scale=1):
+    """
+    Изображение задания captcha. Изображения заданий пула нарисованы
+    заранее и отдаются из кэша или хранилища; остальные задания рисует
+    контроллер django-simple-captcha.
+    """
+    content = read_image(key, scale)
+    if content is None:
+        return captcha_image(request, key, scale)
+    return HttpResponse(content, content_type='image/png')